@@ -0,0 +1,259 @@
+"""
+Admission control in front of the sync gunicorn workers.
+
+Each sync worker serves one request at a time, so under a spike requests wait
+in nginx and the listen backlog. By the time a worker picks one up, its client
+may have given up. nginx stamps every request with X-Request-Start (see
+nginx/django-api.conf), so AdmissionControlMiddleware knows how long each
+request waited before a worker got to it.
+
+Every worker publishes its in-flight count, an EWMA of that queue delay and
+its counters in its own slot of a small memory-mapped file. Only the owner
+writes a slot, so no cross-process locking is needed on the request path. A
+request is shed with 503 and Retry-After when every live worker is busy and
+the shared queue delay (the highest worker EWMA) exceeds the target for the
+request's priority:
+
+    low       list and sync reads and availability checks, which clients
+              retry or refresh anyway
+    normal    other reads
+    critical  writes and auth
+
+Low priority is shed first, critical last. A request is also dropped, whatever
+its priority, once its deadline has passed: X-Request-Deadline (unix time, if
+the client sends it), else DEFAULT_DEADLINE_SECONDS after X-Request-Start.
+Health checks and metrics routes are never shed.
+
+Counters are cumulative per worker slot; /api/metrics/admission/ sums them
+over live workers, and rates come from two successive reads.
+"""
+import fcntl
+import mmap
+import os
+import struct
+import threading
+import time
+from pathlib import Path
+
+from django.conf import settings
+
+PRIORITIES = ('low', 'normal', 'critical')
+OUTCOMES = ('admitted', 'shed', 'expired')
+
+DEFAULTS = {
+    'ENABLED': True,
+    'LOCATION': None,
+    'MAX_WORKERS': 16,
+    # Shared queue delay (ms) above which each priority is shed
+    'TARGET_QUEUE_MS': {'low': 250, 'normal': 1000, 'critical': 5000},
+    'EWMA_WEIGHT': 0.3,
+    'DEFAULT_DEADLINE_SECONDS': 60,
+    'RETRY_AFTER': 5,
+    # Busy slots not updated for this long belong to a dead worker (gunicorn's timeout)
+    'STALE_SECONDS': 300,
+    'LOW_PRIORITY_ROUTES': [
+        'posts-list-create', 'comments-list-create', 'profile-posts', 'tags-posts', 'mentions-list',
+        'notifications-list', 'sync', 'auth-availability',
+    ],
+    'EXEMPT_ROUTES': ['hello', 'metrics-cache', 'metrics-memory', 'metrics-queries', 'metrics-profiles',
+                      'metrics-profile-detail', 'metrics-admission'],
+}
+
+# pid, in flight, queue delay EWMA (ms), updated at, started at,
+# then admitted, shed and expired counters per priority
+SLOT = struct.Struct('<iIddd9Q')
+_HEAD = struct.Struct('<iIddd')
+
+_SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'ADMISSION', {})}
+
+
+def _location(config):
+    location = config['LOCATION']
+    return Path(location) if location else Path(settings.BASE_DIR) / 'persistent' / 'cache' / 'admission.shm'
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class Board:
+    """
+    This process's view of the shared file: its own slot plus everyone's
+    """
+
+    def __init__(self, path, max_workers):
+        self.path = Path(path)
+        self.max_workers = max_workers
+        self.size = SLOT.size * max_workers
+        self.pid = os.getpid()
+        self.lock = threading.Lock()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.lockf(fd, fcntl.LOCK_EX)
+            if os.fstat(fd).st_size != self.size:
+                os.ftruncate(fd, 0)
+                os.ftruncate(fd, self.size)
+            self.map = mmap.mmap(fd, self.size)
+            self.offset = self._claim()
+        finally:
+            os.close(fd)
+
+    def _claim(self):
+        free = None
+        for index in range(self.max_workers):
+            offset = index * SLOT.size
+            pid = _HEAD.unpack_from(self.map, offset)[0]
+            if pid == self.pid:
+                free = offset
+                break
+            if free is None and (pid == 0 or not _alive(pid)):
+                free = offset
+        if free is None:
+            # More processes than slots: share the last one, counters stay approximate
+            free = (self.max_workers - 1) * SLOT.size
+        SLOT.pack_into(self.map, free, self.pid, 0, 0.0, time.time(), time.time(), *[0] * 9)
+        return free
+
+    def slots(self, stale_after=None):
+        """
+        Unpacked slots of live processes, leaving out those not updated for
+        stale_after seconds (a pid reused by another program)
+        """
+        oldest = time.time() - stale_after if stale_after else 0
+        slots = []
+        for index in range(self.max_workers):
+            slot = SLOT.unpack_from(self.map, index * SLOT.size)
+            if slot[0] == self.pid or (slot[0] and slot[3] >= oldest and _alive(slot[0])):
+                slots.append(slot)
+        return slots
+
+    def enter(self, queue_delay_ms, weight):
+        with self.lock:
+            _, in_flight, ewma, _, started = _HEAD.unpack_from(self.map, self.offset)
+            ewma = queue_delay_ms if not ewma else weight * queue_delay_ms + (1 - weight) * ewma
+            _HEAD.pack_into(self.map, self.offset, self.pid, in_flight + 1, ewma, time.time(), started)
+
+    def queue_delay(self):
+        return _HEAD.unpack_from(self.map, self.offset)[2]
+
+    def leave(self):
+        with self.lock:
+            in_flight = struct.unpack_from('<I', self.map, self.offset + 4)[0]
+            struct.pack_into('<I', self.map, self.offset + 4, max(0, in_flight - 1))
+
+    def count(self, outcome, priority):
+        # Counters follow the head: admitted, shed, expired, each per priority
+        position = OUTCOMES.index(outcome) * 3 + PRIORITIES.index(priority)
+        offset = self.offset + _HEAD.size + position * 8
+        with self.lock:
+            struct.pack_into('<Q', self.map, offset, struct.unpack_from('<Q', self.map, offset)[0] + 1)
+
+
+_boards = {}
+_boards_lock = threading.Lock()
+
+
+def board(config=None):
+    config = config or get_config()
+    key = (config['LOCATION'], config['MAX_WORKERS'])
+    current = _boards.get(key)
+    if current is None or current.pid != os.getpid():
+        with _boards_lock:
+            current = _boards.get(key)
+            # A forked worker claims a slot of its own
+            if current is None or current.pid != os.getpid():
+                current = _boards[key] = Board(_location(config), config['MAX_WORKERS'])
+    return current
+
+
+def priority(route_name, method, config):
+    if route_name in config['EXEMPT_ROUTES']:
+        return None
+    if method not in _SAFE_METHODS:
+        return 'critical'
+    if route_name in config['LOW_PRIORITY_ROUTES']:
+        return 'low'
+    return 'critical' if (route_name or '').startswith('auth-') else 'normal'
+
+
+def header_time(value):
+    # nginx sends "t=<seconds>.<milliseconds>"
+    if not value:
+        return None
+    try:
+        return float(value[2:] if value.startswith('t=') else value)
+    except ValueError:
+        return None
+
+
+def decide(request_start, deadline, level, config, now=None):
+    """
+    'admit', 'shed' or 'expired' for a request of priority `level` that nginx
+    received at request_start (None if unknown), updating the shared state
+    """
+    now = time.time() if now is None else now
+    shared = board(config)
+    queue_delay_ms = max(0.0, (now - request_start) * 1000) if request_start else 0.0
+    if deadline is None and request_start:
+        deadline = request_start + config['DEFAULT_DEADLINE_SECONDS']
+    if deadline is not None and deadline <= now:
+        shared.count('expired', level)
+        return 'expired'
+
+    shared.enter(queue_delay_ms, config['EWMA_WEIGHT'])
+    others = [slot for slot in shared.slots(config['STALE_SECONDS']) if slot[0] != shared.pid]
+    # Idle workers' averages are stale; an idle worker would have taken this request anyway
+    if all(slot[1] for slot in others):
+        pressure = max([shared.queue_delay()] + [slot[2] for slot in others])
+        if pressure > config['TARGET_QUEUE_MS'][level]:
+            shared.leave()
+            shared.count('shed', level)
+            return 'shed'
+    shared.count('admitted', level)
+    return 'admit'
+
+
+def finish(config=None):
+    board(config).leave()
+
+
+def snapshot():
+    """
+    Live workers' state and counters summed per priority
+    """
+    config = get_config()
+    slots = board(config).slots()
+    totals = {
+        outcome: {level: 0 for level in PRIORITIES} for outcome in OUTCOMES
+    }
+    workers = []
+    for pid, in_flight, ewma, updated_at, started_at, *counters in slots:
+        workers.append({
+            'pid': pid, 'in_flight': in_flight, 'queue_delay_ms': round(ewma, 3),
+            'updated_at': updated_at, 'started_at': started_at,
+        })
+        for position, value in enumerate(counters):
+            totals[OUTCOMES[position // 3]][PRIORITIES[position % 3]] += value
+    return {
+        'workers': workers,
+        'in_flight': sum(worker['in_flight'] for worker in workers),
+        'queue_delay_ms': max((worker['queue_delay_ms'] for worker in workers), default=0.0),
+        'targets_ms': config['TARGET_QUEUE_MS'],
+        **totals,
+        'shed_ratio': {
+            level: round(totals['shed'][level] / requests, 4) if requests else 0.0
+            for level in PRIORITIES
+            for requests in [totals['admitted'][level] + totals['shed'][level]]
+        },
+    }
@@ -4,3 +4,15 @@ from django.apps import AppConfig
 class ApiConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "api"
+
+    def ready(self):
+        from django.core.signals import request_finished
+        from django.db.backends.signals import connection_created
+
+        from . import likes, notifications, querylog
+
+        if querylog.get_config()['ENABLED']:
+            connection_created.connect(querylog.install, dispatch_uid='api.querylog')
+        # Runs once the response has been sent
+        request_finished.connect(likes.flush_if_due, dispatch_uid='api.likes')
+        request_finished.connect(notifications.deliver_pending, dispatch_uid='api.notifications')
@@ -0,0 +1,146 @@
+"""
+Hot/cold archival of old posts and their comments.
+
+archive_posts() moves posts older than ARCHIVE['AFTER_DAYS'] into posts_archive
+and comments_archive. It works oldest first, in small batches. Each batch
+copies the rows and deletes the originals (through api.batching, so derived
+rows such as post_scores go too) in one short transaction, then pauses so
+writers can get in. The hot tables therefore only hold recent content, and
+reads of old ids fall back to the archive (see ChainedQuerySets and the post
+and comment views).
+
+Only posts and comments are copied. Everything else hanging off a post is
+deleted with it (DROPPED): its likes (the count is kept in
+posts_archive.likes_count, but liked_by_me is false and the post can no
+longer be liked or unliked), its notifications (their recipients' cached
+unread counts are dropped to be recounted), its score in the hot ranking,
+and its tag and mention rows, so archived posts leave the tag, mention and
+notification feeds.
+"""
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.shortcuts import get_object_or_404
+from django.utils import timezone
+
+from . import notifications
+from .batching import batch_delete
+from .models import ArchivedComment, ArchivedPost, Comment, Like, Mention, Notification, Post, PostScore, PostTag
+
+DEFAULTS = {
+    'AFTER_DAYS': 365,
+    'BATCH_SIZE': 200,
+    'PAUSE': 0.05,
+    'INTERVAL': 3600,
+}
+
+
+# Rows referencing archived posts or comments that are deleted, not copied
+DROPPED = (Like, Mention, Notification, PostScore, PostTag)
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'ARCHIVE', {})}
+
+
+def _archive_batch(post_ids):
+    now = timezone.now()
+    with transaction.atomic():
+        rows = list(Post.objects.filter(id__in=post_ids).values(
+            'id', 'author_id', 'content', 'likes_count', 'created_at', 'updated_at'
+        ))
+        ArchivedPost.objects.bulk_create(
+            [ArchivedPost(archived_at=now, **row) for row in rows],
+            ignore_conflicts=True,
+        )
+        ArchivedComment.objects.bulk_create(
+            [
+                ArchivedComment(**row)
+                for row in Comment.objects.filter(post_id__in=post_ids).values(
+                    'id', 'post_id', 'author_id', 'parent_id', 'path', 'depth', 'content', 'created_at',
+                    'updated_at'
+                )
+            ],
+            ignore_conflicts=True,
+        )
+        batch_delete(Post, post_ids, batch_size=len(post_ids))
+    # Their notifications are gone with them
+    notifications.forget_unread(row['author_id'] for row in rows)
+
+
+def archive_posts(after_days=None, batch_size=None, pause=None, limit=None):
+    """
+    Move posts older than after_days (and their comments) to the archive tables.
+
+    Returns the number of posts archived.
+    """
+    config = get_config()
+    after_days = config['AFTER_DAYS'] if after_days is None else after_days
+    batch_size = batch_size or config['BATCH_SIZE']
+    pause = config['PAUSE'] if pause is None else pause
+
+    cutoff = timezone.now() - timedelta(days=after_days)
+    candidates = Post.objects.filter(created_at__lt=cutoff).order_by('created_at').values_list('id', flat=True)
+
+    archived = 0
+    while limit is None or archived < limit:
+        size = batch_size if limit is None else min(batch_size, limit - archived)
+        batch = list(candidates[:size])
+        if not batch:
+            break
+        _archive_batch(batch)
+        archived += len(batch)
+        if pause:
+            time.sleep(pause)
+    return archived
+
+
+def get_post_or_archived(post_id):
+    """
+    Post by id from the hot table, falling back to the archive; raises Http404
+    """
+    post = Post.objects.select_related('author').filter(id=post_id).first()
+    if post is None:
+        post = get_object_or_404(ArchivedPost.objects.select_related('author'), id=post_id)
+    return post
+
+
+class ChainedQuerySets:
+    """
+    Read-only sequence over querysets concatenated in order, for pagination.
+
+    Used to page through recent (hot) rows and then continue into the archive;
+    only the querysets that overlap the requested slice are queried.
+    """
+
+    def __init__(self, *querysets):
+        self.querysets = querysets
+        self._counts = None
+
+    def _get_counts(self):
+        if self._counts is None:
+            self._counts = [queryset.count() for queryset in self.querysets]
+        return self._counts
+
+    def count(self):
+        return sum(self._get_counts())
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        start = index.start or 0
+        stop = self.count() if index.stop is None else index.stop
+        rows = []
+        offset = 0
+        for queryset, size in zip(self.querysets, self._get_counts()):
+            if start < offset + size and stop > offset:
+                rows.extend(queryset[max(start - offset, 0):min(stop - offset, size)])
+            offset += size
+            if offset >= stop:
+                break
+        return rows
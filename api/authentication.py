@@ -11,13 +11,7 @@ class CookieAuthentication(BaseAuthentication):
     """
 
     def authenticate(self, request):
-        session_token = request.COOKIES.get('sessionid')
-        
-        if not session_token:
-            return None
-        
-        # Get member_id from cache using session_token
-        member_id = cache.get(f'session_{session_token}')
+        member_id = session_member_id(request)
         
         if not member_id:
             return None
@@ -30,6 +24,17 @@ class CookieAuthentication(BaseAuthentication):
         return (member, None)
 
 
+def session_member_id(request):
+    """
+    Member id of the request's session, from the cache only (no DB query);
+    None without a valid session
+    """
+    session_token = request.COOKIES.get('sessionid')
+    if not session_token:
+        return None
+    return cache.get(f'session_{session_token}')
+
+
 def create_session(member):
     """
     Create a session token for a member and store it in cache
@@ -0,0 +1,196 @@
+"""
+Username and email availability checks that rarely touch the database.
+
+The register form asks /api/auth/availability/ on every keystroke. Each worker
+keeps a Bloom filter of all lowercased usernames and emails, built on its first
+lookup. A value the filter has never seen is certainly free, whatever its case,
+and is answered from memory. Only a "maybe taken" answer, a real member or a
+false positive (FALSE_POSITIVE_RATE), runs the same exact-match query as
+RegisterSerializer.
+
+RegisterSerializer.create() adds the new member to the filter of the worker
+that serves it and bumps a generation counter in the shared default cache.
+The other workers see the new generation on their next lookup and add the
+members created since their last look (one primary key range query). Nothing
+is ever removed from a Bloom filter, so renamed or deleted members keep
+answering "maybe" until the filter is rebuilt from the table, in a background
+thread, every REBUILD_INTERVAL seconds or once it holds more values than it
+was sized for. Members created without RegisterSerializer (admin, bulk
+imports) are picked up by the next catch-up or rebuild.
+"""
+import hashlib
+import logging
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+
+from .models import Member
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'FALSE_POSITIVE_RATE': 0.001,
+    'REBUILD_INTERVAL': 900,
+    # Members the filter is sized for: GROWTH times the current count, for
+    # registrations between rebuilds, and at least MIN_CAPACITY
+    'MIN_CAPACITY': 10000,
+    'GROWTH': 2,
+}
+
+GENERATION_KEY = 'availability:generation'
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'AVAILABILITY', {})}
+
+
+def _shared_generation():
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        # Never set, or evicted: restart it, so every worker catches up once
+        cache.add(GENERATION_KEY, 0, timeout=None)
+        generation = cache.get(GENERATION_KEY)
+    return generation
+
+
+class BloomFilter:
+    def __init__(self, capacity, false_positive_rate):
+        self.capacity = capacity
+        self.size = max(8, int(-capacity * math.log(false_positive_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, value):
+        digest = hashlib.blake2b(value.encode(), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+        return [(first + index * second) % self.size for index in range(self.hashes)]
+
+    def add(self, value):
+        for position in self._positions(value):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, value):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(value))
+
+
+def _keys(username=None, email=None):
+    keys = []
+    if username is not None:
+        keys.append(('username', f'u:{username.lower()}'))
+    if email is not None:
+        keys.append(('email', f'e:{email.lower()}'))
+    return keys
+
+
+class AvailabilityIndex:
+    """
+    Per-worker Bloom filter over members' usernames and emails
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.filter = None
+        self.max_id = 0
+        self.generation = None
+        self.built_at = 0.0
+        self.rebuilding = False
+
+    def _build(self):
+        """
+        A filter and the highest member id in it, from the members table
+        """
+        config = get_config()
+        capacity = max(config['MIN_CAPACITY'], Member.objects.count() * config['GROWTH'])
+        # Two values per member
+        bloom = BloomFilter(capacity * 2, config['FALSE_POSITIVE_RATE'])
+        max_id = 0
+        rows = Member.objects.order_by().values_list('id', 'username', 'email')
+        for member_id, username, email in rows.iterator(2000):
+            for _, key in _keys(username, email):
+                bloom.add(key)
+            max_id = max(max_id, member_id)
+        return bloom, max_id
+
+    def rebuild(self):
+        generation = _shared_generation()
+        bloom, max_id = self._build()
+        # Registrations after `generation` was read bump it again, so the next
+        # lookup catches up with any member the build missed
+        with self._lock:
+            self.filter, self.max_id, self.generation = bloom, max_id, generation
+            self.built_at = time.monotonic()
+
+    def _rebuild_in_background(self):
+        try:
+            self.rebuild()
+        except Exception:
+            logger.exception('Rebuilding the availability filter failed')
+        finally:
+            self.rebuilding = False
+            connections.close_all()
+
+    def _catch_up(self, generation):
+        with self._lock:
+            max_id = self.max_id
+        added = list(Member.objects.filter(id__gt=max_id).order_by().values_list('id', 'username', 'email'))
+        with self._lock:
+            for member_id, username, email in added:
+                for _, key in _keys(username, email):
+                    self.filter.add(key)
+                self.max_id = max(self.max_id, member_id)
+            self.generation = generation
+
+    def _ensure_current(self):
+        if self.filter is None:
+            self.rebuild()
+            return
+        generation = _shared_generation()
+        if generation != self.generation:
+            self._catch_up(generation)
+        config = get_config()
+        stale = time.monotonic() - self.built_at > config['REBUILD_INTERVAL']
+        if (stale or self.filter.count > self.filter.capacity) and not self.rebuilding:
+            self.rebuilding = True
+            threading.Thread(target=self._rebuild_in_background, daemon=True).start()
+
+    def check(self, username=None, email=None):
+        """
+        {'username': bool, 'email': bool} availability of the given values
+        """
+        self._ensure_current()
+        result = {}
+        for field, key in _keys(username, email):
+            if key not in self.filter:
+                result[field] = True
+                continue
+            lookup = {'username': username} if field == 'username' else {'email': email}
+            result[field] = not Member.objects.filter(**lookup).exists()
+        return result
+
+    def record(self, member):
+        """
+        Add a member created by this worker and tell the others
+        """
+        try:
+            generation = cache.incr(GENERATION_KEY)
+        except ValueError:
+            cache.add(GENERATION_KEY, 1, timeout=None)
+            generation = None
+        with self._lock:
+            if self.filter is None:
+                return
+            for _, key in _keys(member.username, member.email):
+                self.filter.add(key)
+            if generation is not None and self.generation is not None and generation == self.generation + 1:
+                # Nobody else registered in between: no catch-up needed here
+                self.generation = generation
+                self.max_id = max(self.max_id, member.id)
+
+
+index = AvailabilityIndex()
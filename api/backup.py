@@ -0,0 +1,263 @@
+"""
+Online SQLite snapshots with the backup API.
+
+Copying db.sqlite3 while workers write to it can capture a torn file, and a
+single-step backup or a dump holds a read lock that keeps writers waiting
+until it is done. copy_online() instead copies PAGES_PER_STEP pages per
+sqlite3_backup_step() call and sleeps STEP_SLEEP seconds between steps.
+
+In WAL mode (the application database, see DATABASES) the source connection
+holds one read transaction for the whole copy, so every step reads the same
+snapshot and writers are never blocked. With a rollback journal the source
+is only locked during a step. SQLite restarts the copy whenever another
+connection writes between steps, so each restart doubles the step size, up
+to MAX_PAGES_PER_STEP and then one step. The copy then converges, at the
+cost of locking writers out for longer steps.
+
+Snapshots are gzip files named db-<UTC time>.sqlite3.gz, each with a JSON
+manifest holding the SHA-256 of the compressed file. Only the newest KEEP
+are kept. restore() checks the checksum and PRAGMA integrity_check before
+copying a snapshot over the live database.
+"""
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+from datetime import datetime, timezone as dt_timezone
+from pathlib import Path
+
+from django.conf import settings
+
+DEFAULTS = {
+    'DIRECTORY': None,
+    'KEEP': 14,
+    'PAGES_PER_STEP': 128,
+    'MAX_PAGES_PER_STEP': 16384,
+    'STEP_SLEEP': 0.02,
+    'COMPRESS_LEVEL': 6,
+    'INTERVAL': 6 * 3600,
+}
+
+_SUFFIX = '.sqlite3.gz'
+_NAME_FORMAT = '%Y%m%dT%H%M%SZ'
+_CHUNK = 1024 * 1024
+
+
+class BackupError(Exception):
+    pass
+
+
+class _Restarted(Exception):
+    pass
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'BACKUP', {})}
+
+
+def database_path():
+    return Path(settings.DATABASES['default']['NAME'])
+
+
+def backup_directory():
+    directory = get_config()['DIRECTORY']
+    return Path(directory) if directory else Path(settings.BASE_DIR) / 'persistent' / 'backups'
+
+
+def copy_online(source_path, target_path, pages=None, step_sleep=None):
+    """
+    Copy the database at source_path to target_path while others keep writing.
+
+    Returns {'journal_mode', 'pages', 'steps', 'restarts', 'pages_per_step', 'seconds'}.
+    """
+    config = get_config()
+    pages = pages or config['PAGES_PER_STEP']
+    step_sleep = config['STEP_SLEEP'] if step_sleep is None else step_sleep
+    stats = {'pages': 0, 'steps': 0, 'restarts': 0}
+    started = time.monotonic()
+    source = sqlite3.connect(f'file:{source_path}?mode=ro', uri=True, isolation_level=None)
+    try:
+        stats['journal_mode'] = source.execute('PRAGMA journal_mode').fetchone()[0]
+        if stats['journal_mode'] == 'wal':
+            # Pin one snapshot for every step; WAL writers are not blocked by readers
+            source.execute('BEGIN')
+            source.execute('SELECT COUNT(*) FROM sqlite_master').fetchone()
+        while True:
+            remaining_before = [None]
+
+            def progress(status, remaining, total):
+                stats['steps'] += 1
+                stats['pages'] = total
+                if remaining_before[0] is not None and remaining > remaining_before[0]:
+                    # Another connection wrote to the source: SQLite started over
+                    raise _Restarted()
+                remaining_before[0] = remaining
+                if remaining and step_sleep:
+                    time.sleep(step_sleep)
+
+            target = sqlite3.connect(target_path)
+            try:
+                source.backup(target, pages=pages, progress=progress)
+                break
+            except _Restarted:
+                stats['restarts'] += 1
+                pages = -1 if pages < 0 or pages * 2 > config['MAX_PAGES_PER_STEP'] else pages * 2
+            finally:
+                target.close()
+    finally:
+        source.close()
+    stats['pages_per_step'] = pages
+    stats['seconds'] = round(time.monotonic() - started, 3)
+    return stats
+
+
+def integrity_errors(path):
+    """
+    Problems reported by PRAGMA integrity_check, empty when the database is sound
+    """
+    connection = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    try:
+        rows = [row[0] for row in connection.execute('PRAGMA integrity_check')]
+    except sqlite3.DatabaseError as exc:
+        return [str(exc)]
+    finally:
+        connection.close()
+    return [] if rows == ['ok'] else rows
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(_CHUNK), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _manifest_path(snapshot_path):
+    return Path(str(snapshot_path)[:-len(_SUFFIX)] + '.json')
+
+
+def create_snapshot(source_path=None, directory=None):
+    """
+    Take a compressed, checksummed snapshot and return its manifest
+    """
+    config = get_config()
+    source_path = Path(source_path or database_path())
+    directory = Path(directory or backup_directory())
+    directory.mkdir(parents=True, exist_ok=True)
+    created_at = datetime.now(dt_timezone.utc)
+    name = f'db-{created_at.strftime(_NAME_FORMAT)}{_SUFFIX}'
+    snapshot_path = directory / name
+    if snapshot_path.exists():
+        raise BackupError(f'{snapshot_path} already exists')
+
+    with tempfile.TemporaryDirectory(dir=directory) as scratch:
+        copy_path = Path(scratch) / 'db.sqlite3'
+        stats = copy_online(source_path, copy_path)
+        errors = integrity_errors(copy_path)
+        if errors:
+            raise BackupError(f'Snapshot copy failed the integrity check: {errors[:5]}')
+        partial = Path(scratch) / name
+        with open(copy_path, 'rb') as raw, gzip.open(partial, 'wb', compresslevel=config['COMPRESS_LEVEL']) as packed:
+            shutil.copyfileobj(raw, packed, _CHUNK)
+        manifest = {
+            'name': name,
+            'created_at': created_at.isoformat(),
+            'sha256': _sha256(partial),
+            'bytes': partial.stat().st_size,
+            'database_bytes': copy_path.stat().st_size,
+            **stats,
+        }
+        _manifest_path(snapshot_path).write_text(json.dumps(manifest, indent=2))
+        os.replace(partial, snapshot_path)
+    return manifest
+
+
+def list_snapshots(directory=None):
+    """
+    Manifests of the snapshots in `directory`, oldest first
+    """
+    directory = Path(directory or backup_directory())
+    manifests = []
+    for snapshot_path in directory.glob(f'db-*{_SUFFIX}'):
+        try:
+            manifest = json.loads(_manifest_path(snapshot_path).read_text())
+        except (OSError, ValueError):
+            manifest = {'name': snapshot_path.name, 'created_at': None, 'sha256': None}
+        manifest['path'] = str(snapshot_path)
+        manifests.append(manifest)
+    return sorted(manifests, key=lambda manifest: manifest['name'])
+
+
+def snapshot_at(moment, directory=None):
+    """
+    Manifest of the newest snapshot taken at or before `moment` (aware datetime)
+    """
+    candidates = [
+        manifest for manifest in list_snapshots(directory)
+        if manifest['created_at'] and datetime.fromisoformat(manifest['created_at']) <= moment
+    ]
+    return candidates[-1] if candidates else None
+
+
+def rotate(directory=None, keep=None):
+    """
+    Delete all but the newest `keep` snapshots; returns the names deleted
+    """
+    keep = get_config()['KEEP'] if keep is None else keep
+    snapshots = list_snapshots(directory)
+    expired = snapshots[:max(0, len(snapshots) - keep)]
+    for manifest in expired:
+        Path(manifest['path']).unlink(missing_ok=True)
+        _manifest_path(manifest['path']).unlink(missing_ok=True)
+    return [manifest['name'] for manifest in expired]
+
+
+def verify(snapshot_path, into=None):
+    """
+    Check the checksum and integrity of a snapshot, decompressing it to `into`
+    (a temporary file if None, removed afterwards). Raises BackupError.
+    """
+    snapshot_path = Path(snapshot_path)
+    try:
+        manifest = json.loads(_manifest_path(snapshot_path).read_text())
+    except (OSError, ValueError) as exc:
+        raise BackupError(f'No readable manifest for {snapshot_path.name}: {exc}')
+    if _sha256(snapshot_path) != manifest['sha256']:
+        raise BackupError(f'{snapshot_path.name} does not match its checksum')
+
+    with tempfile.TemporaryDirectory(dir=snapshot_path.parent) as scratch:
+        target = Path(into) if into else Path(scratch) / 'db.sqlite3'
+        try:
+            with gzip.open(snapshot_path, 'rb') as packed, open(target, 'wb') as raw:
+                shutil.copyfileobj(packed, raw, _CHUNK)
+        except (OSError, EOFError) as exc:
+            raise BackupError(f'{snapshot_path.name} cannot be decompressed: {exc}')
+        errors = integrity_errors(target)
+        if errors:
+            raise BackupError(f'{snapshot_path.name} failed the integrity check: {errors[:5]}')
+    return manifest
+
+
+def restore(snapshot_path, target_path=None):
+    """
+    Verify a snapshot, then copy it over the database at target_path in one
+    backup step, so open connections see either the old or the restored
+    database, never a mix.
+    """
+    target_path = Path(target_path or database_path())
+    with tempfile.TemporaryDirectory(dir=Path(snapshot_path).parent) as scratch:
+        restored_path = Path(scratch) / 'db.sqlite3'
+        manifest = verify(snapshot_path, into=restored_path)
+        source = sqlite3.connect(restored_path)
+        target = sqlite3.connect(target_path, timeout=30)
+        try:
+            source.backup(target)
+        finally:
+            target.close()
+            source.close()
+    return manifest
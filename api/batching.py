@@ -0,0 +1,74 @@
+"""
+Batched bulk deletes that bypass Django's deletion collector.
+
+QuerySet.delete() loads every row (and every cascaded row) into memory to send
+signals and compute the cascade. For moderation deletes and archival we only
+need the cascade itself, so it is walked from model metadata and executed as
+plain DELETE ... WHERE pk IN (...) statements, one short transaction per batch.
+"""
+from django.db import models, router, transaction
+from django.db.models.deletion import ProtectedError, RestrictedError
+
+DEFAULT_BATCH_SIZE = 500
+
+
+def chunked(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _delete_m2m_rows(model, pks):
+    for field in model._meta.many_to_many:
+        through = field.remote_field.through
+        through._base_manager.filter(**{f'{field.m2m_field_name()}__in': pks})._raw_delete(
+            router.db_for_write(through)
+        )
+    for rel in model._meta.related_objects:
+        if rel.many_to_many:
+            through = rel.through
+            through._base_manager.filter(**{f'{rel.field.m2m_reverse_field_name()}__in': pks})._raw_delete(
+                router.db_for_write(through)
+            )
+
+
+def _delete_rows(model, pks, batch_size):
+    deleted = 0
+    for rel in model._meta.related_objects:
+        if rel.many_to_many:
+            continue
+        related = rel.related_model._base_manager.filter(**{f'{rel.field.name}__in': pks})
+        on_delete = rel.on_delete
+        if on_delete is models.CASCADE:
+            child_pks = list(related.values_list('pk', flat=True))
+            for chunk in chunked(child_pks, batch_size):
+                cascaded = _delete_rows(rel.related_model, chunk, batch_size)
+                if rel.related_model is model:
+                    # Rows of the same model (e.g. replies) count as deleted rows too
+                    deleted += cascaded
+        elif on_delete is models.SET_NULL:
+            related.update(**{rel.field.name: None})
+        elif on_delete is models.DO_NOTHING:
+            continue
+        elif related.exists():
+            error = RestrictedError if on_delete is models.RESTRICT else ProtectedError
+            raise error(f'{model.__name__} rows are referenced by {rel.related_model.__name__}', set())
+
+    _delete_m2m_rows(model, pks)
+    return deleted + model._base_manager.filter(pk__in=pks)._raw_delete(router.db_for_write(model))
+
+
+def batch_delete(model, pks, batch_size=DEFAULT_BATCH_SIZE, on_batch=None):
+    """
+    Delete rows of `model` with the given primary keys, plus their cascade.
+
+    Each batch runs in its own transaction so writers are never locked out for
+    long. on_batch(pks) is called after every committed batch. Returns the
+    number of `model` rows deleted. Signals are not sent.
+    """
+    deleted = 0
+    for chunk in chunked(list(pks), batch_size):
+        with transaction.atomic(using=router.db_for_write(model)):
+            deleted += _delete_rows(model, chunk, batch_size)
+        if on_batch:
+            on_batch(chunk)
+    return deleted
@@ -0,0 +1,220 @@
+"""
+Versioned cache-aside layer for hot post and comment-thread payloads.
+
+Every cached payload lives under a key that embeds a version number stored
+next to it in the cache. Writers never delete payloads, they bump the version
+so that all readers move to a fresh key at once. Concurrent misses for the
+same key are coalesced: one request rebuilds the payload while the others
+either get the last known (slightly stale) payload or wait for the rebuild.
+
+Threads of one worker coalesce on an in-process lock. Across workers, the
+rebuild lock and the version counters live on LOCK_ALIAS rather than on ALIAS:
+the file based cache that holds the payloads checks and writes in two steps,
+so two workers could both win add(), or both bump a version to the same N+1
+and let a rebuild in between cache stale data under the "new" version. The
+shared memory cache (api/shmcache.py) adds and increments under its stripe
+lock, which makes both atomic for every worker on the host. A lock evicted
+before LOCK_TIMEOUT only costs a duplicate rebuild.
+"""
+import threading
+import time
+import zlib
+
+from django.conf import settings
+from django.core.cache import caches
+
+POST_DETAIL = 'post'
+COMMENT_THREAD = 'comments'
+
+DEFAULTS = {
+    'ENABLED': True,
+    'ALIAS': 'hot',
+    # Rebuild locks and version counters; must have an atomic add() and incr() across processes
+    'LOCK_ALIAS': 'default',
+    'TIMEOUT': 300,
+    'STALE_TIMEOUT': 3600,
+    'LOCK_TIMEOUT': 10,
+    'WAIT_TIMEOUT': 2.0,
+    'POLL_INTERVAL': 0.02,
+}
+
+# Striped locks coalesce concurrent misses from threads of the same worker
+_local_locks = [threading.Lock() for _ in range(64)]
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'API_CACHE', {})}
+
+
+def _cache():
+    return caches[get_config()['ALIAS']]
+
+
+def _local_lock(key):
+    return _local_locks[zlib.crc32(key.encode()) % len(_local_locks)]
+
+
+class CacheStats:
+    """
+    Per-worker counters for the hot cache
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+            self.stale_hits = 0
+            self.coalesced = 0
+            self.rebuilds = 0
+            self.rebuild_seconds = 0.0
+            self.rebuild_max_seconds = 0.0
+
+    def incr(self, name, amount=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    def record_rebuild(self, seconds):
+        with self._lock:
+            self.rebuilds += 1
+            self.rebuild_seconds += seconds
+            self.rebuild_max_seconds = max(self.rebuild_max_seconds, seconds)
+
+    def snapshot(self):
+        with self._lock:
+            # stale_hits and coalesced are misses that were still served from cache
+            served = self.hits + self.stale_hits + self.coalesced
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'stale_hits': self.stale_hits,
+                'coalesced': self.coalesced,
+                'hit_ratio': round(served / lookups, 4) if lookups else None,
+                'rebuilds': self.rebuilds,
+                'rebuild_avg_ms': (
+                    round(self.rebuild_seconds * 1000 / self.rebuilds, 3)
+                    if self.rebuilds else None
+                ),
+                'rebuild_max_ms': round(self.rebuild_max_seconds * 1000, 3),
+            }
+
+
+stats = CacheStats()
+
+
+def _versions():
+    return caches[get_config()['LOCK_ALIAS']]
+
+
+def _version_key(kind, obj_id):
+    # Namespaced by ALIAS: LOCK_ALIAS is shared with sessions and other state
+    return f'{get_config()["ALIAS"]}:{kind}:{obj_id}:version'
+
+
+def _stale_key(kind, obj_id):
+    return f'{kind}:{obj_id}:stale'
+
+
+def _initial_version():
+    # Time-based so that an evicted version counter never resurrects old payloads
+    return int(time.time() * 1000)
+
+
+def get_version(kind, obj_id):
+    cache = _versions()
+    key = _version_key(kind, obj_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, _initial_version(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def bump_version(kind, obj_id):
+    cache = _versions()
+    key = _version_key(kind, obj_id)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        version = _initial_version()
+        cache.set(key, version, timeout=None)
+        return version
+
+
+def _rebuild(cache, kind, obj_id, key, builder, config):
+    started = time.perf_counter()
+    payload = builder()
+    stats.record_rebuild(time.perf_counter() - started)
+    cache.set(key, payload, timeout=config['TIMEOUT'])
+    cache.set(_stale_key(kind, obj_id), payload, timeout=config['STALE_TIMEOUT'])
+    return payload
+
+
+def get_or_build(kind, obj_id, builder):
+    """
+    Return the cached payload for (kind, obj_id), calling builder() on a miss.
+
+    Exceptions raised by builder (e.g. Http404) propagate and nothing is cached.
+    """
+    config = get_config()
+    if not config['ENABLED']:
+        return builder()
+
+    cache = _cache()
+    key = f'{kind}:{obj_id}:v{get_version(kind, obj_id)}'
+    payload = cache.get(key)
+    if payload is not None:
+        stats.incr('hits')
+        return payload
+
+    stats.incr('misses')
+    with _local_lock(key):
+        payload = cache.get(key)
+        if payload is not None:
+            stats.incr('coalesced')
+            return payload
+
+        locks = caches[config['LOCK_ALIAS']]
+        lock_key = f'{config["ALIAS"]}:{key}:lock'
+        if locks.add(lock_key, 1, timeout=config['LOCK_TIMEOUT']):
+            try:
+                return _rebuild(cache, kind, obj_id, key, builder, config)
+            finally:
+                locks.delete(lock_key)
+
+        # Another worker is rebuilding: serve the previous payload if we have one
+        payload = cache.get(_stale_key(kind, obj_id))
+        if payload is not None:
+            stats.incr('stale_hits')
+            return payload
+
+        deadline = time.monotonic() + config['WAIT_TIMEOUT']
+        while time.monotonic() < deadline:
+            time.sleep(config['POLL_INTERVAL'])
+            payload = cache.get(key)
+            if payload is not None:
+                stats.incr('coalesced')
+                return payload
+
+        return _rebuild(cache, kind, obj_id, key, builder, config)
+
+
+def invalidate_comments(post_id):
+    """
+    Called after a comment is created or deleted
+    """
+    bump_version(COMMENT_THREAD, post_id)
+
+
+def invalidate_post(post_id):
+    """
+    Called after a post is deleted; stale copies must not outlive the post
+    """
+    cache = _cache()
+    for kind in (POST_DETAIL, COMMENT_THREAD):
+        bump_version(kind, post_id)
+        cache.delete(_stale_key(kind, post_id))
@@ -0,0 +1,192 @@
+"""
+Pre-rendered JSON of the posts and members on feed pages.
+
+The feed and profile pages show the same recent posts over and over, and
+running them through PostSerializer and the JSON renderer is most of what those
+requests cost. The JSON of each post and each member is cached as bytes under
+a key made of its id and updated_at. An edit moves readers to a new key, so
+nothing is invalidated and old keys age out of the cache. A page reads only
+ids, versions and like counts from the database and fetches the fragments with
+one get_many(). It serializes just the misses and joins the bytes into the
+pagination envelope, without building the page as Python objects first.
+
+likes_count and liked_by_me change without touching updated_at, and
+liked_by_me depends on the viewer, so they are not part of a post's fragment.
+It is stored as the JSON before and after them, and they are written in
+between. The result is byte for byte what PostSerializer and JSONRenderer
+produce.
+
+Only the default shape (no ?fields, ?member_fields or ?shape) is served from
+fragments, and only to clients that negotiate JSON. Hit ratio and the time
+spent serializing misses are reported under "fragments" at /api/metrics/cache/.
+"""
+import json
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import OuterRef, Subquery
+from django.http import HttpResponse
+from django.utils.functional import cached_property
+from rest_framework.renderers import JSONRenderer
+
+from . import likes
+from .caching import CacheStats
+from .models import ArchivedPost, Member, Post
+from .serializers import MemberSerializer, PostSerializer
+
+DEFAULTS = {
+    'ENABLED': True,
+    'ALIAS': 'fragments',
+    'TIMEOUT': 3600,
+}
+
+# Bump when PostSerializer or MemberSerializer output changes, so that a
+# deploy does not serve fragments rendered by the previous code
+FORMAT = 1
+
+# PostSerializer's fields around the per-request ones (author, likes_count, liked_by_me)
+HEAD_FIELDS = ['id', 'content']
+TAIL_FIELDS = ['created_at', 'updated_at']
+
+# What a page reads from the database per post, plus author_updated_at
+VERSION_FIELDS = ('id', 'updated_at', 'likes_count', 'author_id')
+
+_renderer = JSONRenderer()
+
+stats = CacheStats()
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'FRAGMENTS', {})}
+
+
+def applies(request, shape):
+    return get_config()['ENABLED'] and shape.is_default and request.accepted_renderer.format == 'json'
+
+
+def page_values(queryset, *fields, path='', **expressions):
+    """
+    queryset.values() of `fields` plus what a page needs of the post at `path`, e.g. 'post__'
+    """
+    # A subquery rather than a join, so that the paginator's COUNT stays on one table
+    author_updated_at = Subquery(
+        Member.objects.filter(pk=OuterRef(f'{path}author_id')).order_by().values('updated_at')
+    )
+    return queryset.values(
+        *fields, *[f'{path}{name}' for name in VERSION_FIELDS], author_updated_at=author_updated_at, **expressions
+    )
+
+
+def _key(kind, obj_id, updated_at):
+    return f'{kind}:f{FORMAT}:{obj_id}:{updated_at:%Y%m%d%H%M%S%f}'
+
+
+def _render(data):
+    return _renderer.render(data)
+
+
+def _render_posts(posts):
+    data = PostSerializer(posts, many=True, fields=HEAD_FIELDS + TAIL_FIELDS).data
+    return {
+        item['id']: (
+            _render({name: item[name] for name in HEAD_FIELDS})[:-1],
+            _render({name: item[name] for name in TAIL_FIELDS})[1:],
+        )
+        for item in data
+    }
+
+
+def _render_members(members):
+    return {item['id']: _render(item) for item in MemberSerializer(members, many=True).data}
+
+
+def _load_posts(rows):
+    """
+    Posts (with authors) of the page rows that missed, from posts or the archive
+    """
+    live = [row['id'] for row in rows if not row.get('archived')]
+    archived = [row['id'] for row in rows if row.get('archived')]
+    posts = []
+    for model, ids in ((Post, live), (ArchivedPost, archived)):
+        if ids:
+            posts.extend(model.objects.filter(id__in=ids).select_related('author'))
+    return posts
+
+
+def render_items(request, rows):
+    """
+    JSON bytes of each page row (from page_values()), in order, as PostSerializer would render them
+    """
+    config = get_config()
+    cache = caches[config['ALIAS']]
+    post_keys = {row['id']: _key('post', row['id'], row['updated_at']) for row in rows}
+    member_keys = {row['author_id']: _key('member', row['author_id'], row['author_updated_at']) for row in rows}
+    cached = cache.get_many([*post_keys.values(), *member_keys.values()])
+    posts = {post_id: cached[key] for post_id, key in post_keys.items() if key in cached}
+    members = {member_id: cached[key] for member_id, key in member_keys.items() if key in cached}
+    stats.incr('hits', len(posts) + len(members))
+
+    missing = [row for row in rows if row['id'] not in posts]
+    if missing or len(members) < len(member_keys):
+        started = time.perf_counter()
+        loaded = _load_posts(missing)
+        authors = {post.author_id: post.author for post in loaded if post.author_id not in members}
+        others = [member_id for member_id in member_keys if member_id not in members and member_id not in authors]
+        if others:
+            authors.update((member.id, member) for member in Member.objects.filter(id__in=others))
+        fresh = {}
+        rendered_posts = _render_posts(loaded)
+        for post in loaded:
+            fresh[_key('post', post.id, post.updated_at)] = rendered_posts[post.id]
+        rendered_members = _render_members(authors.values())
+        for member in authors.values():
+            fresh[_key('member', member.id, member.updated_at)] = rendered_members[member.id]
+        cache.set_many(fresh, timeout=config['TIMEOUT'])
+        posts.update(rendered_posts)
+        members.update(rendered_members)
+        stats.incr('misses', len(fresh))
+        stats.record_rebuild(time.perf_counter() - started)
+
+    liked = likes.liked_post_ids(request.user, [row['id'] for row in rows])
+    items = []
+    for row in rows:
+        if row['id'] not in posts or row['author_id'] not in members:
+            # Deleted since the page was read
+            continue
+        head, tail = posts[row['id']]
+        items.append(b''.join((
+            head, b',"author":', members[row['author_id']],
+            b',"likes_count":', str(likes.approximate_count(row['id'], row['likes_count'])).encode(),
+            b',"liked_by_me":', b'true' if row['id'] in liked else b'false', b',', tail,
+        )))
+    return items
+
+
+class PageResponse(HttpResponse):
+    """
+    A page rendered from fragments. .data parses it back, for tests and debugging
+    """
+
+    def __init__(self, content):
+        super().__init__(content, content_type='application/json')
+
+    @cached_property
+    def data(self):
+        return json.loads(self.content)
+
+
+def page_response(request, paginator, rows, path=''):
+    """
+    The paginator's usual response for `rows`, with its results rendered from fragments
+    """
+    if path:
+        rows = [
+            {'author_updated_at': row['author_updated_at'], **{name: row[path + name] for name in VERSION_FIELDS}}
+            for row in rows
+        ]
+    envelope = paginator.get_paginated_response([]).data
+    envelope.pop('results')
+    return PageResponse(b''.join((
+        _render(envelope)[:-1], b',"results":[', b','.join(render_items(request, rows)), b']}',
+    )))
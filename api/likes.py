@@ -0,0 +1,200 @@
+"""
+Post likes with write-buffered counters.
+
+The post_likes table holds one row per (post, member) and is the source of
+truth; inserting into it is what makes likes idempotent. posts.likes_count is
+a denormalized, approximate counter. Every worker accumulates +1/-1 deltas in
+memory and flushes them once FLUSH_EVERY likes are pending, after a request
+that finds the oldest pending delta older than FLUSH_INTERVAL, and when the
+worker exits. A flush does not add the deltas: it recounts the posts they
+touched from post_likes, in one UPDATE. A viral post therefore costs one
+counter write per batch instead of one per like, and flushes from several
+workers and reconcile() (which runs in its own process) can interleave in any
+order without counting a like twice.
+
+Error bound: the stored count is the true count as of the last flush or
+reconcile that touched the post. It lags by the likes still buffered in
+workers since then: normally fewer than FLUSH_EVERY per worker, each flushed
+by the worker's next request once older than FLUSH_INTERVAL. While flushes
+fail, the deltas are kept and retried with every new like, so a worker can
+then hold more. Likes buffered by a crashed worker are only counted by the
+post's next flush or by reconcile(), run periodically by
+`manage.py reconcile_like_counts --loop`.
+
+Readers in a worker see its pending deltas added to the stored count. That
+over-counts the worker's own likes if another worker's flush has already
+recounted the post, until its own flush.
+"""
+import logging
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Exists, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from .models import Like, Post
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'FLUSH_EVERY': 50,
+    'FLUSH_INTERVAL': 2.0,
+    'RECONCILE_INTERVAL': 600,
+    'RECONCILE_BATCH_SIZE': 1000,
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'LIKES', {})}
+
+
+def _true_count():
+    counts = Like.objects.filter(post=OuterRef('pk')).order_by().values('post').annotate(n=Count('pk')).values('n')
+    return Coalesce(Subquery(counts), Value(0))
+
+
+class LikeCounter:
+    """
+    Per-worker buffer of likes_count deltas
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.pending = defaultdict(int)
+        self.unflushed = 0
+        self.oldest = None
+        self.flushes = 0
+
+    def add(self, post_id, delta):
+        with self._lock:
+            self.pending[post_id] += delta
+            self.unflushed += 1
+            if self.oldest is None:
+                self.oldest = time.monotonic()
+            due = self.unflushed >= get_config()['FLUSH_EVERY']
+        if due:
+            self.flush()
+
+    def pending_for(self, post_id):
+        return self.pending.get(post_id, 0)
+
+    def flush_if_due(self):
+        oldest = self.oldest
+        if oldest is not None and time.monotonic() - oldest >= get_config()['FLUSH_INTERVAL']:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            pending, self.pending = self.pending, defaultdict(int)
+            unflushed, self.unflushed = self.unflushed, 0
+            self.oldest = None
+        post_ids = [post_id for post_id, delta in pending.items() if delta]
+        if not post_ids:
+            return 0
+        try:
+            # Recounting rather than adding the deltas: a reconcile() or another
+            # worker's flush may already have counted these likes
+            Post.objects.filter(id__in=post_ids).update(likes_count=_true_count())
+        except Exception:
+            # Keep the deltas for the next attempt rather than losing them
+            with self._lock:
+                for post_id, delta in pending.items():
+                    self.pending[post_id] += delta
+                self.unflushed += unflushed
+                self.oldest = self.oldest or time.monotonic()
+            logger.exception('Flushing %d like count deltas failed', len(pending))
+            return 0
+        self.flushes += 1
+        return len(post_ids)
+
+
+counter = LikeCounter()
+
+
+def flush_if_due(**kwargs):
+    """
+    request_finished receiver: flush deltas older than FLUSH_INTERVAL
+    """
+    counter.flush_if_due()
+
+
+def like(member, post_id):
+    """
+    Record that member likes the post; returns False if it already did
+    """
+    try:
+        with transaction.atomic():
+            Like.objects.create(post_id=post_id, member=member)
+    except IntegrityError:
+        return False
+    counter.add(post_id, 1)
+    return True
+
+
+def unlike(member, post_id):
+    """
+    Remove the like; returns False if there was none
+    """
+    deleted, _ = Like.objects.filter(post_id=post_id, member=member).delete()
+    if not deleted:
+        return False
+    counter.add(post_id, -1)
+    return True
+
+
+def approximate_count(post_id, stored_count):
+    return max(0, stored_count + counter.pending_for(post_id))
+
+
+def liked_post_ids(member, post_ids):
+    """
+    Which of post_ids the member likes, with one query
+    """
+    if not post_ids or not getattr(member, 'is_authenticated', False) or not member.pk:
+        return set()
+    return set(Like.objects.filter(member=member, post_id__in=post_ids).values_list('post_id', flat=True))
+
+
+def post_state(member, post_id):
+    """
+    (approximate likes count, liked by member) of a post, with one query; None if not in posts
+    """
+    row = (
+        Post.objects.filter(id=post_id)
+        .annotate(liked=Exists(Like.objects.filter(post=OuterRef('pk'), member=member.pk)))
+        .values_list('likes_count', 'liked')
+        .first()
+    )
+    if row is None:
+        return None
+    return approximate_count(post_id, row[0]), row[1]
+
+
+def reconcile(batch_size=None):
+    """
+    Recount likes_count from post_likes for every post, in primary key ranges.
+
+    Only rows whose counter drifted are written. Returns the number fixed.
+    """
+    batch_size = batch_size or get_config()['RECONCILE_BATCH_SIZE']
+    counter.flush()
+    true_count = _true_count()
+    fixed = 0
+    last_id = 0
+    while True:
+        upper = (
+            Post.objects.filter(id__gt=last_id).order_by('id')
+            .values_list('id', flat=True)[batch_size - 1:batch_size].first()
+        )
+        posts = Post.objects.filter(id__gt=last_id)
+        if upper is not None:
+            posts = posts.filter(id__lte=upper)
+        fixed += posts.annotate(true_count=true_count).exclude(likes_count=F('true_count')).update(
+            likes_count=true_count
+        )
+        if upper is None:
+            return fixed
+        last_id = upper
@@ -0,0 +1,84 @@
+"""
+Helpers shared by the bench_* management commands.
+
+Benchmarks run against a throwaway test database and private in-memory caches,
+so they never touch persistent/db/db.sqlite3 or the caches of a live server.
+"""
+import statistics
+import time
+from contextlib import contextmanager
+
+from django.db import connection
+from django.test.utils import (
+    override_settings,
+    setup_test_environment,
+    teardown_test_environment,
+)
+
+BENCH_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'bench-default',
+    },
+    'hot': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'bench-hot',
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    },
+}
+
+
+@contextmanager
+def benchmark_environment(**settings_overrides):
+    """
+    Create a test database and isolated caches for the duration of the block
+    """
+    setup_test_environment()
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        with override_settings(CACHES=BENCH_CACHES, **settings_overrides):
+            yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+
+def timed(func, iterations):
+    """
+    Call func() iterations times and return per-call latencies in seconds
+    """
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def summarize(samples):
+    ordered = sorted(samples)
+    total = sum(ordered)
+    return {
+        'n': len(ordered),
+        'rps': round(len(ordered) / total, 1) if total else None,
+        'mean_ms': round(statistics.fmean(ordered) * 1000, 3),
+        'p50_ms': round(ordered[len(ordered) // 2] * 1000, 3),
+        'p99_ms': round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1000, 3),
+    }
+
+
+def format_row(label, summary):
+    return (
+        f"{label:<28} n={summary['n']:<6} rps={summary['rps']:<9} "
+        f"mean={summary['mean_ms']}ms p50={summary['p50_ms']}ms p99={summary['p99_ms']}ms"
+    )
+
+
+def authenticated_client(member):
+    from rest_framework.test import APIClient
+    from api.authentication import create_session
+
+    client = APIClient()
+    client.cookies['sessionid'] = create_session(member)
+    return client
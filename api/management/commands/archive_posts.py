@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api import archive
+
+
+class Command(BaseCommand):
+    help = (
+        "Move posts older than ARCHIVE['AFTER_DAYS'] and their comments into the archive tables; "
+        "their likes, notifications, scores, tags and mentions are deleted"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, help='Archive posts older than this many days')
+        parser.add_argument('--batch-size', type=int, help='Posts moved per transaction')
+        parser.add_argument('--pause', type=float, help='Seconds to sleep between batches')
+        parser.add_argument('--limit', type=int, help='Stop after this many posts')
+        parser.add_argument(
+            '--loop', action='store_true',
+            help='Keep running, archiving every ARCHIVE["INTERVAL"] seconds'
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            archived = archive.archive_posts(
+                after_days=options['days'],
+                batch_size=options['batch_size'],
+                pause=options['pause'],
+                limit=options['limit'],
+            )
+            self.stdout.write(f'Archived {archived} posts')
+            if not options['loop']:
+                return
+            time.sleep(archive.get_config()['INTERVAL'])
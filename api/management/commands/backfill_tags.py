@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from api import tagging
+
+
+class Command(BaseCommand):
+    help = 'Extract hashtags and @mentions of existing posts and comments into the tags, post_tags and mentions tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=tagging.DEFAULT_BATCH_SIZE,
+            help='Rows read and indexed per transaction'
+        )
+        parser.add_argument('--pause', type=float, default=0.0, help='Seconds to sleep between batches')
+
+    def handle(self, *args, **options):
+        def progress(kind, count, last_id):
+            if options['verbosity'] > 1:
+                self.stdout.write(f'  {kind}: {count} indexed (last id {last_id})')
+
+        posts, comments = tagging.backfill(
+            batch_size=options['batch_size'],
+            pause=options['pause'],
+            on_batch=progress,
+        )
+        self.stdout.write(f'Indexed {posts} posts and {comments} comments')
@@ -0,0 +1,43 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api import backup
+
+
+class Command(BaseCommand):
+    help = 'Take an online, compressed and checksummed snapshot of the SQLite database, then rotate old ones'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--directory', help='Snapshot directory (default: BACKUP["DIRECTORY"])')
+        parser.add_argument('--keep', type=int, help='Snapshots to keep (default: BACKUP["KEEP"])')
+        parser.add_argument('--list', action='store_true', help='List snapshots and exit')
+        parser.add_argument(
+            '--loop', action='store_true',
+            help='Keep running, taking a snapshot every BACKUP["INTERVAL"] seconds'
+        )
+
+    def handle(self, *args, **options):
+        if options['list']:
+            for manifest in backup.list_snapshots(options['directory']):
+                self.stdout.write(
+                    f"{manifest['name']}  {manifest.get('bytes', '?')} bytes  sha256={manifest['sha256']}"
+                )
+            return
+        while True:
+            try:
+                manifest = backup.create_snapshot(directory=options['directory'])
+            except backup.BackupError as exc:
+                if not options['loop']:
+                    raise CommandError(str(exc))
+                self.stderr.write(str(exc))
+            else:
+                self.stdout.write(
+                    f"Wrote {manifest['name']}: {manifest['database_bytes']} -> {manifest['bytes']} bytes "
+                    f"in {manifest['seconds']}s ({manifest['steps']} steps, {manifest['restarts']} restarts)"
+                )
+                for name in backup.rotate(options['directory'], options['keep']):
+                    self.stdout.write(f'Removed {name}')
+            if not options['loop']:
+                return
+            time.sleep(backup.get_config()['INTERVAL'])
@@ -0,0 +1,80 @@
+import sqlite3
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand
+
+from api import backup
+from ._benchutils import format_row, summarize
+
+
+class Command(BaseCommand):
+    help = "Measure write latency while api.backup copies a database, stepped and in a single step"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size-mb', type=int, default=64, help='Size of the scratch database')
+        parser.add_argument('--write-interval', type=float, default=0.002, help='Pause between writes (seconds)')
+        parser.add_argument('--baseline-seconds', type=float, default=3.0, help='Length of the no-backup run')
+        parser.add_argument(
+            '--journal-mode', default='wal', choices=['wal', 'delete'],
+            help='Journal mode of the scratch database (the application database uses WAL)'
+        )
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as scratch:
+            source = Path(scratch) / 'source.sqlite3'
+            self._seed(source, options['size_mb'], options['journal_mode'])
+            self.stdout.write(f'Scratch database: {source.stat().st_size // (1024 * 1024)} MB')
+
+            samples = self._writes_during(source, options, lambda: time.sleep(options['baseline_seconds']))
+            self.stdout.write(format_row('no backup', summarize(samples)))
+
+            for label, pages in (('stepped backup', None), ('single-step backup', -1)):
+                stats = {}
+
+                def run_backup():
+                    stats.update(backup.copy_online(source, Path(scratch) / 'copy.sqlite3', pages=pages))
+
+                samples = self._writes_during(source, options, run_backup)
+                self.stdout.write(format_row(label, summarize(samples)))
+                self.stdout.write(f'  backup: {stats}')
+
+    def _seed(self, path, size_mb, journal_mode):
+        connection = sqlite3.connect(path)
+        connection.execute(f'PRAGMA journal_mode={journal_mode}')
+        connection.execute('CREATE TABLE filler (id INTEGER PRIMARY KEY, payload BLOB)')
+        connection.execute('CREATE TABLE events (id INTEGER PRIMARY KEY, payload TEXT, created REAL)')
+        chunk = b'x' * 4000
+        connection.executemany(
+            'INSERT INTO filler (payload) VALUES (?)', ((chunk,) for _ in range(size_mb * 256))
+        )
+        connection.commit()
+        connection.close()
+
+    def _writes_during(self, path, options, action):
+        """
+        Commit single-row inserts from another thread while action() runs; returns write latencies
+        """
+        stop = threading.Event()
+        samples = []
+
+        def writer():
+            connection = sqlite3.connect(path, timeout=30)
+            while not stop.is_set():
+                started = time.perf_counter()
+                connection.execute('INSERT INTO events (payload, created) VALUES (?, ?)', ('event', time.time()))
+                connection.commit()
+                samples.append(time.perf_counter() - started)
+                time.sleep(options['write_interval'])
+            connection.close()
+
+        thread = threading.Thread(target=writer)
+        thread.start()
+        try:
+            action()
+        finally:
+            stop.set()
+            thread.join()
+        return samples
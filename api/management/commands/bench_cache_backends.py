@@ -0,0 +1,74 @@
+import multiprocessing
+import random
+import tempfile
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand
+from django.utils.module_loading import import_string
+
+from ._benchutils import format_row, summarize
+
+BACKENDS = {
+    'locmem': ('django.core.cache.backends.locmem.LocMemCache', 'bench-locmem'),
+    'filebased': ('django.core.cache.backends.filebased.FileBasedCache', '{scratch}/filebased'),
+    'shm': ('api.shmcache.SharedMemoryCache', '{scratch}/bench.shm'),
+}
+
+
+def _worker(backend, location, options, seed, results):
+    """
+    Cache-aside loop in one process: get, and set on a miss, over a skewed key space
+    """
+    cache = import_string(backend)(location, {'TIMEOUT': 300, 'OPTIONS': {'MAX_ENTRIES': options['max_entries']}})
+    rng = random.Random(seed)
+    value = {'id': 0, 'title': 'x' * 120, 'body': 'y' * options['value_bytes'], 'tags': ['a', 'b']}
+    samples = []
+    hits = 0
+    deadline = time.monotonic() + options['seconds']
+    while time.monotonic() < deadline:
+        key = f'post:{int(rng.paretovariate(0.3)) % options["keys"]}'
+        started = time.perf_counter()
+        if cache.get(key) is None:
+            cache.set(key, value)
+        else:
+            hits += 1
+        samples.append(time.perf_counter() - started)
+    results.put((samples, hits))
+
+
+class Command(BaseCommand):
+    help = "Compare LocMemCache, FileBasedCache and SharedMemoryCache with several processes hitting them"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=4)
+        parser.add_argument('--seconds', type=float, default=5.0)
+        parser.add_argument('--keys', type=int, default=5000, help='Distinct keys (skewed access)')
+        parser.add_argument('--max-entries', type=int, default=10000)
+        parser.add_argument('--value-bytes', type=int, default=300)
+        parser.add_argument('--backend', action='append', choices=sorted(BACKENDS), help='Default: all')
+
+    def handle(self, *args, **options):
+        context = multiprocessing.get_context('fork')
+        with tempfile.TemporaryDirectory() as scratch:
+            for name in options['backend'] or list(BACKENDS):
+                backend, location = BACKENDS[name]
+                location = location.format(scratch=Path(scratch))
+                results = context.Queue()
+                processes = [
+                    context.Process(target=_worker, args=(backend, location, options, seed, results))
+                    for seed in range(options['processes'])
+                ]
+                for process in processes:
+                    process.start()
+                collected = [results.get() for _ in processes]
+                for process in processes:
+                    process.join()
+
+                samples = [sample for process_samples, _ in collected for sample in process_samples]
+                hits = sum(process_hits for _, process_hits in collected)
+                summary = summarize(samples)
+                self.stdout.write(
+                    f"{format_row(name, summary)} ops/s={round(len(samples) / options['seconds'])} "
+                    f"hit={hits / len(samples):.1%}"
+                )
@@ -0,0 +1,62 @@
+from django.core.management.base import BaseCommand
+
+from api import caching, threads
+from api.models import Member, Post, Comment
+from ._benchutils import authenticated_client, benchmark_environment, format_row, summarize, timed
+
+
+class Command(BaseCommand):
+    help = "Benchmark post detail and comment thread reads on a hot post, with and without the hot cache"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--comments', type=int, default=200, help='Comments on the hot post')
+        parser.add_argument('--requests', type=int, default=500, help='Requests per scenario')
+        parser.add_argument(
+            '--write-every', type=int, default=50,
+            help='Create a comment (and invalidate the thread) every N reads; 0 disables writes'
+        )
+
+    def handle(self, *args, **options):
+        with benchmark_environment():
+            post_id, client = self._seed(options['comments'])
+            for enabled in (False, True):
+                self._run(client, post_id, enabled, options)
+
+    def _seed(self, comment_count):
+        members = [
+            Member(username=f'bench{i}', email=f'bench{i}@example.com', password='!')
+            for i in range(20)
+        ]
+        Member.objects.bulk_create(members)
+        members = list(Member.objects.all())
+        post = Post.objects.create(author=members[0], content='Viral post')
+        threads.fill_paths(Comment.objects.bulk_create([
+            Comment(post=post, author=members[i % len(members)], content=f'Comment {i}')
+            for i in range(comment_count)
+        ]))
+        return post.id, authenticated_client(members[1])
+
+    def _run(self, client, post_id, enabled, options):
+        write_every = options['write_every']
+        counter = {'n': 0}
+
+        def request():
+            counter['n'] += 1
+            if write_every and counter['n'] % write_every == 0:
+                client.post(f'/api/posts/{post_id}/comments/', {'content': 'More'}, format='json')
+            client.get(f'/api/posts/{post_id}/')
+            client.get(f'/api/posts/{post_id}/comments/')
+
+        with self.settings_override(enabled):
+            caching.stats.reset()
+            samples = timed(request, options['requests'])
+
+        label = 'hot cache on' if enabled else 'hot cache off'
+        self.stdout.write(format_row(label, summarize(samples)))
+        if enabled:
+            self.stdout.write(f'  cache stats: {caching.stats.snapshot()}')
+
+    def settings_override(self, enabled):
+        from django.test.utils import override_settings
+
+        return override_settings(API_CACHE={**caching.get_config(), 'ENABLED': enabled})
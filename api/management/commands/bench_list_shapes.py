@@ -0,0 +1,58 @@
+from rest_framework.renderers import JSONRenderer
+
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory
+from rest_framework.request import Request
+
+from api import threads
+from api.models import Member, Post, Comment
+from api.serializers import CommentSerializer
+from api.shaping import ListShape
+from ._benchutils import benchmark_environment, format_row, summarize, timed
+
+SHAPES = [
+    ('default (nested authors)', ''),
+    ('compact', 'shape=compact'),
+    ('compact, sparse', 'shape=compact&fields=id,content,author&member_fields=id,username'),
+    ('sparse, nested', 'fields=id,content,author&member_fields=id,username'),
+]
+
+
+class Command(BaseCommand):
+    help = "Compare payload size and serialization time of list response shapes on a large thread"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--authors', type=int, default=10)
+        parser.add_argument('--comments', type=int, default=500)
+        parser.add_argument('--iterations', type=int, default=50)
+
+    def handle(self, *args, **options):
+        with benchmark_environment():
+            comments = self._seed(options['authors'], options['comments'])
+            renderer = JSONRenderer()
+            factory = RequestFactory()
+
+            for label, query in SHAPES:
+                shape = ListShape(Request(factory.get(f'/?{query}')), CommentSerializer)
+
+                def render():
+                    items, included = shape.serialize(comments)
+                    body = {'results': items, 'included': included} if included is not None else items
+                    return renderer.render(body)
+
+                size = len(render())
+                summary = summarize(timed(render, options['iterations']))
+                self.stdout.write(f'{format_row(label, summary)} bytes={size}')
+
+    def _seed(self, author_count, comment_count):
+        Member.objects.bulk_create([
+            Member(username=f'bench{i}', email=f'bench{i}@example.com', password='!')
+            for i in range(author_count)
+        ])
+        members = list(Member.objects.all())
+        post = Post.objects.create(author=members[0], content='Busy thread')
+        threads.fill_paths(Comment.objects.bulk_create([
+            Comment(post=post, author=members[i % len(members)], content=f'Comment number {i}')
+            for i in range(comment_count)
+        ]))
+        return list(Comment.objects.filter(post=post).select_related('author'))
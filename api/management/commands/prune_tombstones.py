@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api import sync
+
+
+class Command(BaseCommand):
+    help = 'Delete delta-sync tombstones older than SYNC["TOMBSTONE_RETENTION_DAYS"]'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, help='Tombstones deleted per statement')
+        parser.add_argument(
+            '--loop', action='store_true',
+            help='Keep running, pruning every SYNC["PRUNE_INTERVAL"] seconds'
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            pruned = sync.prune(batch_size=options['batch_size'])
+            self.stdout.write(f'Pruned {pruned} tombstones')
+            if not options['loop']:
+                return
+            time.sleep(sync.get_config()['PRUNE_INTERVAL'])
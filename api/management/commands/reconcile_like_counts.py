@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api import likes
+
+
+class Command(BaseCommand):
+    help = 'Recount posts.likes_count from post_likes, fixing drift left by lost like-count buffers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, help='Posts recounted per UPDATE')
+        parser.add_argument(
+            '--loop', action='store_true',
+            help='Keep running, reconciling every LIKES["RECONCILE_INTERVAL"] seconds'
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            fixed = likes.reconcile(batch_size=options['batch_size'])
+            self.stdout.write(f'Fixed {fixed} like counts')
+            if not options['loop']:
+                return
+            time.sleep(likes.get_config()['RECONCILE_INTERVAL'])
@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api import ranking
+
+
+class Command(BaseCommand):
+    help = "Update hot feed scores for posts that were created or commented on since the last run"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--loop', action='store_true',
+            help='Keep running, refreshing every HOT_FEED["REFRESH_INTERVAL"] seconds'
+        )
+        parser.add_argument(
+            '--rebuild', action='store_true',
+            help='Drop all scores and recompute them (needed after changing the half-life)'
+        )
+
+    def handle(self, *args, **options):
+        new_posts, rescored = ranking.refresh_scores(rebuild=options['rebuild'])
+        self.stdout.write(f'Scored {new_posts} new posts, rescored {rescored} posts')
+
+        while options['loop']:
+            time.sleep(ranking.get_config()['REFRESH_INTERVAL'])
+            new_posts, rescored = ranking.refresh_scores()
+            if new_posts or rescored:
+                self.stdout.write(f'Scored {new_posts} new posts, rescored {rescored} posts')
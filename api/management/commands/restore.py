@@ -0,0 +1,77 @@
+from datetime import datetime
+from pathlib import Path
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from api import backup
+
+
+class Command(BaseCommand):
+    help = (
+        'Verify a snapshot taken by `backup` and restore it over the SQLite database, then clear every cache. '
+        'Start the workers afterwards: their username filters and like buffers describe the old database'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('snapshot', nargs='?', help='Snapshot file (default: the newest one)')
+        parser.add_argument('--at', help='Restore the newest snapshot taken at or before this ISO 8601 time')
+        parser.add_argument('--directory', help='Snapshot directory (default: BACKUP["DIRECTORY"])')
+        parser.add_argument('--verify-only', action='store_true', help='Check the snapshot without restoring')
+        parser.add_argument(
+            '--noinput', '--no-input', action='store_false', dest='interactive',
+            help='Do not ask for confirmation before overwriting the database'
+        )
+
+    def handle(self, *args, **options):
+        snapshot_path = self.pick_snapshot(options)
+        if options['verify_only']:
+            try:
+                manifest = backup.verify(snapshot_path)
+            except backup.BackupError as exc:
+                raise CommandError(str(exc))
+            self.stdout.write(f"{manifest['name']} is intact")
+            return
+
+        target = backup.database_path()
+        if options['interactive']:
+            answer = input(
+                f'This will overwrite {target} with {snapshot_path.name}. '
+                'Stop the application first and start it again afterwards. Type "yes" to continue: '
+            )
+            if answer != 'yes':
+                raise CommandError('Restore cancelled')
+        try:
+            manifest = backup.restore(snapshot_path, target)
+        except backup.BackupError as exc:
+            raise CommandError(str(exc))
+        # Every cache describes the database that was just replaced: payloads and fragments, but also
+        # sessions, like and unread counters, hot feed snapshots and rebuild locks. State kept inside
+        # each worker (api.availability's filter, api.likes' buffers) goes only with a restart
+        for alias in settings.CACHES:
+            caches[alias].clear()
+        self.stdout.write(f"Restored {manifest['name']} (taken {manifest['created_at']}) into {target}")
+        self.stdout.write(f"Cleared caches: {', '.join(settings.CACHES)}. Restart the workers before serving again")
+
+    def pick_snapshot(self, options):
+        if options['snapshot']:
+            snapshot_path = Path(options['snapshot'])
+            if not snapshot_path.exists():
+                raise CommandError(f'{snapshot_path} does not exist')
+            return snapshot_path
+        if options['at']:
+            try:
+                moment = datetime.fromisoformat(options['at'])
+            except ValueError:
+                raise CommandError(f'Invalid --at time: {options["at"]}')
+            if timezone.is_naive(moment):
+                moment = timezone.make_aware(moment)
+            manifest = backup.snapshot_at(moment, options['directory'])
+        else:
+            snapshots = backup.list_snapshots(options['directory'])
+            manifest = snapshots[-1] if snapshots else None
+        if manifest is None:
+            raise CommandError('No matching snapshot')
+        return Path(manifest['path'])
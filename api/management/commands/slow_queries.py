@@ -0,0 +1,48 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from api import querylog
+
+
+class Command(BaseCommand):
+    help = "Show SQL fingerprint stats and captured slow queries from all workers"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=20)
+        parser.add_argument(
+            '--sort', default='total_ms',
+            choices=['total_ms', 'mean_ms', 'p95_ms', 'max_ms', 'count', 'slow_count'],
+        )
+        parser.add_argument('--json', action='store_true', help='Print the raw report as JSON')
+        parser.add_argument('--reset', action='store_true', help='Delete collected stats')
+
+    def handle(self, *args, **options):
+        if options['reset']:
+            querylog.reset()
+            self.stdout.write('Slow-query log cleared')
+            return
+
+        report = querylog.merged_report(sort=options['sort'], top=options['top'])
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2, default=str))
+            return
+
+        self.stdout.write(
+            f"Workers: {', '.join(map(str, report['workers'])) or 'none'}; "
+            f"sampled queries: {report['sampled_queries']}\n"
+        )
+        self.stdout.write(f"{'count':>7} {'total ms':>10} {'mean':>8} {'p95':>8} {'max':>8} {'slow':>5}  sql")
+        for row in report['fingerprints']:
+            self.stdout.write(
+                f"{row['count']:>7} {row['total_ms']:>10.1f} {row['mean_ms']:>8.2f} "
+                f"{row['p95_ms'] or 0:>8.2f} {row['max_ms']:>8.2f} {row['slow_count']:>5}  {row['sql'][:120]}"
+            )
+
+        if report['slow']:
+            self.stdout.write('\nRecent slow queries:')
+        for entry in report['slow']:
+            self.stdout.write(f"\n{entry['ms']:.1f} ms  route={entry['route']}  at {entry['call_site']}")
+            self.stdout.write(f"  {entry['sql'][:300]}")
+            for line in entry['plan'] or []:
+                self.stdout.write(f'    {line}')
@@ -0,0 +1,95 @@
+import json
+import os
+import subprocess
+import sys
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+# Runs in a fresh interpreter so nothing is already imported
+PROBE = '''
+import json, os, sys, time
+started = time.perf_counter()
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
+from django.core.wsgi import get_wsgi_application
+application = get_wsgi_application()
+loaded = time.perf_counter()
+if sys.argv[1] == "1":
+    from api.warmup import warm_imports
+    warm_imports()
+ready = time.perf_counter()
+from wsgiref.util import setup_testing_defaults
+environ = {"PATH_INFO": "/api/hello/", "REQUEST_METHOD": "GET"}
+setup_testing_defaults(environ)
+status = []
+b"".join(application(environ, lambda s, h, exc_info=None: status.append(s)))
+done = time.perf_counter()
+print(json.dumps({
+    "status": status[0],
+    "load_app_ms": (loaded - started) * 1000,
+    "warm_imports_ms": (ready - loaded) * 1000,
+    "first_response_ms": (done - ready) * 1000,
+    "total_ms": (done - started) * 1000,
+}))
+'''
+
+
+class Command(BaseCommand):
+    help = "Profile worker cold start: import time per module and time to first response"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=25, help='Number of modules/packages to list')
+        parser.add_argument('--runs', type=int, default=5, help='Cold starts to average per scenario')
+
+    def _probe(self, warm, schema_build, importtime=False):
+        env = {**os.environ, 'DJANGO_SETTINGS_MODULE': 'config.settings'}
+        env['DJANGO_SCHEMA_BUILD'] = '1' if schema_build else '0'
+        command = [sys.executable]
+        if importtime:
+            command += ['-X', 'importtime']
+        command += ['-c', PROBE, '1' if warm else '0']
+        result = subprocess.run(
+            command, cwd=settings.BASE_DIR, env=env, capture_output=True, text=True, check=True
+        )
+        return json.loads(result.stdout.strip().splitlines()[-1]), result.stderr
+
+    def _import_table(self, stderr):
+        modules = []
+        packages = defaultdict(int)
+        for line in stderr.splitlines():
+            if not line.startswith('import time:') or 'self [us]' in line:
+                continue
+            self_us, cumulative_us, name = line[len('import time:'):].split('|')
+            name = name.strip()
+            modules.append((int(cumulative_us), int(self_us), name))
+            packages[name.split('.')[0]] += int(self_us)
+        return modules, packages
+
+    def handle(self, *args, **options):
+        top = options['top']
+        _, stderr = self._probe(warm=True, schema_build=False, importtime=True)
+        modules, packages = self._import_table(stderr)
+
+        self.stdout.write(f'Top {top} packages by self import time:')
+        for name, self_us in sorted(packages.items(), key=lambda item: -item[1])[:top]:
+            self.stdout.write(f'  {self_us / 1000:8.1f} ms  {name}')
+        self.stdout.write(f'\nTop {top} modules by cumulative import time:')
+        for cumulative_us, self_us, name in sorted(modules, reverse=True)[:top]:
+            self.stdout.write(f'  {cumulative_us / 1000:8.1f} ms  (self {self_us / 1000:6.1f} ms)  {name}')
+
+        self.stdout.write('\nCold start (mean of %d runs):' % options['runs'])
+        for label, warm, schema_build in (
+            ('schema libs loaded, no warm-up', False, True),
+            ('lazy schema, no warm-up', False, False),
+            ('lazy schema, master warm-up', True, False),
+        ):
+            runs = [self._probe(warm, schema_build)[0] for _ in range(options['runs'])]
+            mean = {
+                key: sum(run[key] for run in runs) / len(runs)
+                for key in ('load_app_ms', 'warm_imports_ms', 'first_response_ms', 'total_ms')
+            }
+            self.stdout.write(
+                f"  {label:<32} load={mean['load_app_ms']:.1f}ms warm={mean['warm_imports_ms']:.1f}ms "
+                f"first_response={mean['first_response_ms']:.1f}ms total={mean['total_ms']:.1f}ms"
+            )
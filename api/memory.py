@@ -0,0 +1,162 @@
+"""
+Opt-in per-worker memory instrumentation.
+
+When MEMORY_PROFILING['ENABLED'] is set, MemoryProfilingMiddleware records, for
+every route in api/urls.py, how much traced Python heap each request left
+behind. Once a route's retained growth crosses the threshold (or a staff member
+asks for it) the next request to that route runs between two tracemalloc
+snapshots, and the top allocation sites of that diff are kept per route.
+
+current_rss_bytes() is always available and is used by the gunicorn
+post_request hook to recycle workers that grew past WORKER_MAX_RSS_MB.
+"""
+import os
+import resource
+import threading
+import time
+import tracemalloc
+from collections import deque
+
+from django.conf import settings
+
+DEFAULTS = {
+    'ENABLED': False,
+    'FRAMES': 10,
+    'SAMPLE_EVERY': 100,
+    'SAMPLES_KEPT': 360,
+    'ROUTE_THRESHOLD_BYTES': 5 * 1024 * 1024,
+    'TOP_SITES': 15,
+}
+
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'MEMORY_PROFILING', {})}
+
+
+def current_rss_bytes():
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * _PAGE_SIZE
+    except OSError:
+        # No procfs: fall back to peak RSS (reported in kilobytes)
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _top_sites(before, after, limit):
+    stats = after.compare_to(before, 'lineno')
+    return [
+        {
+            'site': f'{stat.traceback[0].filename}:{stat.traceback[0].lineno}',
+            'size_diff': stat.size_diff,
+            'count_diff': stat.count_diff,
+        }
+        for stat in stats[:limit]
+        if stat.size_diff > 0
+    ]
+
+
+def _snapshot():
+    return tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    ))
+
+
+class MemoryMonitor:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started_at = None
+        self.baseline = None
+        self.requests = 0
+        self.samples = deque()
+        self.routes = {}
+        self.reports = {}
+        self.armed = set()
+
+    def start(self):
+        config = get_config()
+        with self._lock:
+            if self.started_at is not None:
+                return
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(config['FRAMES'])
+            self.samples = deque(maxlen=config['SAMPLES_KEPT'])
+            self.started_at = time.time()
+            self.baseline = _snapshot()
+
+    def sample(self):
+        heap, heap_peak = tracemalloc.get_traced_memory()
+        self.samples.append({
+            'at': time.time(),
+            'requests': self.requests,
+            'rss_bytes': current_rss_bytes(),
+            'heap_bytes': heap,
+            'heap_peak_bytes': heap_peak,
+        })
+
+    def arm(self, routes=None):
+        """
+        Capture a snapshot diff on the next request of each route (all seen routes by default)
+        """
+        with self._lock:
+            self.armed.update(routes if routes is not None else self.routes.keys())
+
+    def before_request(self, route):
+        return {
+            'heap': tracemalloc.get_traced_memory()[0],
+            'snapshot': _snapshot() if route in self.armed else None,
+        }
+
+    def after_request(self, route, token):
+        config = get_config()
+        retained = tracemalloc.get_traced_memory()[0] - token['heap']
+        with self._lock:
+            self.requests += 1
+            stats = self.routes.setdefault(route, {'requests': 0, 'retained_bytes': 0, 'since_report': 0})
+            stats['requests'] += 1
+            stats['retained_bytes'] += retained
+            stats['since_report'] += retained
+            if stats['since_report'] >= config['ROUTE_THRESHOLD_BYTES']:
+                self.armed.add(route)
+            take_sample = self.requests % config['SAMPLE_EVERY'] == 0
+
+        if token['snapshot'] is not None:
+            route_report = {
+                'taken_at': time.time(),
+                'retained_bytes': retained,
+                'top_sites': _top_sites(token['snapshot'], _snapshot(), config['TOP_SITES']),
+            }
+            with self._lock:
+                self.reports[route] = route_report
+                self.armed.discard(route)
+                if route in self.routes:
+                    self.routes[route]['since_report'] = 0
+        if take_sample:
+            self.sample()
+
+    def report(self, include_global_diff=False):
+        config = get_config()
+        data = {
+            'pid': os.getpid(),
+            'enabled': self.started_at is not None,
+            'rss_bytes': current_rss_bytes(),
+            'requests': self.requests,
+        }
+        if self.started_at is None:
+            return data
+        data['heap_bytes'], data['heap_peak_bytes'] = tracemalloc.get_traced_memory()
+        data['samples'] = list(self.samples)
+        data['routes'] = {
+            route: {'requests': stats['requests'], 'retained_bytes': stats['retained_bytes']}
+            for route, stats in sorted(self.routes.items(), key=lambda item: -item[1]['retained_bytes'])
+        }
+        with self._lock:
+            data['route_reports'] = dict(self.reports)
+        if include_global_diff:
+            data['since_start_top_sites'] = _top_sites(self.baseline, _snapshot(), config['TOP_SITES'])
+        return data
+
+
+monitor = MemoryMonitor()
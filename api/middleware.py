@@ -0,0 +1,121 @@
+from django.http import JsonResponse
+from django.urls import Resolver404, resolve
+
+from . import admission, memory, profiling, querylog
+
+
+class AdmissionControlMiddleware:
+    """
+    Sheds low-priority requests first when the workers fall behind, and drops
+    requests whose client already gave up (see api/admission.py). Goes first,
+    so a shed request costs as little as possible.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.config = admission.get_config()
+
+    def __call__(self, request):
+        if not self.config['ENABLED']:
+            return self.get_response(request)
+        try:
+            route_name = resolve(request.path_info).url_name
+        except Resolver404:
+            route_name = None
+        level = admission.priority(route_name, request.method, self.config)
+        if level is None:
+            return self.get_response(request)
+
+        outcome = admission.decide(
+            admission.header_time(request.headers.get('X-Request-Start')),
+            admission.header_time(request.headers.get('X-Request-Deadline')),
+            level, self.config,
+        )
+        if outcome != 'admit':
+            response = JsonResponse(
+                {
+                    "error": "Server is overloaded, retry later" if outcome == 'shed' else "Request deadline passed",
+                    "details": {"priority": level}
+                },
+                status=503
+            )
+            response['Retry-After'] = str(self.config['RETRY_AFTER'])
+            return response
+        try:
+            return self.get_response(request)
+        finally:
+            admission.finish(self.config)
+
+
+class MemoryProfilingMiddleware:
+    """
+    Attributes retained Python heap to routes (opt-in, see api/memory.py)
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.enabled = memory.get_config()['ENABLED']
+        if self.enabled:
+            memory.monitor.start()
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        token = getattr(request, '_memory_token', None)
+        if token is not None:
+            memory.monitor.after_request(request._memory_route, token)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if not self.enabled:
+            return None
+        match = request.resolver_match
+        request._memory_route = match.route if match else request.path
+        request._memory_token = memory.monitor.before_request(request._memory_route)
+        return None
+
+
+class SlowQueryLogMiddleware:
+    """
+    Tags logged queries with the current route and flushes worker stats (opt-in, see api/querylog.py)
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.enabled = querylog.get_config()['ENABLED']
+
+    def __call__(self, request):
+        if not self.enabled:
+            return self.get_response(request)
+        querylog.set_route(request.path)
+        try:
+            return self.get_response(request)
+        finally:
+            querylog.set_route(None)
+            querylog.logger.maybe_flush()
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if self.enabled and request.resolver_match:
+            querylog.set_route(request.resolver_match.route)
+        return None
+
+
+class RequestProfilerMiddleware:
+    """
+    Profiles the view of requests that staff flag for it (see api/profiling.py).
+    Must come last: the view runs here, so later process_view hooks are skipped.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.config = profiling.get_config()
+
+    def __call__(self, request):
+        return self.get_response(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if not self.config['ENABLED']:
+            return None
+        mode = profiling.requested_mode(request, self.config)
+        if mode is None or not profiling.is_staff(request):
+            return None
+        return profiling.profile_view(request, view_func, view_args, view_kwargs, mode)
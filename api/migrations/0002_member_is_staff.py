@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='member',
+            name='is_staff',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.7
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_member_is_staff'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PostScore',
+            fields=[
+                ('post', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='hot_score', serialize=False, to='api.post')),
+                ('score', models.FloatField(default=0)),
+                ('last_comment_id', models.BigIntegerField(db_index=True, default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'post_scores',
+                'indexes': [models.Index(fields=['score', 'post'], name='post_scores_score_post_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 5.2.7
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_archive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'db_table': 'tags',
+            },
+        ),
+        migrations.CreateModel(
+            name='Mention',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField()),
+                ('comment', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='mentions', to='api.comment')),
+                ('member', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='mentions', to='api.member')),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='mentions', to='api.post')),
+            ],
+            options={
+                'db_table': 'mentions',
+                'indexes': [models.Index(fields=['member', 'created_at', 'id'], name='mentions_member_created_idx')],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('comment__isnull', True)), fields=('member', 'post'), name='mentions_member_post_uniq'), models.UniqueConstraint(fields=('member', 'comment'), name='mentions_member_comment_uniq')],
+            },
+        ),
+        migrations.CreateModel(
+            name='PostTag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField()),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='post_tags', to='api.post')),
+                ('tag', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='post_tags', to='api.tag')),
+            ],
+            options={
+                'db_table': 'post_tags',
+                'indexes': [models.Index(fields=['tag', 'created_at', 'post'], name='post_tags_tag_created_idx')],
+                'constraints': [models.UniqueConstraint(fields=('post', 'tag'), name='post_tags_post_tag_uniq')],
+            },
+        ),
+    ]
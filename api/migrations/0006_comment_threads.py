@@ -0,0 +1,94 @@
+# Generated by Django 5.2.7
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+DIGITS = '0123456789abcdefghijklmnopqrstuvwxyz'
+
+
+def encode_segment(value):
+    digits = []
+    while value:
+        value, remainder = divmod(value, len(DIGITS))
+        digits.append(DIGITS[remainder])
+    return ''.join(reversed(digits)).rjust(8, '0')
+
+
+def fill_root_paths(apps, schema_editor):
+    # Every existing comment is top-level: its path is its own id segment
+    for name in ('Comment', 'ArchivedComment'):
+        model = apps.get_model('api', name)
+        last_id = 0
+        while True:
+            batch = list(model.objects.filter(id__gt=last_id).order_by('id').only('id')[:1000])
+            if not batch:
+                break
+            for comment in batch:
+                comment.path = encode_segment(comment.id)
+            model.objects.bulk_update(batch, ['path'])
+            last_id = batch[-1].id
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_tags_mentions'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='archivedcomment',
+            options={'ordering': ['path']},
+        ),
+        migrations.AlterModelOptions(
+            name='comment',
+            options={'ordering': ['path']},
+        ),
+        migrations.RemoveIndex(
+            model_name='archivedcomment',
+            name='comments_archive_post_idx',
+        ),
+        migrations.AddField(
+            model_name='archivedcomment',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='archivedcomment',
+            name='parent_id',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='archivedcomment',
+            name='path',
+            field=models.CharField(default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='parent',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='replies', to='api.comment'),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='path',
+            field=models.CharField(default='', max_length=255),
+        ),
+        migrations.RunPython(fill_root_paths, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='archivedcomment',
+            index=models.Index(fields=['post', 'path'], name='comments_archive_post_path_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['post', 'path'], name='comments_post_path_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['post', 'depth', 'path'], name='comments_post_depth_path_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_post_list_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='member',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
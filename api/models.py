@@ -9,7 +9,10 @@ class Member(models.Model):
     password = models.CharField(max_length=128)
     bio = models.TextField(max_length=500, blank=True, null=True)
     avatar_url = models.URLField(blank=True, null=True)
+    is_staff = models.BooleanField(default=False)
     created_at = models.DateTimeField(default=timezone.now)
+    # Version of the member's JSON in api.fragments
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         db_table = 'members'
@@ -42,12 +45,20 @@ class Member(models.Model):
 class Post(models.Model):
     author = models.ForeignKey(Member, on_delete=models.CASCADE, related_name='posts')
     content = models.TextField(max_length=5000)
+    # Approximate, maintained by api.likes (buffered per worker, reconciled periodically)
+    likes_count = models.PositiveIntegerField(default=0)
     created_at = models.DateTimeField(default=timezone.now)
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         db_table = 'posts'
         ordering = ['-created_at']
+        indexes = [
+            # The feed and profile pages, newest first (api.queryplans checks every route's plans)
+            models.Index(fields=['created_at'], name='posts_created_idx'),
+            models.Index(fields=['author', 'created_at'], name='posts_author_created_idx'),
+            models.Index(fields=['updated_at', 'id'], name='posts_updated_idx'),
+        ]
 
     def __str__(self):
         return f'Post by {self.author.username} at {self.created_at}'
@@ -56,13 +67,227 @@ class Post(models.Model):
 class Comment(models.Model):
     post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='comments')
     author = models.ForeignKey(Member, on_delete=models.CASCADE, related_name='comments')
+    parent = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True, related_name='replies')
+    # Materialized path and nesting level, see api.threads
+    path = models.CharField(max_length=255, default='')
+    depth = models.PositiveSmallIntegerField(default=0)
     content = models.TextField(max_length=2000)
     created_at = models.DateTimeField(default=timezone.now)
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         db_table = 'comments'
-        ordering = ['created_at']
+        ordering = ['path']
+        indexes = [
+            models.Index(fields=['post', 'path'], name='comments_post_path_idx'),
+            models.Index(fields=['post', 'depth', 'path'], name='comments_post_depth_path_idx'),
+            models.Index(fields=['post', 'updated_at', 'id'], name='comments_post_updated_idx'),
+        ]
 
     def __str__(self):
         return f'Comment by {self.author.username} on post {self.post.id}'
+
+
+class PostScore(models.Model):
+    """
+    Time-decayed "hot" score of a post, maintained by api.ranking.refresh_scores
+    """
+    post = models.OneToOneField(Post, on_delete=models.CASCADE, primary_key=True, related_name='hot_score')
+    score = models.FloatField(default=0)
+    last_comment_id = models.BigIntegerField(default=0, db_index=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'post_scores'
+        indexes = [
+            models.Index(fields=['score', 'post'], name='post_scores_score_post_idx'),
+        ]
+
+    def __str__(self):
+        return f'Score {self.score:.1f} for post {self.post_id}'
+
+
+class ArchivedPost(models.Model):
+    """
+    Cold copy of a Post moved out of `posts` by api.archive; keeps the original id
+    """
+    id = models.BigIntegerField(primary_key=True)
+    author = models.ForeignKey(Member, on_delete=models.CASCADE, related_name='archived_posts')
+    content = models.TextField(max_length=5000)
+    likes_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    archived_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        db_table = 'posts_archive'
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['author', 'created_at'], name='posts_archive_author_idx'),
+        ]
+
+    def __str__(self):
+        return f'Archived post {self.id} by {self.author.username}'
+
+
+class ArchivedComment(models.Model):
+    """
+    Cold copy of a Comment whose post was archived; keeps the original id
+    """
+    id = models.BigIntegerField(primary_key=True)
+    post = models.ForeignKey(ArchivedPost, on_delete=models.CASCADE, related_name='comments')
+    author = models.ForeignKey(Member, on_delete=models.CASCADE, related_name='archived_comments')
+    parent_id = models.BigIntegerField(null=True, blank=True)
+    path = models.CharField(max_length=255, default='')
+    depth = models.PositiveSmallIntegerField(default=0)
+    content = models.TextField(max_length=2000)
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+
+    class Meta:
+        db_table = 'comments_archive'
+        ordering = ['path']
+        indexes = [
+            models.Index(fields=['post', 'path'], name='comments_archive_post_path_idx'),
+        ]
+
+    def __str__(self):
+        return f'Archived comment {self.id} on post {self.post_id}'
+
+
+class Tag(models.Model):
+    """
+    A normalized (case-folded) hashtag, see api.tagging
+    """
+    name = models.CharField(max_length=100, unique=True)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        db_table = 'tags'
+
+    def __str__(self):
+        return f'#{self.name}'
+
+
+class PostTag(models.Model):
+    """
+    Post carrying a tag (in its content or one of its comments).
+
+    created_at is copied from the post so a tag feed is one range scan of the
+    (tag, created_at, post) index.
+    """
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='post_tags')
+    tag = models.ForeignKey(Tag, on_delete=models.CASCADE, related_name='post_tags')
+    created_at = models.DateTimeField()
+
+    class Meta:
+        db_table = 'post_tags'
+        constraints = [
+            models.UniqueConstraint(fields=['post', 'tag'], name='post_tags_post_tag_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['tag', 'created_at', 'post'], name='post_tags_tag_created_idx'),
+        ]
+
+    def __str__(self):
+        return f'Post {self.post_id} tagged {self.tag_id}'
+
+
+class Mention(models.Model):
+    """
+    A member @mentioned in a post, or in a comment (comment set) on that post
+    """
+    member = models.ForeignKey(Member, on_delete=models.CASCADE, related_name='mentions')
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='mentions')
+    comment = models.ForeignKey(Comment, on_delete=models.CASCADE, null=True, blank=True, related_name='mentions')
+    created_at = models.DateTimeField()
+
+    class Meta:
+        db_table = 'mentions'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['member', 'post'], condition=models.Q(comment__isnull=True),
+                name='mentions_member_post_uniq',
+            ),
+            models.UniqueConstraint(fields=['member', 'comment'], name='mentions_member_comment_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['member', 'created_at', 'id'], name='mentions_member_created_idx'),
+        ]
+
+    def __str__(self):
+        return f'Mention of member {self.member_id} in post {self.post_id}'
+
+
+class Like(models.Model):
+    """
+    A member liking a post; the (post, member) pair is unique so likes are idempotent
+    """
+    # The unique (post, member) index serves post lookups
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='likes', db_index=False)
+    member = models.ForeignKey(Member, on_delete=models.CASCADE, related_name='likes')
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        db_table = 'post_likes'
+        constraints = [
+            models.UniqueConstraint(fields=['post', 'member'], name='post_likes_post_member_uniq'),
+        ]
+
+    def __str__(self):
+        return f'Member {self.member_id} likes post {self.post_id}'
+
+
+class Notification(models.Model):
+    """
+    Comments on a member's post. While unread, further comments on the same
+    post are batched into it (see api.notifications).
+    """
+    recipient = models.ForeignKey(Member, on_delete=models.CASCADE, related_name='notifications')
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='notifications')
+    # Author of the latest batched comment
+    actor = models.ForeignKey(Member, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    last_comment = models.ForeignKey(Comment, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    comment_count = models.PositiveIntegerField(default=1)
+    created_at = models.DateTimeField(default=timezone.now)
+    updated_at = models.DateTimeField(default=timezone.now)
+    read_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'notifications'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['recipient', 'post'], condition=models.Q(read_at__isnull=True),
+                name='notifications_unread_post_uniq',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['recipient', 'updated_at', 'id'], name='notifications_inbox_idx'),
+        ]
+
+    def __str__(self):
+        return f'Notification for member {self.recipient_id} on post {self.post_id}'
+
+
+class Tombstone(models.Model):
+    """
+    Deletion log entry for delta sync (api.sync); pruned after a retention period
+    """
+    POST = 'post'
+    COMMENT = 'comment'
+    KIND_CHOICES = [(POST, 'Post'), (COMMENT, 'Comment')]
+
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    object_id = models.BigIntegerField()
+    # The post itself for posts, the post commented on for comments
+    post_id = models.BigIntegerField()
+    deleted_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        db_table = 'tombstones'
+        indexes = [
+            models.Index(fields=['deleted_at'], name='tombstones_deleted_at_idx'),
+        ]
+
+    def __str__(self):
+        return f'Deleted {self.kind} {self.object_id}'
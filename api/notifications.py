@@ -0,0 +1,188 @@
+"""
+Notification inbox for comments on a member's posts.
+
+CommentListCreateView hands every new comment on somebody else's post to
+notify_comment(), which only queues it in this worker. The queue is written by
+deliver_pending() once the response has been sent (request_finished) and when
+the worker exits, so creating a comment never waits for it. Queued comments of
+a worker that crashes are lost.
+
+Comments on the same post are batched: while a recipient's notification for a
+post is unread, later comments bump its comment_count, actor and updated_at
+instead of adding rows. The unique (recipient, post) constraint on unread rows
+enforces this across workers.
+
+Each member's unread count (unread notifications, not comments) is cached as
+a plain integer and adjusted in place with incr() by deliveries and
+mark_read(), so the header badge is served without a DB query unless the
+entry is missing. ALIAS must increment atomically across workers, as the
+shared memory 'default' cache does. Notifications that cascade with a deleted
+or archived post drop their recipients' entries (forget_unread()), to be
+recounted on the next read. A delivery that lands between a recount and its
+store is missed, so entries still expire UNREAD_TIMEOUT seconds after they
+were counted.
+"""
+import logging
+import threading
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Notification
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    # Needs an atomic incr() across workers
+    'ALIAS': 'default',
+    'UNREAD_TIMEOUT': 300,
+    'MAX_MARK_READ': 100,
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'NOTIFICATIONS', {})}
+
+
+def _cache():
+    return caches[get_config()['ALIAS']]
+
+
+def _unread_key(member_id):
+    return f'notifications:unread:{member_id}'
+
+
+class Outbox:
+    """
+    Per-worker queue of comments waiting to be delivered as notifications
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.pending = []
+
+    def add(self, entry):
+        with self._lock:
+            self.pending.append(entry)
+
+    def drain(self):
+        with self._lock:
+            pending, self.pending = self.pending, []
+        return pending
+
+
+outbox = Outbox()
+
+
+def notify_comment(comment, post):
+    """
+    Queue a notification to the post's author, unless they wrote the comment
+    """
+    if comment.author_id == post.author_id:
+        return
+    outbox.add((post.author_id, post.id, comment.author_id, comment.id, comment.created_at))
+
+
+def deliver_pending(**kwargs):
+    """
+    request_finished receiver: deliver the comments queued by this worker
+    """
+    pending = outbox.drain()
+    if not pending:
+        return
+    try:
+        deliver(pending)
+    except Exception:
+        logger.exception('Delivering %d notifications failed', len(pending))
+
+
+def _add_to_unread(recipient_id, post_id, count, actor_id, comment_id, created_at):
+    return Notification.objects.filter(recipient_id=recipient_id, post_id=post_id, read_at__isnull=True).update(
+        comment_count=F('comment_count') + count,
+        actor_id=actor_id,
+        last_comment_id=comment_id,
+        updated_at=created_at,
+    )
+
+
+def deliver(entries):
+    """
+    Write (recipient_id, post_id, actor_id, comment_id, created_at) entries,
+    one row per recipient and post. Returns the number of notifications created.
+    """
+    batches = {}
+    for recipient_id, post_id, actor_id, comment_id, created_at in entries:
+        batch = batches.get((recipient_id, post_id))
+        if batch is None:
+            batches[recipient_id, post_id] = [1, actor_id, comment_id, created_at]
+            continue
+        batch[0] += 1
+        if comment_id > batch[2]:
+            batch[1:] = [actor_id, comment_id, created_at]
+
+    created = {}
+    for (recipient_id, post_id), (count, actor_id, comment_id, created_at) in batches.items():
+        if _add_to_unread(recipient_id, post_id, count, actor_id, comment_id, created_at):
+            continue
+        try:
+            with transaction.atomic():
+                Notification.objects.create(
+                    recipient_id=recipient_id, post_id=post_id, actor_id=actor_id, last_comment_id=comment_id,
+                    comment_count=count, created_at=created_at, updated_at=created_at,
+                )
+        except IntegrityError:
+            # Another worker created the unread row first, or the post is gone
+            _add_to_unread(recipient_id, post_id, count, actor_id, comment_id, created_at)
+            continue
+        created[recipient_id] = created.get(recipient_id, 0) + 1
+
+    for recipient_id, count in created.items():
+        _adjust_unread(recipient_id, count)
+    return sum(created.values())
+
+
+def _adjust_unread(member_id, delta):
+    try:
+        _cache().incr(_unread_key(member_id), delta)
+    except ValueError:
+        # Not counted (or expired): the next read counts from the table
+        pass
+
+
+def forget_unread(member_ids):
+    """
+    Drop the cached unread counts of members whose notifications were deleted
+    with their posts (deletes and archival)
+    """
+    _cache().delete_many([_unread_key(member_id) for member_id in set(member_ids)])
+
+
+def unread_count(member_id):
+    """
+    Number of unread notifications, from the cache when possible
+    """
+    cache = _cache()
+    key = _unread_key(member_id)
+    count = cache.get(key)
+    if count is not None:
+        return max(0, count)
+    count = Notification.objects.filter(recipient_id=member_id, read_at__isnull=True).count()
+    cache.add(key, count, timeout=get_config()['UNREAD_TIMEOUT'])
+    return count
+
+
+def mark_read(member, ids=None):
+    """
+    Mark the member's unread notifications with the given ids (all if None)
+    as read. Returns the number marked.
+    """
+    notifications = Notification.objects.filter(recipient=member, read_at__isnull=True)
+    if ids is not None:
+        notifications = notifications.filter(id__in=ids)
+    marked = notifications.update(read_at=timezone.now())
+    if marked:
+        _adjust_unread(member.id, -marked)
+    return marked
@@ -0,0 +1,209 @@
+"""
+Keyset ("seek") pagination for feeds that must stay stable while new rows arrive.
+
+The cursor is an opaque token holding the ordering-key values of the last row
+of the previous page, so every page is a single indexed range scan no matter
+how deep the client scrolls.
+"""
+import base64
+import binascii
+import bisect
+import json
+
+from django.db.models import Q
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from . import ranking
+from .threads import subtree_bounds
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(values):
+    raw = json.dumps(values, separators=(',', ':'), default=str)
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token, length):
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (binascii.Error, ValueError, UnicodeDecodeError):
+        raise InvalidCursor(token)
+    if not isinstance(values, list) or len(values) != length:
+        raise InvalidCursor(token)
+    return values
+
+
+class KeysetPagination:
+    """
+    Paginates a queryset in descending order of `keys`, e.g. ('score', 'post_id').
+
+    The last key must be unique so that ties on the leading keys are broken
+    deterministically.
+
+    Keys are read as of each page's query. A row whose keys move above the
+    cursor after the client fetched an earlier page is skipped, and one that
+    moves below it is shown again.
+    """
+    page_size = 10
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+
+    def __init__(self, keys):
+        self.keys = tuple(keys)
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except (TypeError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def _after(self, values):
+        # (k1 < v1) OR (k1 = v1 AND k2 < v2) OR ...
+        condition = Q()
+        for i, key in enumerate(self.keys):
+            clause = Q(**{f'{key}__lt': values[i]})
+            for prev_key, prev_value in zip(self.keys[:i], values[:i]):
+                clause &= Q(**{prev_key: prev_value})
+            condition |= clause
+        return condition
+
+    def paginate_queryset(self, queryset, request):
+        self.request = request
+        page_size = self.get_page_size(request)
+        token = request.query_params.get(self.cursor_query_param)
+        if token:
+            try:
+                queryset = queryset.filter(self._after(decode_cursor(token, len(self.keys))))
+            except (TypeError, ValueError):
+                raise InvalidCursor(token)
+        queryset = queryset.order_by(*[f'-{key}' for key in self.keys])
+
+        rows = list(queryset[:page_size + 1])
+        self.has_next = len(rows) > page_size
+        rows = rows[:page_size]
+        self.next_cursor = None
+        if self.has_next:
+            self.next_cursor = encode_cursor([self._key_value(rows[-1], key) for key in self.keys])
+        return rows
+
+    def _key_value(self, row, key):
+        value = row
+        for part in key.split('__'):
+            value = value[part] if isinstance(value, dict) else getattr(value, part)
+        return value
+
+    def get_next_link(self):
+        if not self.next_cursor:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.next_cursor)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+
+class HotFeedPagination(KeysetPagination):
+    """
+    Pages PostScore rows by (score, post_id), pinned to the ranking the scroll started on.
+
+    The cursor is the last (score, post_id) of the previous page as of the
+    snapshot, plus the snapshot's refresh watermark (see api/ranking.py).
+    Pages are cut from the snapshot and their rows loaded by post_id; past its
+    end they continue as plain keyset pages over live scores.
+    """
+
+    def __init__(self):
+        super().__init__(keys=('score', 'post_id'))
+
+    def paginate_queryset(self, queryset, request):
+        self.request = request
+        page_size = self.get_page_size(request)
+        after, mark = None, None
+        token = request.query_params.get(self.cursor_query_param)
+        if token:
+            values = decode_cursor(token, 4)
+            if not all(isinstance(value, (int, float)) for value in values):
+                raise InvalidCursor(token)
+            after, mark = values[:2], values[2:]
+        mark, pinned = ranking.snapshot(mark)
+
+        keys = []
+        if pinned is not None:
+            # Descending (score, post_id): bisect on the negated pairs
+            start = 0 if after is None else bisect.bisect_right(
+                [(-score, -post_id) for score, post_id in pinned], (-after[0], -after[1])
+            )
+            keys = [list(pair) for pair in pinned[start:start + page_size + 1]]
+            complete = len(pinned) < ranking.get_config()['SNAPSHOT_SIZE']
+            if len(keys) > page_size or complete:
+                return self._page(queryset, [(key, None) for key in keys], page_size, mark)
+            if keys:
+                after = keys[-1]
+
+        live = queryset.filter(self._after(after)) if after is not None else queryset
+        live = live.order_by('-score', '-post_id')[:page_size + 1 - len(keys)]
+        entries = [(key, None) for key in keys]
+        entries += [([self._key_value(row, key) for key in self.keys], row) for row in live]
+        return self._page(queryset, entries, page_size, mark)
+
+    def _page(self, queryset, entries, page_size, mark):
+        """
+        Rows of the first page_size (key, row) entries, loading those taken from the snapshot
+        """
+        self.has_next = len(entries) > page_size
+        entries = entries[:page_size]
+        self.next_cursor = encode_cursor(entries[-1][0] + mark) if self.has_next else None
+        pinned = [key[1] for key, row in entries if row is None]
+        loaded = {}
+        if pinned:
+            loaded = {self._key_value(row, 'post_id'): row for row in queryset.filter(post_id__in=pinned)}
+        # Posts deleted since the snapshot are left out
+        return [
+            row if row is not None else loaded[key[1]]
+            for key, row in entries
+            if row is not None or key[1] in loaded
+        ]
+
+
+class ThreadPagination(KeysetPagination):
+    """
+    Pages a comment thread by top-level comment, oldest first.
+
+    Each page holds whole threads: its top-level comments and all of their
+    replies in display order, loaded with one range scan over the paths from
+    the first to the last top-level comment of the page.
+    """
+    page_size = 20
+
+    def __init__(self):
+        super().__init__(keys=('path',))
+
+    def paginate_queryset(self, queryset, request):
+        self.request = request
+        page_size = self.get_page_size(request)
+        roots = queryset.filter(depth=0)
+        token = request.query_params.get(self.cursor_query_param)
+        if token:
+            (after,) = decode_cursor(token, 1)
+            if not isinstance(after, str):
+                raise InvalidCursor(token)
+            roots = roots.filter(path__gt=after)
+
+        root_paths = list(roots.order_by('path').values_list('path', flat=True)[:page_size + 1])
+        self.has_next = len(root_paths) > page_size
+        root_paths = root_paths[:page_size]
+        self.next_cursor = encode_cursor([root_paths[-1]]) if self.has_next else None
+        if not root_paths:
+            return []
+        _, end = subtree_bounds(root_paths[-1])
+        return list(queryset.filter(path__gte=root_paths[0], path__lt=end).order_by('path'))
@@ -0,0 +1,10 @@
+from rest_framework.permissions import BasePermission
+
+
+class IsStaff(BasePermission):
+    """
+    Allows access only to members flagged as staff
+    """
+
+    def has_permission(self, request, view):
+        return bool(request.user and getattr(request.user, 'is_staff', False))
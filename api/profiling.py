@@ -0,0 +1,288 @@
+"""
+On-demand profiles of single requests, for staff.
+
+A staff member adds "X-Profile: 1" (or ?_profile=1) to any request and
+RequestProfilerMiddleware runs the view (DRF dispatch and response rendering)
+under cProfile. "X-Profile: sample" uses a sampling profiler instead: a thread
+records the view's stack every SAMPLE_INTERVAL seconds, which adds almost no
+overhead to what it measures and yields folded stacks for a flame graph
+(flamegraph.pl, speedscope). The sampler needs the GIL to take a sample, so it
+gets at most one per switch interval (5 ms by default) while the view runs
+Python code: use it for slow requests, cProfile for fast ones. Either way the SQL the view runs is recorded as a
+timeline next to the profile.
+
+Profiles are stored in DIRECTORY (shared by all workers, newest KEEP kept) as
+<id>.json plus the raw <id>.prof (pstats) or <id>.folded file, listed at
+/api/metrics/profiles/. The response carries the profile id in X-Profile-Id.
+
+Untriggered requests only pay for a header lookup. The header is ignored for
+anyone but staff, which costs one query when it is sent.
+"""
+import cProfile
+import json
+import os
+import pstats
+import re
+import secrets
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone as dt_timezone
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connection
+
+from .authentication import session_member_id
+from .models import Member
+
+DEFAULTS = {
+    'ENABLED': True,
+    'HEADER': 'X-Profile',
+    'QUERY_PARAM': '_profile',
+    'SAMPLE_INTERVAL': 0.001,
+    'TOP_FUNCTIONS': 40,
+    'MAX_QUERIES': 500,
+    'KEEP': 100,
+    'DIRECTORY': None,
+}
+
+MODES = {'1': 'cprofile', 'cprofile': 'cprofile', 'sample': 'sample'}
+
+_PROFILE_ID = re.compile(r'^\d{8}T\d{6}-\d+-[0-9a-f]{6}$')
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'PROFILER', {})}
+
+
+def _directory():
+    directory = get_config()['DIRECTORY']
+    return Path(directory) if directory else Path(settings.BASE_DIR) / 'persistent' / 'profiles'
+
+
+def requested_mode(request, config):
+    """
+    Profiler mode asked for by the request, None if it asks for none
+    """
+    value = request.headers.get(config['HEADER'])
+    if value is None and config['QUERY_PARAM'] in request.META.get('QUERY_STRING', ''):
+        value = request.GET.get(config['QUERY_PARAM'])
+    return MODES.get(value.lower()) if value else None
+
+
+def is_staff(request):
+    member_id = session_member_id(request)
+    return bool(member_id) and Member.objects.filter(id=member_id, is_staff=True).exists()
+
+
+def _short_path(filename):
+    base = str(settings.BASE_DIR) + os.sep
+    if filename.startswith(base):
+        return filename[len(base):]
+    if 'site-packages' + os.sep in filename:
+        return filename.split('site-packages' + os.sep, 1)[1]
+    return filename
+
+
+def _label(code):
+    return f'{_short_path(code.co_filename)}:{code.co_qualname}'
+
+
+class SqlTimeline:
+    """
+    Execute wrapper recording when each query started and how long it took
+    """
+
+    def __init__(self, started, limit):
+        self.started = started
+        self.limit = limit
+        self.queries = []
+        self.dropped = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            if len(self.queries) < self.limit:
+                self.queries.append({
+                    'start_ms': round((started - self.started) * 1000, 3),
+                    'ms': round((time.perf_counter() - started) * 1000, 3),
+                    'sql': sql[:2000],
+                    'many': many,
+                })
+            else:
+                self.dropped += 1
+
+
+class Sampler(threading.Thread):
+    """
+    Counts the stacks of one thread below `root`, sampled every `interval`
+    """
+
+    def __init__(self, thread_id, root, interval):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.root = root
+        self.interval = interval
+        self.stacks = Counter()
+        self.finished = threading.Event()
+
+    def run(self):
+        while not self.finished.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None and frame.f_code is not self.root:
+                stack.append(_label(frame.f_code))
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+
+def _run(view_func, request, args, kwargs):
+    response = view_func(request, *args, **kwargs)
+    if callable(getattr(response, 'render', None)) and not response.is_rendered:
+        response.render()
+    return response
+
+
+def _top_functions(profiler, limit):
+    stats = pstats.Stats(profiler).stats
+    callees = {}
+    for function, (_, _, _, _, callers) in stats.items():
+        for caller, (_, _, _, cumulative) in callers.items():
+            callees.setdefault(caller, []).append((cumulative, function))
+
+    def label(function):
+        filename, line, name = function
+        return f'{_short_path(filename)}:{line}:{name}'
+
+    ranked = sorted(stats.items(), key=lambda item: item[1][3], reverse=True)[:limit]
+    return [
+        {
+            'function': label(function),
+            'calls': calls,
+            'self_ms': round(own * 1000, 3),
+            'cumulative_ms': round(cumulative * 1000, 3),
+            'callees': [
+                {'function': label(callee), 'cumulative_ms': round(callee_cumulative * 1000, 3)}
+                for callee_cumulative, callee in sorted(callees.get(function, []), reverse=True)[:5]
+            ],
+        }
+        for function, (_, calls, own, cumulative, _) in ranked
+    ]
+
+
+def profile_view(request, view_func, view_args, view_kwargs, mode):
+    """
+    Run a view under the profiler, store the profile and return the response
+    """
+    config = get_config()
+    started = time.perf_counter()
+    timeline = SqlTimeline(started, config['MAX_QUERIES'])
+    profiler = sampler = None
+    if mode == 'cprofile':
+        profiler = cProfile.Profile()
+    else:
+        sampler = Sampler(threading.get_ident(), _run.__code__, config['SAMPLE_INTERVAL'])
+        sampler.start()
+
+    response = None
+    try:
+        with connection.execute_wrapper(timeline):
+            if profiler is not None:
+                response = profiler.runcall(_run, view_func, request, view_args, view_kwargs)
+            else:
+                response = _run(view_func, request, view_args, view_kwargs)
+    finally:
+        elapsed_ms = round((time.perf_counter() - started) * 1000, 3)
+        if sampler is not None:
+            sampler.finished.set()
+            sampler.join()
+        match = request.resolver_match
+        profile = {
+            'id': f"{time.strftime('%Y%m%dT%H%M%S', time.gmtime())}-{os.getpid()}-{secrets.token_hex(3)}",
+            'created_at': datetime.now(dt_timezone.utc).isoformat(),
+            'mode': mode,
+            'method': request.method,
+            'path': request.get_full_path(),
+            'route': match.route if match else None,
+            'member_id': session_member_id(request),
+            'status': response.status_code if response is not None else None,
+            'elapsed_ms': elapsed_ms,
+            'sql_ms': round(sum(query['ms'] for query in timeline.queries), 3),
+            'query_count': len(timeline.queries) + timeline.dropped,
+            'queries': timeline.queries,
+        }
+        if profiler is not None:
+            profile['functions'] = _top_functions(profiler, config['TOP_FUNCTIONS'])
+        else:
+            profile['samples'] = sum(sampler.stacks.values())
+            profile['interval_ms'] = config['SAMPLE_INTERVAL'] * 1000
+        save(profile, profiler=profiler, stacks=sampler.stacks if sampler else None)
+    response['X-Profile-Id'] = profile['id']
+    return response
+
+
+def save(profile, profiler=None, stacks=None):
+    directory = _directory()
+    directory.mkdir(parents=True, exist_ok=True)
+    if profiler is not None:
+        profiler.dump_stats(directory / f"{profile['id']}.prof")
+    if stacks is not None:
+        (directory / f"{profile['id']}.folded").write_text(
+            ''.join(f'{stack} {count}\n' for stack, count in stacks.most_common())
+        )
+    # Written last: a listed profile always has its raw file
+    partial = directory / f"{profile['id']}.json.partial"
+    partial.write_text(json.dumps(profile))
+    os.replace(partial, directory / f"{profile['id']}.json")
+    rotate()
+
+
+def rotate(keep=None):
+    keep = get_config()['KEEP'] if keep is None else keep
+    manifests = sorted(_directory().glob('*.json'))
+    for manifest in manifests[:max(0, len(manifests) - keep)]:
+        for suffix in ('.json', '.prof', '.folded'):
+            manifest.with_suffix(suffix).unlink(missing_ok=True)
+
+
+_SUMMARY_FIELDS = ('id', 'created_at', 'mode', 'method', 'path', 'route', 'member_id', 'status',
+                   'elapsed_ms', 'sql_ms', 'query_count')
+
+
+def list_profiles():
+    """
+    Summaries of the stored profiles, newest first
+    """
+    profiles = []
+    for manifest in sorted(_directory().glob('*.json'), reverse=True):
+        try:
+            profile = json.loads(manifest.read_text())
+        except (OSError, ValueError):
+            continue
+        profiles.append({field: profile.get(field) for field in _SUMMARY_FIELDS})
+    return profiles
+
+
+def load(profile_id):
+    """
+    (profile, raw file path) or (None, None) if there is no such profile
+    """
+    if not _PROFILE_ID.match(profile_id):
+        return None, None
+    manifest = _directory() / f'{profile_id}.json'
+    try:
+        profile = json.loads(manifest.read_text())
+    except (OSError, ValueError):
+        return None, None
+    raw = manifest.with_suffix('.prof' if profile['mode'] == 'cprofile' else '.folded')
+    if profile['mode'] == 'sample':
+        try:
+            profile['folded'] = raw.read_text().splitlines()
+        except OSError:
+            profile['folded'] = []
+    return profile, raw
@@ -0,0 +1,293 @@
+"""
+Opt-in slow-query log with SQL fingerprinting.
+
+QueryLogger is installed as an execute wrapper on every new DB connection when
+SLOW_QUERY_LOG['ENABLED'] is set. Every query is timed (two perf_counter calls).
+A SAMPLE_RATE fraction of queries is normalized into a fingerprint that feeds
+rolling per-fingerprint latency stats. Every query slower than THRESHOLD_MS is
+always fingerprinted, and its EXPLAIN QUERY PLAN, route and Python call site
+are kept.
+
+Each worker periodically writes its state to <DIRECTORY>/<pid>.json. The
+`slow_queries` management command and /api/metrics/queries/ merge those files,
+so the numbers cover every worker on the host. Files of processes that are no
+longer running (recycled or crashed workers), or not rewritten for STATE_TTL
+seconds, are deleted on every flush and merge. A live worker writes its whole
+state on its next flush, so that loses nothing of it.
+"""
+import hashlib
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import deque
+from pathlib import Path
+
+from django.conf import settings
+
+DEFAULTS = {
+    'ENABLED': False,
+    'SAMPLE_RATE': 0.1,
+    'THRESHOLD_MS': 100,
+    'MAX_FINGERPRINTS': 500,
+    'LATENCY_SAMPLES': 200,
+    'SLOW_KEPT': 100,
+    'FLUSH_INTERVAL': 10,
+    # State files older than this are deleted even if their pid is running (reused pids)
+    'STATE_TTL': 3600,
+    'DIRECTORY': None,
+}
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_IN_LIST = re.compile(r'\((?:\s*(?:%s|\?)\s*,)+\s*(?:%s|\?)\s*\)')
+_SPACE = re.compile(r'\s+')
+
+_state = threading.local()
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'SLOW_QUERY_LOG', {})}
+
+
+def _directory():
+    directory = get_config()['DIRECTORY']
+    return Path(directory) if directory else Path(settings.BASE_DIR) / 'persistent' / 'querylog'
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def prune(directory=None):
+    """
+    Delete the state files of dead processes and those not updated for STATE_TTL
+    """
+    directory = directory or _directory()
+    if not directory.exists():
+        return 0
+    oldest = time.time() - get_config()['STATE_TTL']
+    pruned = 0
+    for path in directory.glob('*.json'):
+        try:
+            pid = int(path.stem)
+            stale = pid != os.getpid() and (not _alive(pid) or path.stat().st_mtime < oldest)
+        except (ValueError, OSError):
+            continue
+        if stale:
+            path.unlink(missing_ok=True)
+            pruned += 1
+    return pruned
+
+
+def fingerprint(sql):
+    """
+    Normalize SQL so that queries differing only in literals share a fingerprint
+    """
+    normalized = _STRING.sub('?', sql)
+    normalized = _NUMBER.sub('?', normalized)
+    normalized = _IN_LIST.sub('(...)', normalized.replace('%s', '?'))
+    normalized = _SPACE.sub(' ', normalized).strip()
+    return hashlib.blake2b(normalized.encode(), digest_size=8).hexdigest(), normalized
+
+
+def set_route(route):
+    _state.route = route
+
+
+def _call_site():
+    base = str(settings.BASE_DIR)
+    frame = sys._getframe(2)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if filename.startswith(base) and not filename.endswith(('querylog.py', 'middleware.py')):
+            return f'{os.path.relpath(filename, base)}:{frame.f_lineno} in {frame.f_code.co_name}'
+        frame = frame.f_back
+    return None
+
+
+class QueryLogger:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.fingerprints = {}
+        self.slow = deque()
+        self.total_queries = 0
+        self.last_flush = time.monotonic()
+
+    def __call__(self, execute, sql, params, many, context):
+        if getattr(_state, 'explaining', False):
+            return execute(sql, params, many, context)
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            self.record(sql, params, many, context, elapsed_ms)
+
+    def record(self, sql, params, many, context, elapsed_ms):
+        config = get_config()
+        self.total_queries += 1
+        slow = elapsed_ms >= config['THRESHOLD_MS']
+        if not slow and random.random() >= config['SAMPLE_RATE']:
+            return
+
+        key, normalized = fingerprint(sql)
+        with self._lock:
+            stats = self.fingerprints.get(key)
+            if stats is None:
+                if len(self.fingerprints) >= config['MAX_FINGERPRINTS']:
+                    return
+                stats = self.fingerprints[key] = {
+                    'sql': normalized,
+                    'count': 0,
+                    'total_ms': 0.0,
+                    'max_ms': 0.0,
+                    'slow_count': 0,
+                    'samples': deque(maxlen=config['LATENCY_SAMPLES']),
+                }
+            stats['count'] += 1
+            stats['total_ms'] += elapsed_ms
+            stats['max_ms'] = max(stats['max_ms'], elapsed_ms)
+            stats['samples'].append(round(elapsed_ms, 3))
+            if slow:
+                stats['slow_count'] += 1
+
+        if slow:
+            entry = {
+                'fingerprint': key,
+                'at': time.time(),
+                'ms': round(elapsed_ms, 3),
+                'sql': sql,
+                'route': getattr(_state, 'route', None),
+                'call_site': _call_site(),
+                'plan': None if many else self.explain(context['connection'], sql, params),
+            }
+            with self._lock:
+                if self.slow.maxlen != config['SLOW_KEPT']:
+                    self.slow = deque(self.slow, maxlen=config['SLOW_KEPT'])
+                self.slow.append(entry)
+
+    def explain(self, connection, sql, params):
+        if not sql.lstrip().upper().startswith(('SELECT', 'WITH')) or connection.vendor != 'sqlite':
+            return None
+        _state.explaining = True
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+                return [row[-1] for row in cursor.fetchall()]
+        except Exception as exc:
+            return [f'EXPLAIN failed: {exc}']
+        finally:
+            _state.explaining = False
+
+    def state(self):
+        with self._lock:
+            return {
+                'pid': os.getpid(),
+                'updated_at': time.time(),
+                'total_queries': self.total_queries,
+                'fingerprints': {
+                    key: {**stats, 'samples': list(stats['samples'])}
+                    for key, stats in self.fingerprints.items()
+                },
+                'slow': list(self.slow),
+            }
+
+    def maybe_flush(self, force=False):
+        if not force and time.monotonic() - self.last_flush < get_config()['FLUSH_INTERVAL']:
+            return
+        self.last_flush = time.monotonic()
+        directory = _directory()
+        directory.mkdir(parents=True, exist_ok=True)
+        target = directory / f'{os.getpid()}.json'
+        temporary = target.with_suffix('.tmp')
+        temporary.write_text(json.dumps(self.state(), default=str))
+        os.replace(temporary, target)
+        prune(directory)
+
+
+logger = QueryLogger()
+
+
+def install(sender, connection, **kwargs):
+    """
+    connection_created receiver: wrap every query of the new connection
+    """
+    if logger not in connection.execute_wrappers:
+        connection.execute_wrappers.append(logger)
+
+
+def _percentile(ordered, fraction):
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def merged_report(sort='total_ms', top=20):
+    """
+    Merge the state files of all workers (and this process) into one report
+    """
+    directory = _directory()
+    prune(directory)
+    states = {}
+    if directory.exists():
+        for path in directory.glob('*.json'):
+            try:
+                state = json.loads(path.read_text())
+            except (OSError, ValueError):
+                continue
+            states[state['pid']] = state
+    if logger.total_queries:
+        states[os.getpid()] = logger.state()
+
+    fingerprints = {}
+    slow = []
+    for state in states.values():
+        slow.extend(state['slow'])
+        for key, stats in state['fingerprints'].items():
+            merged = fingerprints.setdefault(key, {
+                'fingerprint': key, 'sql': stats['sql'], 'count': 0, 'total_ms': 0.0,
+                'max_ms': 0.0, 'slow_count': 0, 'samples': [],
+            })
+            merged['count'] += stats['count']
+            merged['total_ms'] += stats['total_ms']
+            merged['max_ms'] = max(merged['max_ms'], stats['max_ms'])
+            merged['slow_count'] += stats['slow_count']
+            merged['samples'].extend(stats['samples'])
+
+    rows = []
+    for merged in fingerprints.values():
+        ordered = sorted(merged.pop('samples'))
+        merged['mean_ms'] = round(merged['total_ms'] / merged['count'], 3)
+        merged['p50_ms'] = _percentile(ordered, 0.5)
+        merged['p95_ms'] = _percentile(ordered, 0.95)
+        merged['total_ms'] = round(merged['total_ms'], 3)
+        rows.append(merged)
+    rows.sort(key=lambda row: row.get(sort) or 0, reverse=True)
+    slow.sort(key=lambda entry: entry['at'], reverse=True)
+    return {
+        'workers': sorted(states),
+        'sampled_queries': sum(row['count'] for row in rows),
+        'fingerprints': rows[:top],
+        'slow': slow[:top],
+    }
+
+
+def reset():
+    directory = _directory()
+    if directory.exists():
+        for path in directory.glob('*.json'):
+            path.unlink(missing_ok=True)
+    with logger._lock:
+        logger.fingerprints.clear()
+        logger.slow.clear()
+        logger.total_queries = 0
@@ -0,0 +1,94 @@
+"""
+Query-plan regression checks.
+
+record_statements() collects the SELECTs a block of code runs, and
+plan_problems() reports the EXPLAIN QUERY PLAN steps that read a whole table
+(a SCAN without an index) or sort rows in a temp B-tree, i.e. the queries that
+get slower as tables grow. Walking an index in order (SCAN ... USING INDEX) is
+fine: the list queries stop after one page.
+
+RouteBudgetTests checks the plan of every query each route runs, so a dropped
+index or a new ordering without one fails the test suite. ALLOWED lists the
+steps that are expected anyway, each with its reason.
+"""
+import re
+from contextlib import contextmanager
+
+_FULL_SCAN = re.compile(r'^SCAN (\w+)$')
+_TEMP_SORT = re.compile(r'USE TEMP B-TREE FOR (ORDER BY|GROUP BY|DISTINCT|RIGHT PART OF ORDER BY)')
+
+# (plan step pattern, SQL pattern) -> why the step is acceptable
+ALLOWED = {
+    (
+        r'^USE TEMP B-TREE FOR ORDER BY$',
+        r'^SELECT "comments"\."id" FROM "comments" WHERE "comments"\."parent_id" IN \(',
+    ):
+        "Django's delete collector reads the replies of the comments being deleted in Meta.ordering; "
+        "it only sorts rows that are deleted next",
+    (
+        r'^SCAN members$',
+        r'^SELECT "members"\."id" AS "id", "members"\."username" AS "username", '
+        r'"members"\."email" AS "email" FROM "members"$',
+    ):
+        "api.availability reads every username and email once per worker to build its Bloom filter",
+}
+
+
+class StatementRecorder:
+    """
+    Execute wrapper collecting (sql, params) of every SELECT
+    """
+
+    def __init__(self):
+        self.statements = []
+
+    def __call__(self, execute, sql, params, many, context):
+        if not many and sql.lstrip().upper().startswith(('SELECT', 'WITH')):
+            self.statements.append((sql, params))
+        return execute(sql, params, many, context)
+
+
+@contextmanager
+def record_statements(connection):
+    recorder = StatementRecorder()
+    with connection.execute_wrapper(recorder):
+        yield recorder.statements
+
+
+def explain(connection, sql, params):
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+        return [row[-1] for row in cursor.fetchall()]
+
+
+def _allowed(step, sql):
+    return any(
+        re.search(step_pattern, step) and re.search(sql_pattern, sql)
+        for step_pattern, sql_pattern in ALLOWED
+    )
+
+
+def plan_problems(connection, statements):
+    """
+    [(sql, plan, offending steps)] for the statements whose plans scan a whole
+    table or sort in a temp B-tree
+    """
+    if connection.vendor != 'sqlite':
+        return []
+    problems = []
+    for sql, params in statements:
+        plan = explain(connection, sql, params)
+        offending = [
+            step for step in plan
+            if (_FULL_SCAN.match(step) or _TEMP_SORT.search(step)) and not _allowed(step, sql)
+        ]
+        if offending:
+            problems.append((sql, plan, offending))
+    return problems
+
+
+def format_problems(problems):
+    return '\n'.join(
+        f'  {sql}\n' + ''.join(f'    {"!" if step in offending else " "} {step}\n' for step in plan)
+        for sql, plan, offending in problems
+    )
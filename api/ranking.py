@@ -0,0 +1,184 @@
+"""
+Hot feed ranking.
+
+A post's score is tau * ln(sum_i exp((t_i - EPOCH) / tau)) over its activity
+events (its creation and every comment), with tau = half_life / ln 2. Ranking by
+this value is the same as ranking by the exponentially decayed event count at
+any moment, because every post decays by the same factor as time passes. So a
+score only has to change when new comments arrive, and the refresh job only
+touches posts that received comments since its last run.
+
+A scroll through the hot feed is pinned to the ranking it started on. The
+first page reads the refresh watermark (the highest scored post and comment
+ids) and, in the same statement, the top SNAPSHOT_SIZE (score, post_id)
+pairs, and caches them under that watermark. Scores only change as the
+watermark moves, so every scroll started between two refreshes shares one
+snapshot. The watermark travels in the cursor and later pages are cut from
+the same snapshot while refreshes move scores underneath: a post commented on
+mid-scroll keeps its place and is neither skipped nor repeated. Past the end
+of the snapshot, or once it has left the cache, pages continue from live
+scores, where a post that rises above the cursor is skipped (scores only
+grow, so none is shown twice).
+"""
+import math
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import Func, Max, Subquery
+from django.utils import timezone
+
+from .models import Comment, Post, PostScore
+
+EPOCH = datetime(2024, 1, 1, tzinfo=dt_timezone.utc)
+
+DEFAULTS = {
+    'HALF_LIFE_HOURS': 12,
+    'BATCH_SIZE': 1000,
+    'REFRESH_INTERVAL': 60,
+    # Top of the ranking pinned per scroll session; 0 pages from live scores only
+    'SNAPSHOT_SIZE': 1000,
+    'SNAPSHOT_ALIAS': 'hot',
+    'SNAPSHOT_TIMEOUT': 3600,
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'HOT_FEED', {})}
+
+
+def _tau():
+    return get_config()['HALF_LIFE_HOURS'] * 3600 / math.log(2)
+
+
+def event_score(when):
+    # A single event's score is simply its age relative to EPOCH, in seconds
+    return (when - EPOCH).total_seconds()
+
+
+def combine(score, when, tau=None):
+    """
+    Add one activity event at `when` to an existing log-domain score
+    """
+    tau = tau or _tau()
+    event = event_score(when)
+    high, low = max(score, event), min(score, event)
+    return high + tau * math.log1p(math.exp((low - high) / tau))
+
+
+def _new_posts(batch_size):
+    last_post_id = PostScore.objects.aggregate(m=Max('post_id'))['m'] or 0
+    created = 0
+    while True:
+        batch = list(
+            Post.objects.filter(id__gt=last_post_id)
+            .order_by('id')
+            .values_list('id', 'created_at')[:batch_size]
+        )
+        if not batch:
+            return created
+        PostScore.objects.bulk_create(
+            [PostScore(post_id=post_id, score=event_score(created_at)) for post_id, created_at in batch],
+            ignore_conflicts=True,
+        )
+        created += len(batch)
+        last_post_id = batch[-1][0]
+
+
+def _new_comments(batch_size, tau):
+    last_comment_id = PostScore.objects.aggregate(m=Max('last_comment_id'))['m'] or 0
+    updated = set()
+    while True:
+        batch = list(
+            Comment.objects.filter(id__gt=last_comment_id)
+            .order_by('id')
+            .values_list('id', 'post_id', 'created_at')[:batch_size]
+        )
+        if not batch:
+            return len(updated)
+
+        post_ids = {post_id for _, post_id, _ in batch}
+        with transaction.atomic():
+            scores = PostScore.objects.select_for_update().in_bulk(post_ids)
+            missing = post_ids - scores.keys()
+            if missing:
+                for post_id, created_at in Post.objects.filter(id__in=missing).values_list('id', 'created_at'):
+                    scores[post_id] = PostScore(post_id=post_id, score=event_score(created_at))
+                PostScore.objects.bulk_create(
+                    [scores[post_id] for post_id in missing if post_id in scores],
+                    ignore_conflicts=True,
+                )
+
+            now = timezone.now()
+            changed = {}
+            for comment_id, post_id, created_at in batch:
+                row = scores.get(post_id)
+                # Rows already past this comment were updated by an earlier run
+                if row is None or comment_id <= row.last_comment_id:
+                    continue
+                row.score = combine(row.score, created_at, tau)
+                row.last_comment_id = comment_id
+                row.updated_at = now
+                changed[post_id] = row
+            PostScore.objects.bulk_update(changed.values(), ['score', 'last_comment_id', 'updated_at'])
+        updated.update(changed)
+        last_comment_id = batch[-1][0]
+
+
+def refresh_scores(rebuild=False):
+    """
+    Bring post_scores up to date with posts and comments created since the last run.
+
+    Returns (new_posts, rescored_posts).
+    """
+    config = get_config()
+    if rebuild:
+        PostScore.objects.all().delete()
+    new_posts = _new_posts(config['BATCH_SIZE'])
+    rescored = _new_comments(config['BATCH_SIZE'], _tau())
+    return new_posts, rescored
+
+
+def _snapshot_key(mark):
+    return f'hot-feed:snapshot:{mark[0]}:{mark[1]}'
+
+
+def _watermarks():
+    """
+    The refresh watermark (highest scored post id and comment id) as annotations
+    """
+    return {
+        f'mark_{name}': Subquery(PostScore.objects.annotate(top=Func(field, function='MAX')).values('top'))
+        for name, field in (('post', 'post_id'), ('comment', 'last_comment_id'))
+    }
+
+
+def snapshot(mark=None):
+    """
+    Return (mark, ranking): a refresh watermark and the top SNAPSHOT_SIZE
+    (score, post_id) pairs as of it, best first.
+
+    Without `mark` the current watermark is read, and its ranking built if no
+    scroll has cached it yet. With `mark` (from a cursor) only the cache is
+    consulted, and ranking is None once that snapshot is gone.
+    """
+    config = get_config()
+    if not config['SNAPSHOT_SIZE']:
+        return mark or [0, 0], None
+    cache = caches[config['SNAPSHOT_ALIAS']]
+    if mark is not None:
+        return mark, cache.get(_snapshot_key(mark))
+
+    ranked = PostScore.objects.annotate(**_watermarks()).order_by('-score', '-post_id')
+    latest = ranked.values_list('mark_post', 'mark_comment').first()
+    mark = list(latest or (0, 0))
+    ranking = cache.get(_snapshot_key(mark))
+    if ranking is None:
+        # The watermark comes with the ranking, in the same statement, in case a refresh ran in between
+        rows = list(ranked.values_list('score', 'post_id', 'mark_post', 'mark_comment')[:config['SNAPSHOT_SIZE']])
+        if rows:
+            mark = list(rows[0][2:])
+        ranking = [(score, post_id) for score, post_id, _, _ in rows]
+        cache.set(_snapshot_key(mark), ranking, timeout=config['SNAPSHOT_TIMEOUT'])
+    return mark, ranking
@@ -0,0 +1,25 @@
+"""
+OpenAPI decorators that cost nothing outside of schema generation.
+
+drf-spectacular (and yaml, uritemplate and jsonschema behind it) is only needed
+to generate the schema, which happens once at image build time. In every other
+process extend_schema is a no-op and drf_spectacular is never imported.
+"""
+from django.conf import settings
+
+if settings.SCHEMA_BUILD:
+    from drf_spectacular.utils import extend_schema, OpenApiParameter  # noqa: F401
+else:
+    def extend_schema(*args, **kwargs):
+        def decorator(func):
+            return func
+        return decorator
+
+    class OpenApiParameter:
+        QUERY = 'query'
+        PATH = 'path'
+        HEADER = 'header'
+        COOKIE = 'cookie'
+
+        def __init__(self, *args, **kwargs):
+            pass
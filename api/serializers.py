@@ -1,8 +1,36 @@
+from django.db import transaction
 from rest_framework import serializers
-from api.models import Member, Post, Comment
+from api.models import Member, Post, Comment, Mention, Notification
+from api import availability, likes, notifications, threads
 
 
-class MemberSerializer(serializers.ModelSerializer):
+class ShapedSerializerMixin:
+    """
+    Optional `fields` (sparse fieldset), `member_fields` (sparse fieldset of the
+    nested author) and `compact` (nested author replaced by author_id) keyword
+    arguments, also honoured with many=True
+    """
+
+    def __init__(self, *args, **kwargs):
+        fields = kwargs.pop('fields', None)
+        member_fields = kwargs.pop('member_fields', None)
+        compact = kwargs.pop('compact', False)
+        super().__init__(*args, **kwargs)
+        if compact and 'author' in self.fields:
+            self.fields.pop('author')
+            self.fields['author_id'] = serializers.IntegerField(read_only=True)
+        elif member_fields is not None and 'author' in self.fields:
+            self.fields['author'] = MemberSerializer(read_only=True, fields=member_fields)
+        if fields is not None:
+            keep = set(fields)
+            if 'author' in keep:
+                keep.add('author_id')
+            for name in list(self.fields):
+                if name not in keep:
+                    self.fields.pop(name)
+
+
+class MemberSerializer(ShapedSerializerMixin, serializers.ModelSerializer):
     """Serializer for Member model - displays user data"""
     class Meta:
         model = Member
@@ -46,23 +74,66 @@ class RegisterSerializer(serializers.Serializer):
         )
         member.set_password(validated_data['password'])
         member.save()
+        availability.index.record(member)
         return member
 
 
+class AvailabilitySerializer(serializers.Serializer):
+    """Query parameters of the availability check - a username, an email or both"""
+    username = serializers.CharField(max_length=150, required=False)
+    email = serializers.EmailField(max_length=254, required=False)
+
+    def validate(self, attrs):
+        if not attrs:
+            raise serializers.ValidationError('Provide a username, an email or both')
+        return attrs
+
+
 class LoginSerializer(serializers.Serializer):
     """Serializer for user login"""
     username = serializers.CharField(required=True)
     password = serializers.CharField(required=True, write_only=True)
 
 
-class PostSerializer(serializers.ModelSerializer):
+def _request_member(context):
+    request = context.get('request')
+    return getattr(request, 'user', None)
+
+
+class PostListSerializer(serializers.ListSerializer):
+    """Looks up liked_by_me for the whole list with one query"""
+
+    def to_representation(self, data):
+        posts = list(data.all() if hasattr(data, 'all') else data)
+        if 'liked_by_me' in self.child.fields and 'liked_post_ids' not in self.context:
+            self.context['liked_post_ids'] = likes.liked_post_ids(
+                _request_member(self.context), [post.id for post in posts]
+            )
+        return super().to_representation(posts)
+
+
+class PostSerializer(ShapedSerializerMixin, serializers.ModelSerializer):
     """Serializer for Post model - displays post data"""
     author = MemberSerializer(read_only=True)
+    likes_count = serializers.SerializerMethodField()
+    liked_by_me = serializers.SerializerMethodField()
 
     class Meta:
         model = Post
-        fields = ['id', 'content', 'author', 'created_at', 'updated_at']
-        read_only_fields = ['id', 'author', 'created_at', 'updated_at']
+        fields = ['id', 'content', 'author', 'likes_count', 'liked_by_me', 'created_at', 'updated_at']
+        read_only_fields = ['id', 'author', 'likes_count', 'liked_by_me', 'created_at', 'updated_at']
+        list_serializer_class = PostListSerializer
+
+    def get_likes_count(self, obj):
+        """Stored count plus this worker's unflushed likes"""
+        return likes.approximate_count(obj.id, obj.likes_count)
+
+    def get_liked_by_me(self, obj):
+        """Whether the requesting member likes the post (from the list-wide lookup if there is one)"""
+        liked_post_ids = self.context.get('liked_post_ids')
+        if liked_post_ids is None:
+            liked_post_ids = likes.liked_post_ids(_request_member(self.context), [obj.id])
+        return obj.id in liked_post_ids
 
 
 class PostCreateSerializer(serializers.ModelSerializer):
@@ -78,22 +149,27 @@ class PostCreateSerializer(serializers.ModelSerializer):
         return value
 
 
-class CommentSerializer(serializers.ModelSerializer):
+class CommentSerializer(ShapedSerializerMixin, serializers.ModelSerializer):
     """Serializer for Comment model - displays comment data"""
     author = MemberSerializer(read_only=True)
-    post_id = serializers.IntegerField(source='post.id', read_only=True)
+    post_id = serializers.IntegerField(read_only=True)
+    parent_id = serializers.IntegerField(read_only=True, allow_null=True)
 
     class Meta:
         model = Comment
-        fields = ['id', 'content', 'author', 'post_id', 'created_at', 'updated_at']
-        read_only_fields = ['id', 'author', 'post_id', 'created_at', 'updated_at']
+        fields = ['id', 'content', 'author', 'post_id', 'parent_id', 'depth', 'created_at', 'updated_at']
+        read_only_fields = ['id', 'author', 'post_id', 'parent_id', 'depth', 'created_at', 'updated_at']
 
 
 class CommentCreateSerializer(serializers.ModelSerializer):
-    """Serializer for creating a comment"""
+    """Serializer for creating a comment or a reply (expects the post in context)"""
+    parent_id = serializers.PrimaryKeyRelatedField(
+        source='parent', queryset=Comment.objects.all(), required=False, allow_null=True
+    )
+
     class Meta:
         model = Comment
-        fields = ['content']
+        fields = ['content', 'parent_id']
 
     def validate_content(self, value):
         """Validate content length"""
@@ -101,6 +177,76 @@ class CommentCreateSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError("Content is too long (max 2000 characters)")
         return value
 
+    def validate_parent_id(self, value):
+        """Replies must stay on the same post and within the nesting limit"""
+        if value is None:
+            return value
+        if value.post_id != self.context['post'].id:
+            raise serializers.ValidationError("Parent comment belongs to another post")
+        if value.depth >= threads.MAX_DEPTH:
+            raise serializers.ValidationError(
+                f"Replies cannot be nested more than {threads.MAX_DEPTH} levels deep"
+            )
+        return value
+
+    def create(self, validated_data):
+        """Insert the comment, then derive its path from the new id"""
+        with transaction.atomic():
+            comment = super().create(validated_data)
+            threads.fill_paths([comment])
+        return comment
+
+
+class MentionSerializer(serializers.ModelSerializer):
+    """Serializer for a mention of the current user - the post, plus the comment if it was in one"""
+    post = PostSerializer(read_only=True)
+    comment = CommentSerializer(read_only=True, allow_null=True)
+
+    class Meta:
+        model = Mention
+        fields = ['id', 'post', 'comment', 'created_at']
+        read_only_fields = ['id', 'post', 'comment', 'created_at']
+
+
+class NotificationSerializer(serializers.ModelSerializer):
+    """Serializer for an inbox entry - comments on one of the current user's posts"""
+    post_id = serializers.IntegerField(read_only=True)
+    actor = MemberSerializer(read_only=True, allow_null=True)
+    last_comment_id = serializers.IntegerField(read_only=True, allow_null=True)
+    read = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Notification
+        fields = ['id', 'post_id', 'actor', 'last_comment_id', 'comment_count', 'read', 'created_at', 'updated_at']
+        read_only_fields = ['id', 'comment_count', 'created_at', 'updated_at']
+
+    def get_read(self, obj):
+        return obj.read_at is not None
+
+
+class NotificationReadSerializer(serializers.Serializer):
+    """Serializer for marking notifications as read - given ids, or all of them"""
+    ids = serializers.ListField(child=serializers.IntegerField(min_value=1), allow_empty=False, required=False)
+    all = serializers.BooleanField(default=False)
+
+    def validate_ids(self, value):
+        limit = notifications.get_config()['MAX_MARK_READ']
+        if len(value) > limit:
+            raise serializers.ValidationError(f'At most {limit} ids can be marked at once')
+        return value
+
+    def validate(self, attrs):
+        if attrs['all'] == ('ids' in attrs):
+            raise serializers.ValidationError('Provide either ids or all=true')
+        return attrs
+
+
+class MemoryArmSerializer(serializers.Serializer):
+    """Serializer for arming memory snapshot diffs - given routes, or every route seen so far"""
+    routes = serializers.ListField(
+        child=serializers.CharField(max_length=200), allow_empty=True, required=False, max_length=200
+    )
+
 
 class ProfileSerializer(serializers.ModelSerializer):
     """Serializer for user profile with posts count"""
@@ -112,8 +258,8 @@ class ProfileSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'username', 'posts_count', 'created_at']
 
     def get_posts_count(self, obj):
-        """Get the count of posts by this user"""
-        return obj.posts.count()
+        """Get the count of posts by this user, archived ones included"""
+        return obj.posts.count() + obj.archived_posts.count()
 
 
 class ProfileUpdateSerializer(serializers.ModelSerializer):
@@ -0,0 +1,92 @@
+"""
+Response shapes for list endpoints.
+
+    ?fields=id,content,author     sparse fieldset for the items
+    ?member_fields=id,username    sparse fieldset for author objects
+    ?shape=compact                items carry author_id; each author is sent once
+                                  in included.members, keyed by id
+
+The default shape (nested author on every item) is unchanged.
+"""
+from .serializers import MemberSerializer
+
+
+class InvalidShape(ValueError):
+    def __init__(self, details):
+        super().__init__(details)
+        self.details = details
+
+
+def _parse_fields(raw, allowed, param):
+    if raw is None:
+        return None
+    fields = [name.strip() for name in raw.split(',') if name.strip()]
+    unknown = [name for name in fields if name not in allowed]
+    if unknown:
+        raise InvalidShape({param: [f'Unknown field: {name}' for name in unknown]})
+    return fields
+
+
+class ListShape:
+    def __init__(self, request, serializer_class):
+        params = request.query_params
+        self.request = request
+        self.serializer_class = serializer_class
+        self.compact = params.get('shape') == 'compact'
+        self.fields = _parse_fields(params.get('fields'), serializer_class.Meta.fields, 'fields')
+        self.member_fields = _parse_fields(
+            params.get('member_fields'), MemberSerializer.Meta.fields, 'member_fields'
+        )
+        if self.compact and self.member_fields is not None and 'id' not in self.member_fields:
+            # included.members is keyed by id
+            self.member_fields.insert(0, 'id')
+
+    @property
+    def is_default(self):
+        return not self.compact and self.fields is None and self.member_fields is None
+
+    def _wants_author(self):
+        return self.fields is None or 'author' in self.fields
+
+    def serialize(self, instances):
+        """
+        Serialize model instances; returns (items, included or None)
+        """
+        instances = list(instances)
+        items = self.serializer_class(
+            instances, many=True, fields=self.fields, member_fields=self.member_fields, compact=self.compact,
+            context={'request': self.request},
+        ).data
+        if not self.compact:
+            return items, None
+
+        members = {}
+        if self._wants_author():
+            for instance in instances:
+                members.setdefault(instance.author_id, instance.author)
+        included = MemberSerializer(members.values(), many=True, fields=self.member_fields).data
+        return items, {'members': {str(member['id']): member for member in included}}
+
+    def reshape(self, items):
+        """
+        Same as serialize() but starting from already serialized default-shape
+        items (e.g. a cached payload), without touching the models again
+        """
+        def pick(data, fields):
+            return data if fields is None else {key: data[key] for key in fields if key in data}
+
+        members = {}
+        shaped = []
+        for item in items:
+            author = item.get('author')
+            item = pick(item, self.fields)
+            if 'author' in item:
+                author_data = pick(author, self.member_fields)
+                if self.compact:
+                    del item['author']
+                    item['author_id'] = author['id']
+                    members.setdefault(str(author['id']), author_data)
+                else:
+                    item['author'] = author_data
+            shaped.append(item)
+        return shaped, ({'members': members} if self.compact else None)
@@ -0,0 +1,420 @@
+"""
+Django cache backend on a memory-mapped file shared by every process on the host.
+
+LocMemCache gives each gunicorn worker its own copy, so every worker warms and
+evicts separately (and a session created by one worker is unknown to the
+others). SharedMemoryCache maps one file into all of them instead:
+
+    CACHES = {'default': {
+        'BACKEND': 'api.shmcache.SharedMemoryCache',
+        'LOCATION': '/path/to/default.cache',
+        'OPTIONS': {'MAX_ENTRIES': 10000, 'SLOT_SIZE': 1024},
+    }}
+
+The file is a fixed-size hash table of MAX_ENTRIES slots of SLOT_SIZE bytes,
+split into STRIPES contiguous stripes. A key hashes to one stripe and to a
+window of WAYS slots inside it, the only slots it can occupy. Each slot holds
+the key, the pickled value (zlib-compressed when it would not fit otherwise),
+an absolute expiry time and a CLOCK reference bit, set by reads. When a
+window is full, the first slot whose reference bit is clear is evicted, and
+the bits passed over are cleared on the way (second chance), so keys that are
+read between sweeps stay while keys written once and never read go first. Values that do not fit in a slot even
+compressed are not cached.
+
+Writers lock the stripe with a thread lock plus an fcntl lock on one byte of
+the file, so stripes are written concurrently. Readers take no lock: every
+slot starts with a sequence number that writers make odd while they write,
+and even again only once the rest of the slot is in place.
+A reader copies the value bytes once, straight from the mapping, and keeps
+them only if the sequence number is even and unchanged. Otherwise it retries
+under the stripe lock.
+
+A file whose layout does not match the configuration is replaced with a new
+file, never truncated, so processes still mapping the old one are not hurt.
+"""
+import fcntl
+import hashlib
+import mmap
+import os
+import pickle
+import struct
+import threading
+import time
+import zlib
+from pathlib import Path
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+MAGIC = b'EZSHMC01'
+HEADER = struct.Struct('<8sIIII')
+HEADER_SIZE = mmap.PAGESIZE
+# sequence, flags, reference bit, key length, value length, expires at, key hash
+SLOT = struct.Struct('<IBBHIdQ')
+_SEQUENCE = struct.Struct('<I')
+_EXPIRES = struct.Struct('<d')
+
+USED = 1
+COMPRESSED = 2
+
+_BUSY = object()
+
+DEFAULT_SLOT_SIZE = 1024
+DEFAULT_STRIPES = 64
+DEFAULT_WAYS = 8
+
+_tables = {}
+_tables_lock = threading.Lock()
+
+
+def _key_hash(key_bytes):
+    return int.from_bytes(hashlib.blake2b(key_bytes, digest_size=8).digest(), 'little')
+
+
+class _Table:
+    """
+    One process's mapping of a cache file, shared by its threads
+    """
+
+    def __init__(self, path, slots, slot_size, stripes, ways):
+        self.path = Path(path)
+        self.stripes = stripes
+        self.stripe_slots = -(-slots // stripes)
+        self.slots = self.stripe_slots * stripes
+        self.slot_size = slot_size
+        self.ways = min(ways, self.stripe_slots)
+        self.size = HEADER_SIZE + self.slots * slot_size
+        self.pid = os.getpid()
+        self.thread_locks = [threading.Lock() for _ in range(stripes)]
+        self.fd = self._open()
+        self.map = mmap.mmap(self.fd, self.size)
+        # Compares keys in place; slicing the mmap itself would copy
+        self.view = memoryview(self.map)
+
+    def _header(self):
+        return HEADER.pack(MAGIC, 1, self.slots, self.slot_size, self.stripes)
+
+    def _open(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        while True:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+            fcntl.lockf(fd, fcntl.LOCK_EX)
+            try:
+                stat = os.fstat(fd)
+                if stat.st_ino != os.stat(self.path).st_ino:
+                    # Replaced by another process while we waited for the lock
+                    os.close(fd)
+                    continue
+                if stat.st_size == 0:
+                    os.ftruncate(fd, self.size)
+                    os.pwrite(fd, self._header(), 0)
+                elif stat.st_size != self.size or os.pread(fd, HEADER.size, 0) != self._header():
+                    self._replace()
+                    os.close(fd)
+                    continue
+            except BaseException:
+                os.close(fd)
+                raise
+            fcntl.lockf(fd, fcntl.LOCK_UN)
+            return fd
+
+    def _replace(self):
+        temporary = self.path.with_name(f'{self.path.name}.{os.getpid()}.tmp')
+        fd = os.open(temporary, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o600)
+        try:
+            os.ftruncate(fd, self.size)
+            os.pwrite(fd, self._header(), 0)
+        finally:
+            os.close(fd)
+        os.replace(temporary, self.path)
+
+    def locate(self, key_hash):
+        stripe = key_hash % self.stripes
+        first = stripe * self.stripe_slots
+        start = (key_hash // self.stripes) % self.stripe_slots
+        window = [first + (start + way) % self.stripe_slots for way in range(self.ways)]
+        return stripe, [HEADER_SIZE + index * self.slot_size for index in window]
+
+    def lock(self, stripe):
+        self.thread_locks[stripe].acquire()
+        try:
+            # One byte per stripe; the byte's contents are irrelevant
+            fcntl.lockf(self.fd, fcntl.LOCK_EX, 1, stripe)
+        except BaseException:
+            self.thread_locks[stripe].release()
+            raise
+
+    def unlock(self, stripe):
+        try:
+            fcntl.lockf(self.fd, fcntl.LOCK_UN, 1, stripe)
+        finally:
+            self.thread_locks[stripe].release()
+
+
+def _table(path, slots, slot_size, stripes, ways):
+    key = (str(path), slots, slot_size, stripes, ways)
+    table = _tables.get(key)
+    if table is None or table.pid != os.getpid():
+        with _tables_lock:
+            table = _tables.get(key)
+            # A forked child reopens: fcntl locks and thread locks are per process
+            if table is None or table.pid != os.getpid():
+                table = _tables[key] = _Table(path, slots, slot_size, stripes, ways)
+    return table
+
+
+class SharedMemoryCache(BaseCache):
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self._location = location
+        self._slot_size = options.get('SLOT_SIZE', DEFAULT_SLOT_SIZE)
+        self._stripes = options.get('STRIPES', DEFAULT_STRIPES)
+        self._ways = options.get('WAYS', DEFAULT_WAYS)
+        if self._slot_size <= SLOT.size:
+            raise ValueError(f'SLOT_SIZE must be larger than {SLOT.size} bytes')
+
+    @property
+    def _table(self):
+        return _table(self._location, self._max_entries, self._slot_size, self._stripes, self._ways)
+
+    # Slot access
+
+    def _find(self, table, offsets, key_bytes, key_hash):
+        view = table.map
+        for offset in offsets:
+            _, flags, _, key_length, _, _, slot_hash = SLOT.unpack_from(view, offset)
+            if (flags & USED and slot_hash == key_hash
+                    and table.view[offset + SLOT.size:offset + SLOT.size + key_length] == key_bytes):
+                return offset
+        return None
+
+    def _lookup(self, table, offsets, key_bytes, key_hash):
+        """
+        Lock-free read: (offset, flags, expires at, value bytes) of the key's
+        slot, None if absent, or _BUSY if a writer got in the way
+        """
+        view = table.map
+        busy = False
+        for offset in offsets:
+            sequence, flags, _, key_length, value_length, expires_at, slot_hash = SLOT.unpack_from(view, offset)
+            if sequence & 1:
+                busy = True
+                continue
+            if not flags & USED or slot_hash != key_hash:
+                continue
+            start = offset + SLOT.size
+            if table.view[start:start + key_length] != key_bytes:
+                continue
+            payload = view[start + key_length:start + key_length + value_length]
+            if _SEQUENCE.unpack_from(view, offset)[0] != sequence:
+                busy = True
+                continue
+            return offset, flags, expires_at, payload
+        return _BUSY if busy else None
+
+    # Every change to a slot happens between _begin() (odd sequence number) and
+    # _publish() (the next even one), and the header is rewritten with the odd
+    # number: a reader that sees the published number also sees everything else
+
+    def _begin(self, view, offset):
+        sequence = (_SEQUENCE.unpack_from(view, offset)[0] + 1) & 0xFFFFFFFF
+        _SEQUENCE.pack_into(view, offset, sequence)
+        return sequence
+
+    def _publish(self, view, offset, sequence):
+        _SEQUENCE.pack_into(view, offset, (sequence + 1) & 0xFFFFFFFF)
+
+    def _write(self, table, offset, key_bytes, key_hash, flags, payload, expires_at, referenced):
+        view = table.map
+        sequence = self._begin(view, offset)
+        start = offset + SLOT.size
+        view[start:start + len(key_bytes)] = key_bytes
+        view[start + len(key_bytes):start + len(key_bytes) + len(payload)] = payload
+        SLOT.pack_into(
+            view, offset, sequence, flags, referenced, len(key_bytes), len(payload), expires_at, key_hash,
+        )
+        self._publish(view, offset, sequence)
+
+    def _erase(self, table, offset):
+        view = table.map
+        sequence = self._begin(view, offset)
+        SLOT.pack_into(view, offset, sequence, 0, 0, 0, 0, 0.0, 0)
+        self._publish(view, offset, sequence)
+
+    def _victim(self, table, offsets, now):
+        """
+        Slot to store a new key in: a free or expired one, else CLOCK
+        """
+        view = table.map
+        for offset in offsets:
+            _, flags, _, _, _, expires_at, _ = SLOT.unpack_from(view, offset)
+            if not flags & USED or (expires_at and expires_at <= now):
+                return offset
+        for offset in offsets:
+            if not view[offset + 5]:
+                return offset
+            view[offset + 5] = 0
+        return offsets[0]
+
+    def _encode(self, key_bytes, value):
+        capacity = self._slot_size - SLOT.size - len(key_bytes)
+        payload = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        if len(payload) <= capacity:
+            return USED, payload
+        payload = zlib.compress(payload)
+        if len(payload) <= capacity:
+            return USED | COMPRESSED, payload
+        return None, None
+
+    def _decode(self, flags, payload):
+        if flags & COMPRESSED:
+            payload = zlib.decompress(payload)
+        return pickle.loads(payload)
+
+    def _expires_at(self, timeout):
+        expires_at = self.get_backend_timeout(timeout)
+        return 0.0 if expires_at is None else expires_at
+
+    def _prepare(self, key, version):
+        key = self.make_and_validate_key(key, version=version)
+        key_bytes = key.encode()
+        key_hash = _key_hash(key_bytes)
+        table = self._table
+        stripe, offsets = table.locate(key_hash)
+        return key_bytes, key_hash, table, stripe, offsets
+
+    def _store(self, key, value, timeout, version, only_if_missing):
+        key_bytes, key_hash, table, stripe, offsets = self._prepare(key, version)
+        flags, payload = self._encode(key_bytes, value)
+        expires_at = self._expires_at(timeout)
+        now = time.time()
+        table.lock(stripe)
+        try:
+            offset = self._find(table, offsets, key_bytes, key_hash)
+            if offset is not None and only_if_missing:
+                slot_expires_at = _EXPIRES.unpack_from(table.map, offset + 12)[0]
+                if not slot_expires_at or slot_expires_at > now:
+                    return False
+            if flags is None:
+                # Too large to cache: do not leave an outdated value behind
+                if offset is not None:
+                    self._erase(table, offset)
+                return False
+            # A new key has to be read before the next sweep to stay cached
+            referenced = 0
+            if offset is None:
+                offset = self._victim(table, offsets, now)
+            else:
+                referenced = table.map[offset + 5]
+            self._write(table, offset, key_bytes, key_hash, flags, payload, expires_at, referenced)
+            return True
+        finally:
+            table.unlock(stripe)
+
+    # Cache API
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        return self._store(key, value, timeout, version, only_if_missing=True)
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self._store(key, value, timeout, version, only_if_missing=False)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        return [
+            key for key, value in data.items()
+            if not self._store(key, value, timeout, version, only_if_missing=False)
+        ]
+
+    def get(self, key, default=None, version=None):
+        key_bytes, key_hash, table, stripe, offsets = self._prepare(key, version)
+        slot = self._lookup(table, offsets, key_bytes, key_hash)
+        if slot is _BUSY:
+            table.lock(stripe)
+            try:
+                slot = self._lookup(table, offsets, key_bytes, key_hash)
+            finally:
+                table.unlock(stripe)
+        if slot is None:
+            return default
+        offset, flags, expires_at, payload = slot
+        if expires_at and expires_at <= time.time():
+            return default
+        # CLOCK reference bit; a lost update only costs an earlier eviction
+        table.map[offset + 5] = 1
+        return self._decode(flags, payload)
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key_bytes, key_hash, table, stripe, offsets = self._prepare(key, version)
+        table.lock(stripe)
+        try:
+            offset = self._find(table, offsets, key_bytes, key_hash)
+            if offset is None:
+                return False
+            expires_at = _EXPIRES.unpack_from(table.map, offset + 12)[0]
+            if expires_at and expires_at <= time.time():
+                return False
+            sequence = self._begin(table.map, offset)
+            _EXPIRES.pack_into(table.map, offset + 12, self._expires_at(timeout))
+            self._publish(table.map, offset, sequence)
+            return True
+        finally:
+            table.unlock(stripe)
+
+    def incr(self, key, delta=1, version=None):
+        key_bytes, key_hash, table, stripe, offsets = self._prepare(key, version)
+        table.lock(stripe)
+        try:
+            slot = self._lookup(table, offsets, key_bytes, key_hash)
+            if slot is None or (slot[2] and slot[2] <= time.time()):
+                raise ValueError(f"Key '{key}' not found")
+            offset, flags, expires_at, payload = slot
+            value = self._decode(flags, payload) + delta
+            flags, payload = self._encode(key_bytes, value)
+            self._write(table, offset, key_bytes, key_hash, flags, payload, expires_at, table.map[offset + 5])
+            return value
+        finally:
+            table.unlock(stripe)
+
+    def delete(self, key, version=None):
+        key_bytes, key_hash, table, stripe, offsets = self._prepare(key, version)
+        table.lock(stripe)
+        try:
+            offset = self._find(table, offsets, key_bytes, key_hash)
+            if offset is None:
+                return False
+            expires_at = _EXPIRES.unpack_from(table.map, offset + 12)[0]
+            self._erase(table, offset)
+            return not expires_at or expires_at > time.time()
+        finally:
+            table.unlock(stripe)
+
+    def has_key(self, key, version=None):
+        sentinel = object()
+        return self.get(key, sentinel, version=version) is not sentinel
+
+    def clear(self):
+        table = self._table
+        for stripe in range(table.stripes):
+            table.lock(stripe)
+            try:
+                first = HEADER_SIZE + stripe * table.stripe_slots * table.slot_size
+                for index in range(table.stripe_slots):
+                    offset = first + index * table.slot_size
+                    if table.map[offset + 4]:
+                        self._erase(table, offset)
+            finally:
+                table.unlock(stripe)
+
+    def stats(self):
+        """
+        Slot occupancy of the shared table (scans it, for diagnostics only)
+        """
+        table = self._table
+        now = time.time()
+        used = expired = 0
+        for index in range(table.slots):
+            _, flags, _, _, _, expires_at, _ = SLOT.unpack_from(table.map, HEADER_SIZE + index * table.slot_size)
+            if flags & USED:
+                used += 1
+                expired += bool(expires_at and expires_at <= now)
+        return {'slots': table.slots, 'slot_size': table.slot_size, 'used': used, 'expired': expired}
@@ -0,0 +1,122 @@
+"""
+Delta sync for clients that already hold a feed page or a post's thread.
+
+A client keeps the opaque mark returned by /api/sync/ and sends it back on its
+next refresh. It then receives only the posts, and the comments of one post,
+whose updated_at is at or after the mark, read from (updated_at, id) indexes,
+plus the ids deleted since then from the tombstones table. Deleting a comment
+deletes its replies; only the comment itself gets a tombstone.
+
+A row's updated_at is set before its transaction commits, so a row can become
+visible with a timestamp slightly older than a mark already handed out. Marks
+are therefore set SETTLE_SECONDS in the past: rows changed within that window
+are sent twice and clients apply changes idempotently.
+
+A client is told to reset (refetch its pages) when it has no mark, when its
+mark predates the tombstone retention, or when more than LIMIT rows of one
+kind changed; a refresh never computes more than that.
+"""
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Comment, Post, Tombstone
+from .pagination import InvalidCursor, decode_cursor, encode_cursor
+
+DEFAULTS = {
+    'LIMIT': 200,
+    'SETTLE_SECONDS': 2,
+    'TOMBSTONE_RETENTION_DAYS': 7,
+    'PRUNE_INTERVAL': 3600,
+    'PRUNE_BATCH_SIZE': 1000,
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'SYNC', {})}
+
+
+def encode_mark(moment):
+    return encode_cursor([moment.isoformat()])
+
+
+def decode_mark(token):
+    try:
+        moment = datetime.fromisoformat(decode_cursor(token, 1)[0])
+    except (TypeError, ValueError):
+        raise InvalidCursor(token)
+    if timezone.is_naive(moment):
+        raise InvalidCursor(token)
+    return moment
+
+
+def record_deleted_posts(post_ids):
+    Tombstone.objects.bulk_create([
+        Tombstone(kind=Tombstone.POST, object_id=post_id, post_id=post_id) for post_id in post_ids
+    ])
+
+
+def record_deleted_comments(comments):
+    """
+    Log the deletion of (comment_id, post_id) pairs
+    """
+    Tombstone.objects.bulk_create([
+        Tombstone(kind=Tombstone.COMMENT, object_id=comment_id, post_id=post_id)
+        for comment_id, post_id in comments
+    ])
+
+
+def changes(since, post_id=None):
+    """
+    Posts (and comments of post_id) changed at or after `since`, and
+    tombstones since then. Returns (mark, changes) where changes is None when
+    the client has to reset.
+    """
+    config = get_config()
+    now = timezone.now()
+    mark = now - timedelta(seconds=config['SETTLE_SECONDS'])
+    if since is None or since < now - timedelta(days=config['TOMBSTONE_RETENTION_DAYS']):
+        return mark, None
+
+    limit = config['LIMIT']
+    posts = list(
+        Post.objects.filter(updated_at__gte=since).select_related('author').order_by('updated_at', 'id')[:limit + 1]
+    )
+    comments = []
+    if post_id is not None:
+        comments = list(
+            Comment.objects.filter(post_id=post_id, updated_at__gte=since)
+            .select_related('author').order_by('updated_at', 'id')[:limit + 1]
+        )
+    kinds = Q(kind=Tombstone.POST)
+    if post_id is not None:
+        kinds |= Q(kind=Tombstone.COMMENT, post_id=post_id)
+    tombstones = list(
+        Tombstone.objects.filter(kinds, deleted_at__gte=since).values_list('kind', 'object_id')[:limit + 1]
+    )
+    if len(posts) > limit or len(comments) > limit or len(tombstones) > limit:
+        return mark, None
+    return mark, {
+        'posts': posts,
+        'comments': comments,
+        'deleted_posts': sorted({object_id for kind, object_id in tombstones if kind == Tombstone.POST}),
+        'deleted_comments': sorted({object_id for kind, object_id in tombstones if kind == Tombstone.COMMENT}),
+    }
+
+
+def prune(batch_size=None):
+    """
+    Delete tombstones older than the retention period, in primary key batches.
+    Returns the number deleted.
+    """
+    config = get_config()
+    batch_size = batch_size or config['PRUNE_BATCH_SIZE']
+    cutoff = timezone.now() - timedelta(days=config['TOMBSTONE_RETENTION_DAYS'])
+    pruned = 0
+    while True:
+        ids = list(Tombstone.objects.filter(deleted_at__lt=cutoff).values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return pruned
+        pruned += Tombstone.objects.filter(id__in=ids).delete()[0]
@@ -0,0 +1,178 @@
+"""
+Hashtag and @mention extraction.
+
+Posts and comments are parsed once, at write time, into the normalized tags /
+post_tags and mentions tables, so "posts about #topic" and "where was I
+mentioned" are range scans of (tag, created_at) and (member, created_at)
+indexes instead of LIKE scans over content. A hashtag in a comment tags the
+post it belongs to. The rows cascade with their post or comment, so archived
+posts drop out of tag feeds; deleting comments drops the post's tags that only
+those comments carried (forget_comments()).
+"""
+import re
+import time
+import unicodedata
+
+from django.db import transaction
+
+from .models import Comment, Member, Mention, Post, PostTag, Tag
+
+MAX_TAGS = 20
+MAX_MENTIONS = 20
+DEFAULT_BATCH_SIZE = 500
+
+_HASHTAG = re.compile(r'(?<![\w&#])#(\w{1,100})')
+_MENTION = re.compile(r'(?<![\w@])@([\w.+-]{1,150})')
+
+
+def normalize_tag(name):
+    return unicodedata.normalize('NFKC', name).casefold()[:100]
+
+
+def extract_tags(text):
+    """
+    Distinct normalized hashtags of `text`, in order of appearance
+    """
+    tags = []
+    for match in _HASHTAG.finditer(text):
+        name = normalize_tag(match.group(1))
+        if name not in tags:
+            tags.append(name)
+            if len(tags) == MAX_TAGS:
+                break
+    return tags
+
+
+def extract_mentions(text):
+    """
+    Distinct @usernames of `text`, in order of appearance
+    """
+    usernames = []
+    for match in _MENTION.finditer(text):
+        # "@alice." at the end of a sentence mentions alice
+        username = match.group(1).rstrip('.-+')
+        if username and username not in usernames:
+            usernames.append(username)
+            if len(usernames) == MAX_MENTIONS:
+                break
+    return usernames
+
+
+def _tag_ids(names):
+    tag_ids = dict(Tag.objects.filter(name__in=names).values_list('name', 'id'))
+    missing = names - tag_ids.keys()
+    if missing:
+        Tag.objects.bulk_create([Tag(name=name) for name in missing], ignore_conflicts=True)
+        tag_ids.update(Tag.objects.filter(name__in=missing).values_list('name', 'id'))
+    return tag_ids
+
+
+def _index(entries):
+    """
+    Store tags and mentions of (post_id, post_created_at, comment_id, author_id, created_at, text) entries
+    """
+    tagged = {}
+    mentioned = {}
+    for post_id, post_created_at, comment_id, author_id, created_at, text in entries:
+        for name in extract_tags(text):
+            tagged.setdefault((post_id, name), post_created_at)
+        for username in extract_mentions(text):
+            mentioned.setdefault((username, post_id, comment_id), (author_id, created_at))
+    if not tagged and not mentioned:
+        return
+
+    with transaction.atomic():
+        if tagged:
+            tag_ids = _tag_ids({name for _, name in tagged})
+            PostTag.objects.bulk_create(
+                [
+                    PostTag(post_id=post_id, tag_id=tag_ids[name], created_at=created_at)
+                    for (post_id, name), created_at in tagged.items()
+                ],
+                ignore_conflicts=True,
+            )
+        if mentioned:
+            member_ids = dict(
+                Member.objects.filter(username__in={username for username, _, _ in mentioned})
+                .order_by().values_list('username', 'id')
+            )
+            Mention.objects.bulk_create(
+                [
+                    Mention(member_id=member_ids[username], post_id=post_id, comment_id=comment_id,
+                            created_at=created_at)
+                    for (username, post_id, comment_id), (author_id, created_at) in mentioned.items()
+                    # Unknown usernames and self-mentions are not stored
+                    if member_ids.get(username, author_id) != author_id
+                ],
+                ignore_conflicts=True,
+            )
+
+
+def index_posts(posts):
+    _index([
+        (post.id, post.created_at, None, post.author_id, post.created_at, post.content)
+        for post in posts
+    ])
+
+
+def index_comments(comments):
+    """
+    Index comments; comment.post should already be loaded (it supplies the tag timestamp)
+    """
+    _index([
+        (comment.post_id, comment.post.created_at, comment.id, comment.author_id, comment.created_at,
+         comment.content)
+        for comment in comments
+    ])
+
+
+def forget_comments(post_id, texts):
+    """
+    Untag a post of the hashtags that only its deleted comments (their `texts`) carried.
+
+    Mentions cascade with their comments; a post's tags do not, so the post and
+    its remaining comments are re-read for the candidates. Returns the number of
+    tags dropped.
+    """
+    names = {name for text in texts for name in extract_tags(text)}
+    if not names:
+        return 0
+    # Archived posts have no tags left
+    names -= set(extract_tags(Post.objects.filter(id=post_id).values_list('content', flat=True).first() or ''))
+    for content in Comment.objects.filter(post_id=post_id).values_list('content', flat=True).iterator():
+        if not names:
+            break
+        names -= set(extract_tags(content))
+    if not names:
+        return 0
+    return PostTag.objects.filter(post_id=post_id, tag__in=Tag.objects.filter(name__in=names)).delete()[0]
+
+
+def backfill(batch_size=DEFAULT_BATCH_SIZE, pause=0.0, on_batch=None):
+    """
+    Index every existing post and comment in primary key order. Safe to re-run.
+
+    on_batch(kind, count, last_id) is called after every batch. Returns
+    (posts, comments) processed.
+    """
+    totals = {}
+    sources = (
+        ('posts', Post.objects.only('id', 'author_id', 'content', 'created_at'), index_posts),
+        ('comments', Comment.objects.select_related('post').only(
+            'id', 'post_id', 'author_id', 'content', 'created_at', 'post__created_at'
+        ), index_comments),
+    )
+    for kind, queryset, index in sources:
+        totals[kind] = last_id = 0
+        while True:
+            batch = list(queryset.filter(id__gt=last_id).order_by('id')[:batch_size])
+            if not batch:
+                break
+            index(batch)
+            totals[kind] += len(batch)
+            last_id = batch[-1].id
+            if on_batch:
+                on_batch(kind, totals[kind], last_id)
+            if pause:
+                time.sleep(pause)
+    return totals['posts'], totals['comments']
@@ -1,3 +1,1903 @@
-from django.test import TestCase
+import io
+import json
+import math
+import multiprocessing
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone as dt_timezone
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import OperationalError, connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from . import (
+    admission, archive, availability, backup, caching, fragments, likes, memory, notifications, profiling, querylog,
+    queryplans, ranking, shmcache, sync, tagging, threads,
+)
+from .admin import CommentAdmin, CreatedMonthFilter, EstimatedCountPaginator, PostAdmin
+from .authentication import create_session
+from .models import (
+    ArchivedComment, ArchivedPost, Comment, Like, Member, Mention, Notification, Post, PostScore, PostTag,
+    Tombstone,
+)
+from .serializers import RegisterSerializer
+from .shmcache import SharedMemoryCache
+from .urls import urlpatterns
+
+TEST_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'tests-default',
+    },
+    'hot': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'tests-hot',
+    },
+    'fragments': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'tests-fragments',
+    },
+    'dummy': {
+        'BACKEND': 'django.core.cache.backends.dummy.DummyCache',
+    },
+}
+
+_module_settings = []
+
+
+def setUpModule():
+    # Every request passes AdmissionControlMiddleware: keep its board out of persistent/
+    scratch = tempfile.TemporaryDirectory()
+    override = override_settings(ADMISSION={**settings.ADMISSION, 'LOCATION': Path(scratch.name) / 'admission.shm'})
+    override.enable()
+    _module_settings.extend([override, scratch])
+
+
+def tearDownModule():
+    override, scratch = _module_settings
+    override.disable()
+    scratch.cleanup()
+    _module_settings.clear()
+
+
+def format_queries(queries):
+    return '\n'.join(f"  [{index}] {query['sql']}" for index, query in enumerate(queries.captured_queries, 1))
+
+
+def count_queries(queries):
+    # Savepoints only exist because every test runs inside a transaction
+    return sum(
+        1 for query in queries.captured_queries
+        if not query['sql'].startswith(('SAVEPOINT', 'RELEASE SAVEPOINT', 'ROLLBACK TO SAVEPOINT'))
+    )
+
+
+class BudgetAssertionsMixin:
+    # Coarse per-request wall-time budget; catches pathological regressions only
+    TIME_BUDGET = 1.0
+
+    # Fail on plans that scan a whole table or sort in a temp B-tree (api/queryplans.py)
+    CHECK_PLANS = False
+
+    def assertWithinBudget(self, label, budget, send):
+        with CaptureQueriesContext(connection) as queries, queryplans.record_statements(connection) as statements:
+            started = time.perf_counter()
+            response = send()
+            elapsed = time.perf_counter() - started
+        self.assertLess(
+            response.status_code, 400,
+            f'{label} returned {response.status_code}: {getattr(response, "data", response.content)!r}'
+        )
+        count = count_queries(queries)
+        if count > budget:
+            self.fail(f'{label} ran {count} queries (budget {budget}):\n{format_queries(queries)}')
+        if elapsed > self.TIME_BUDGET:
+            self.fail(f'{label} took {elapsed:.3f}s (budget {self.TIME_BUDGET}s):\n{format_queries(queries)}')
+        if self.CHECK_PLANS:
+            problems = queryplans.plan_problems(connection, statements)
+            if problems:
+                self.fail(f'{label} has unindexed plans:\n{queryplans.format_problems(problems)}')
+        return count
+
+
+@override_settings(
+    CACHES=TEST_CACHES, API_CACHE={'ENABLED': False}, FRAGMENTS={'ENABLED': False}, LIKES={'FLUSH_EVERY': 1},
+    HOT_FEED={'SNAPSHOT_ALIAS': 'dummy'},
+)
+class RouteBudgetTests(BudgetAssertionsMixin, TestCase):
+    """
+    Every route in api/urls.py runs within a fixed query budget that does not
+    depend on page size or thread length. The hot cache and feed fragments are
+    disabled, and hot feed snapshots are never kept, so the budgets cover the
+    rebuild path (FragmentCacheTests covers the fragment path).
+    """
+    PAGE_SIZES = [5, 20, 50]
+    CHECK_PLANS = True
+
+    # (route name, method) -> maximum queries per request
+    QUERY_BUDGETS = {
+        ('hello', 'get'): 1,
+        ('auth-register', 'post'): 3,
+        # Building this worker's filter (2) and checking a taken name; free names then run none
+        ('auth-availability', 'get'): 3,
+        ('auth-login', 'post'): 1,
+        ('auth-logout', 'post'): 1,
+        ('auth-me', 'get'): 1,
+        ('posts-list-create', 'get'): 4,
+        # Plus the ranking watermark and the snapshot the scroll is pinned to
+        ('posts-list-create', 'get-hot'): 5,
+        ('posts-list-create', 'post'): 6,
+        ('posts-detail-delete', 'get'): 3,
+        ('posts-detail-delete', 'delete'): 14,
+        ('posts-like', 'post'): 4,
+        ('posts-like', 'delete'): 4,
+        ('comments-list-create', 'get'): 4,
+        # Includes the notification delivered once the response is sent
+        ('comments-list-create', 'post'): 10,
+        # Reads the subtree's ids for their tombstones before the range delete
+        ('comments-delete', 'delete'): 6,
+        ('profile-detail', 'get'): 4,
+        ('profile-update', 'patch'): 4,
+        ('profile-posts', 'get'): 7,
+        ('tags-posts', 'get'): 3,
+        ('mentions-list', 'get'): 3,
+        ('notifications-list', 'get'): 3,
+        ('notifications-read', 'post'): 3,
+        ('notifications-unread-count', 'get'): 1,
+        ('sync', 'get'): 5,
+        ('metrics-cache', 'get'): 1,
+        ('metrics-memory', 'get'): 1,
+        ('metrics-queries', 'get'): 1,
+        ('metrics-admission', 'get'): 1,
+        ('metrics-profiles', 'get'): 1,
+        ('metrics-profile-detail', 'get'): 1,
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        Member.objects.bulk_create([
+            Member(username=f'member{i}', email=f'member{i}@example.com', password='!')
+            for i in range(20)
+        ])
+        cls.members = list(Member.objects.order_by('id'))
+        cls.member = cls.members[0]
+        cls.member.is_staff = True
+        cls.member.set_password('correct horse')
+        cls.member.save()
+
+        Post.objects.bulk_create([
+            Post(author=cls.members[i % len(cls.members)], content=f'Post {i} #topic')
+            for i in range(120)
+        ])
+        cls.posts = list(Post.objects.order_by('id'))
+        # Threads with different numbers of top-level comments, each with nested replies
+        cls.thread_posts = {}
+        for post, size in zip(cls.posts, cls.PAGE_SIZES):
+            cls.thread_posts[size] = post
+            parents = [None] * size
+            for level in range(3):
+                parents = Comment.objects.bulk_create([
+                    Comment(post=post, parent=parent, author=cls.members[i % len(cls.members)],
+                            content=f'Comment {i} at depth {level} @member0')
+                    for i, parent in enumerate(parents)
+                ])
+                threads.fill_paths(parents)
+        tagging.backfill()
+        ranking.refresh_scores()
+        Notification.objects.bulk_create([
+            Notification(recipient=cls.member, post=post, actor=cls.members[1], comment_count=2)
+            for post in cls.posts[:60]
+        ])
+        # Half of the profile's posts live in the archive, so its pages span both tables
+        archive._archive_batch([post.id for post in cls.posts[21::20][:3]])
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.cookies['sessionid'] = create_session(self.member)
+        patcher = mock.patch.object(availability, 'index', availability.AvailabilityIndex())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def budget(self, route, method):
+        return self.QUERY_BUDGETS[(route, method)]
+
+    def test_every_route_has_a_budget(self):
+        routes = {pattern.name for pattern in urlpatterns}
+        budgeted = {route for route, _ in self.QUERY_BUDGETS}
+        self.assertEqual(routes - budgeted, set(), 'Routes without a query budget')
+
+    def test_plan_checker_flags_scans_and_sorts(self):
+        problems = queryplans.plan_problems(connection, [
+            ('SELECT "id" FROM "posts" ORDER BY "created_at" DESC LIMIT 10', ()),
+            ('SELECT "id" FROM "posts" WHERE "content" = %s ORDER BY "likes_count"', ('x',)),
+        ])
+        self.assertEqual([offending for _, _, offending in problems], [['SCAN posts', 'USE TEMP B-TREE FOR ORDER BY']])
+
+    def test_paginated_lists_do_not_depend_on_page_size(self):
+        lists = [
+            ('posts-list-create', 'get', reverse('posts-list-create')),
+            ('posts-list-create', 'get-hot', reverse('posts-list-create') + '?sort=hot&'),
+            ('profile-posts', 'get', reverse('profile-posts', args=[self.members[1].id])),
+            ('tags-posts', 'get', reverse('tags-posts', args=['Topic'])),
+            ('mentions-list', 'get', reverse('mentions-list')),
+            ('notifications-list', 'get', reverse('notifications-list')),
+        ]
+        for route, method, url in lists:
+            separator = '' if url.endswith('&') else '?'
+            counts = set()
+            for page_size in self.PAGE_SIZES:
+                for shape in ('', '&shape=compact'):
+                    full_url = f'{url}{separator}page_size={page_size}{shape}'
+                    counts.add(self.assertWithinBudget(
+                        f'GET {full_url}', self.budget(route, method),
+                        lambda: self.client.get(full_url),
+                    ))
+            self.assertEqual(len(counts), 1, f'{route} query count varies with page size: {counts}')
+
+    def test_comment_threads_do_not_depend_on_length(self):
+        counts = set()
+        for size, post in self.thread_posts.items():
+            url = reverse('comments-list-create', args=[post.id])
+            counts.add(self.assertWithinBudget(
+                f'GET {url} ({size} comments)', self.budget('comments-list-create', 'get'),
+                lambda: self.client.get(url),
+            ))
+        self.assertEqual(len(counts), 1, f'Comment thread query count varies with length: {counts}')
+
+    def test_single_object_routes(self):
+        post = self.thread_posts[20]
+        reads = [
+            ('hello', 'get', reverse('hello')),
+            ('auth-me', 'get', reverse('auth-me')),
+            ('posts-detail-delete', 'get', reverse('posts-detail-delete', args=[post.id])),
+            ('profile-detail', 'get', reverse('profile-detail', args=[self.members[1].id])),
+            ('metrics-cache', 'get', reverse('metrics-cache')),
+            ('metrics-memory', 'get', reverse('metrics-memory')),
+            ('metrics-queries', 'get', reverse('metrics-queries')),
+            ('metrics-admission', 'get', reverse('metrics-admission')),
+            ('notifications-unread-count', 'get', reverse('notifications-unread-count')),
+            ('auth-availability', 'get', reverse('auth-availability') + '?username=member1&email=new@example.com'),
+            ('sync', 'get', reverse('sync') + f'?post_id={post.id}&since='
+             + sync.encode_mark(timezone.now() - timedelta(hours=1))),
+        ]
+        for route, method, url in reads:
+            self.assertWithinBudget(f'GET {url}', self.budget(route, method), lambda: self.client.get(url))
+
+    def test_write_routes(self):
+        post = self.thread_posts[5]
+        self.assertWithinBudget(
+            'POST posts', self.budget('posts-list-create', 'post'),
+            lambda: self.client.post(
+                reverse('posts-list-create'), {'content': 'New #topic post for @member1'}, format='json'
+            ),
+        )
+        self.assertWithinBudget(
+            'POST comments', self.budget('comments-list-create', 'post'),
+            # On somebody else's post, so a notification is delivered too
+            lambda: self.client.post(
+                reverse('comments-list-create', args=[self.thread_posts[20].id]), {'content': '#topic @member2'},
+                format='json'
+            ),
+        )
+        like_url = reverse('posts-like', args=[post.id])
+        self.assertWithinBudget(
+            'POST like', self.budget('posts-like', 'post'), lambda: self.client.post(like_url)
+        )
+        self.assertWithinBudget(
+            'DELETE like', self.budget('posts-like', 'delete'), lambda: self.client.delete(like_url)
+        )
+        self.assertWithinBudget(
+            'POST notifications read', self.budget('notifications-read', 'post'),
+            lambda: self.client.post(reverse('notifications-read'), {'all': True}, format='json'),
+        )
+        self.assertWithinBudget(
+            'PATCH profile', self.budget('profile-update', 'patch'),
+            lambda: self.client.patch(reverse('profile-update'), {'bio': 'Hello'}, format='json'),
+        )
+
+        comment = Comment.objects.create(post=post, author=self.member, content='Doomed')
+        threads.fill_paths([comment])
+        self.assertWithinBudget(
+            'DELETE comment', self.budget('comments-delete', 'delete'),
+            lambda: self.client.delete(reverse('comments-delete', args=[comment.id])),
+        )
+        own_post = Post.objects.create(author=self.member, content='Doomed')
+        threads.fill_paths(Comment.objects.bulk_create([
+            Comment(post=own_post, author=self.members[i], content='Reply') for i in range(10)
+        ]))
+        self.assertWithinBudget(
+            'DELETE post', self.budget('posts-detail-delete', 'delete'),
+            lambda: self.client.delete(reverse('posts-detail-delete', args=[own_post.id])),
+        )
+
+    def test_auth_routes(self):
+        anonymous = APIClient()
+        self.assertWithinBudget(
+            'POST register', self.budget('auth-register', 'post'),
+            lambda: anonymous.post(reverse('auth-register'), {
+                'username': 'newcomer',
+                'email': 'newcomer@example.com',
+                'password': 'long enough',
+                'password_confirm': 'long enough',
+            }, format='json'),
+        )
+        self.assertWithinBudget(
+            'POST login', self.budget('auth-login', 'post'),
+            lambda: anonymous.post(reverse('auth-login'), {
+                'username': self.member.username,
+                'password': 'correct horse',
+            }, format='json'),
+        )
+        self.assertWithinBudget(
+            'POST logout', self.budget('auth-logout', 'post'),
+            lambda: self.client.post(reverse('auth-logout')),
+        )
+
+
+@override_settings(CACHES=TEST_CACHES)
+class TaggingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = Member.objects.create(username='alice', email='alice@example.com', password='!')
+        cls.bob = Member.objects.create(username='bob', email='bob@example.com', password='!')
+
+    def client_for(self, member):
+        client = APIClient()
+        client.cookies['sessionid'] = create_session(member)
+        return client
+
+    def test_extraction(self):
+        self.assertEqual(tagging.extract_tags('#Django and #django, x#no &#39; #ÉTÉ'), ['django', 'été'])
+        self.assertEqual(tagging.extract_mentions('cc @bob. and @alice, not a@b.com @bob'), ['bob', 'alice'])
+
+    def test_writes_are_indexed(self):
+        alice, bob = self.client_for(self.alice), self.client_for(self.bob)
+        post_id = alice.post(
+            reverse('posts-list-create'), {'content': 'Hello #Django @bob @alice @nobody'}, format='json'
+        ).data['id']
+        bob.post(reverse('comments-list-create', args=[post_id]), {'content': 'Thanks @alice #python'}, format='json')
+
+        for tag in ('django', 'PYTHON'):
+            results = bob.get(reverse('tags-posts', args=[tag])).data['results']
+            self.assertEqual([post['id'] for post in results], [post_id])
+        self.assertEqual(bob.get(reverse('tags-posts', args=['missing'])).data['results'], [])
+
+        bob_mentions = bob.get(reverse('mentions-list')).data['results']
+        self.assertEqual([(m['post']['id'], m['comment']) for m in bob_mentions], [(post_id, None)])
+        # Self-mentions are not stored
+        alice_mentions = alice.get(reverse('mentions-list')).data['results']
+        self.assertEqual(len(alice_mentions), 1)
+        self.assertEqual(alice_mentions[0]['comment']['content'], 'Thanks @alice #python')
+
+    def test_tag_feed_pages_through_every_post(self):
+        Post.objects.bulk_create([Post(author=self.alice, content=f'#feed {i}') for i in range(25)])
+        tagging.backfill(batch_size=7)
+        client = self.client_for(self.bob)
+        url, seen = reverse('tags-posts', args=['feed']) + '?page_size=10', []
+        while url:
+            page = client.get(url).data
+            seen += [post['id'] for post in page['results']]
+            url = page['next']
+        expected = list(Post.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+        self.assertEqual(seen, expected)
+        self.assertEqual(client.get(reverse('tags-posts', args=['feed']) + '?cursor=bogus').status_code, 400)
+
+    def test_backfill_is_idempotent(self):
+        post = Post.objects.create(author=self.alice, content='#once @bob')
+        Comment.objects.create(post=post, author=self.bob, content='@alice #once #twice')
+        self.assertEqual(tagging.backfill(batch_size=1), (1, 1))
+        tagging.backfill()
+        self.assertEqual(PostTag.objects.count(), 2)
+        self.assertEqual(Mention.objects.count(), 2)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class ThreadTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = Member.objects.create(username='alice', email='alice@example.com', password='!')
+        cls.bob = Member.objects.create(username='bob', email='bob@example.com', password='!')
+        cls.post = Post.objects.create(author=cls.alice, content='Discuss')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.cookies['sessionid'] = create_session(self.bob)
+        self.url = reverse('comments-list-create', args=[self.post.id])
+
+    def reply(self, content, parent=None):
+        response = self.client.post(self.url, {'content': content, 'parent_id': parent}, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        return response.data['id']
+
+    def build_thread(self):
+        first = self.reply('first')
+        second = self.reply('second')
+        answer = self.reply('answer', first)
+        self.reply('nested @alice', answer)
+        self.reply('another answer', first)
+        self.reply('third')
+        return first, second, answer
+
+    def test_threads_are_in_display_order(self):
+        first, _, answer = self.build_thread()
+        results = self.client.get(self.url).data['results']
+        self.assertEqual(
+            [(comment['content'], comment['depth']) for comment in results],
+            [('first', 0), ('answer', 1), ('nested @alice', 2), ('another answer', 1), ('second', 0), ('third', 0)],
+        )
+        self.assertEqual(results[1]['parent_id'], first)
+        self.assertEqual(results[2]['parent_id'], answer)
+
+    def test_pages_hold_whole_threads(self):
+        self.build_thread()
+        page = self.client.get(self.url + '?page_size=1').data
+        self.assertEqual([comment['content'] for comment in page['results']],
+                         ['first', 'answer', 'nested @alice', 'another answer'])
+        page = self.client.get(page['next']).data
+        self.assertEqual([comment['content'] for comment in page['results']], ['second'])
+        page = self.client.get(page['next']).data
+        self.assertEqual([comment['content'] for comment in page['results']], ['third'])
+        self.assertIsNone(page['next'])
+
+    def test_reply_must_be_on_the_same_post(self):
+        other = Post.objects.create(author=self.alice, content='Elsewhere')
+        comment = Comment.objects.create(post=other, author=self.alice, content='Not here')
+        response = self.client.post(self.url, {'content': 'Hi', 'parent_id': comment.id}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('parent_id', response.data['details'])
+
+    def test_delete_removes_the_subtree(self):
+        first, _, answer = self.build_thread()
+        self.assertEqual(Mention.objects.filter(comment__isnull=False).count(), 1)
+        self.assertEqual(self.client.delete(reverse('comments-delete', args=[answer])).status_code, 204)
+        contents = [comment['content'] for comment in self.client.get(self.url).data['results']]
+        self.assertEqual(contents, ['first', 'another answer', 'second', 'third'])
+        self.assertEqual(Mention.objects.filter(comment__isnull=False).count(), 0)
+
+    def test_delete_tombstones_and_untags_every_reply(self):
+        first = self.reply('first #kept')
+        answer = self.reply('answer #gone #kept', first)
+        nested = self.reply('nested #deep', answer)
+        self.reply('elsewhere #kept')
+        since = timezone.now()
+        self.assertEqual(self.client.delete(reverse('comments-delete', args=[answer])).status_code, 204)
+        self.assertEqual(
+            sorted(Tombstone.objects.filter(deleted_at__gte=since).values_list('kind', 'object_id', 'post_id')),
+            [(Tombstone.COMMENT, answer, self.post.id), (Tombstone.COMMENT, nested, self.post.id)],
+        )
+        self.assertEqual(set(PostTag.objects.filter(post=self.post).values_list('tag__name', flat=True)), {'kept'})
+
+    def test_archived_threads_keep_their_shape(self):
+        self.build_thread()
+        before = self.client.get(self.url).data['results']
+        archive._archive_batch([self.post.id])
+        self.assertFalse(Comment.objects.exists())
+        self.assertEqual(self.client.get(self.url).data['results'], before)
+
+
+@override_settings(CACHES=TEST_CACHES, HOT_FEED={'HALF_LIFE_HOURS': 12, 'BATCH_SIZE': 2})
+class RankingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.member = Member.objects.create(username='ranker', email='ranker@example.com', password='!')
+        cls.start = ranking.EPOCH + timedelta(days=400)
+        cls.posts = Post.objects.bulk_create([
+            Post(author=cls.member, content=f'Post {i}', created_at=cls.start + timedelta(hours=i)) for i in range(3)
+        ])
+
+    def setUp(self):
+        # Snapshots are keyed by ids, which the rolled back tests reuse
+        caches['hot'].clear()
+        self.client = APIClient()
+        self.client.cookies['sessionid'] = create_session(self.member)
+
+    def comment(self, post, when):
+        comment = Comment.objects.create(post=post, author=self.member, content='Hot take', created_at=when)
+        threads.fill_paths([comment])
+        return comment
+
+    def score(self, post):
+        return PostScore.objects.get(post=post).score
+
+    def hot_ids(self, page_size):
+        ids, url = [], reverse('posts-list-create') + f'?sort=hot&page_size={page_size}'
+        while url:
+            page = self.client.get(url).data
+            ids.extend(post['id'] for post in page['results'])
+            url = page['next']
+        return ids
+
+    def test_score_is_the_log_of_the_decayed_event_count(self):
+        post = self.posts[0]
+        events = [post.created_at, self.start + timedelta(hours=5), self.start + timedelta(hours=30)]
+        for when in events[1:]:
+            self.comment(post, when)
+        ranking.refresh_scores()
+        tau = 12 * 3600 / math.log(2)
+        now = ranking.event_score(self.start + timedelta(days=2))
+        decayed = sum(math.exp((ranking.event_score(when) - now) / tau) for when in events)
+        self.assertAlmostEqual(self.score(post), now + tau * math.log(decayed), places=3)
+        # Ranking by score is ranking by decayed event count: one fresh comment beats two from a day earlier
+        older, newer = self.posts[1], self.posts[2]
+        for hour in (6, 7):
+            self.comment(older, self.start + timedelta(hours=hour))
+        ranking.refresh_scores()
+        self.assertGreater(self.score(older), self.score(newer))
+        self.comment(newer, self.start + timedelta(hours=40))
+        ranking.refresh_scores()
+        self.assertGreater(self.score(newer), self.score(older))
+
+    def test_refresh_only_picks_up_rows_past_its_watermarks(self):
+        self.assertEqual(ranking.refresh_scores(), (3, 0))
+        self.assertEqual(self.score(self.posts[2]), ranking.event_score(self.posts[2].created_at))
+        self.assertEqual(ranking.refresh_scores(), (0, 0))
+
+        # New posts start after Max(post_id), comments after Max(last_comment_id)
+        late = Post.objects.create(author=self.member, content='Late', created_at=self.start + timedelta(hours=9))
+        comments = [self.comment(self.posts[0], self.start + timedelta(hours=10 + i)) for i in range(3)]
+        self.assertEqual(ranking.refresh_scores(), (1, 1))
+        self.assertEqual(PostScore.objects.get(post=self.posts[0]).last_comment_id, comments[-1].id)
+        self.assertEqual(self.score(late), ranking.event_score(late.created_at))
+        score = self.score(self.posts[0])
+        self.assertEqual(ranking.refresh_scores(), (0, 0))
+        self.assertEqual(self.score(self.posts[0]), score)
+
+        # A post without a score row (e.g. deleted by hand) gets one from its first new comment
+        PostScore.objects.filter(post=self.posts[1]).delete()
+        self.comment(self.posts[1], self.start + timedelta(hours=20))
+        self.assertEqual(ranking.refresh_scores(), (0, 1))
+        self.assertGreater(self.score(self.posts[1]), ranking.event_score(self.posts[1].created_at))
+        self.assertEqual(ranking.refresh_scores(rebuild=True), (4, 2))
+        self.assertAlmostEqual(self.score(self.posts[0]), score, places=6)
+
+    def test_hot_pages_break_ties_by_post_id(self):
+        tied = Post.objects.bulk_create([Post(author=self.member, content=f'Tied {i}') for i in range(7)])
+        ranking.refresh_scores()
+        PostScore.objects.filter(post__in=tied).update(score=1e9)
+        expected = [post.id for post in sorted(tied, key=lambda post: -post.id)]
+        expected += [post.id for post in sorted(self.posts, key=lambda post: -self.score(post))]
+        # From the snapshot, across its end into live scores, and from live scores only
+        for snapshot_size in (1000, 4, 0):
+            caches['hot'].clear()
+            with self.settings(HOT_FEED={'SNAPSHOT_SIZE': snapshot_size}):
+                for page_size in (1, 2, 3, 10):
+                    self.assertEqual(self.hot_ids(page_size), expected, (snapshot_size, page_size))
+        url = reverse('posts-list-create') + '?sort=hot&cursor=bm90LWEtY3Vyc29y'
+        self.assertEqual(self.client.get(url).data, {'error': 'Invalid cursor', 'details': {}})
+
+    def test_scroll_keeps_the_ranking_it_started_on(self):
+        ranking.refresh_scores()
+        url = reverse('posts-list-create') + '?sort=hot&page_size=1'
+        first = self.client.get(url).data
+        self.assertEqual([post['id'] for post in first['results']], [self.posts[2].id])
+        # Mid-scroll, the last post takes the lead and the middle one is deleted
+        self.comment(self.posts[0], self.start + timedelta(days=1))
+        ranking.refresh_scores()
+        self.posts[1].delete()
+        self.assertEqual(self.hot_ids(1)[0], self.posts[0].id)
+
+        second = self.client.get(first['next']).data
+        self.assertEqual(second['results'], [])
+        third = self.client.get(second['next']).data
+        self.assertEqual([post['id'] for post in third['results']], [self.posts[0].id])
+        self.assertIsNone(third['next'])
+
+    def test_scroll_continues_from_live_scores_once_its_snapshot_is_gone(self):
+        ranking.refresh_scores()
+        url = reverse('posts-list-create') + '?sort=hot&page_size=1'
+        first = self.client.get(url).data
+        caches['hot'].clear()
+        rest = self.client.get(first['next'] + '&page_size=2').data
+        self.assertEqual([post['id'] for post in rest['results']], [self.posts[1].id, self.posts[0].id])
+
+
+@override_settings(CACHES=TEST_CACHES)
+class QueryLogTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.member = Member.objects.create(username='logged', email='logged@example.com', password='!')
+
+    def setUp(self):
+        scratch = tempfile.TemporaryDirectory()
+        self.addCleanup(scratch.cleanup)
+        self.directory = Path(scratch.name)
+        self.configure()
+
+    def configure(self, **config):
+        override = override_settings(SLOW_QUERY_LOG={'ENABLED': True, 'DIRECTORY': self.directory, **config})
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def test_fingerprints_ignore_literals(self):
+        key, normalized = querylog.fingerprint(
+            "SELECT  *\n FROM posts WHERE id IN (%s, %s, %s) AND content = 'it''s' AND likes_count > 10.5"
+        )
+        self.assertEqual(normalized, 'SELECT * FROM posts WHERE id IN (...) AND content = ? AND likes_count > ?')
+        # A single-element IN keeps its own fingerprint
+        single = querylog.fingerprint("SELECT * FROM posts WHERE id IN (%s) AND content = 'x' AND likes_count > 3")
+        self.assertNotEqual(single[0], key)
+        self.assertEqual(
+            querylog.fingerprint("SELECT * FROM posts WHERE id IN (%s, %s) AND content = '' AND likes_count > 1")[0],
+            key,
+        )
+        self.assertNotEqual(querylog.fingerprint('SELECT * FROM comments WHERE id = 1')[0], key)
+
+    def run_logged(self, logger):
+        querylog.set_route('api/posts/')
+        self.addCleanup(querylog.set_route, None)
+        with connection.execute_wrapper(logger):
+            Member.objects.filter(username='logged').count()
+            Member.objects.filter(bio__contains='x').count()
+
+    def test_slow_queries_keep_plan_route_and_call_site(self):
+        self.configure(THRESHOLD_MS=0, SAMPLE_RATE=0)
+        logger = querylog.QueryLogger()
+        self.run_logged(logger)
+        self.assertEqual(logger.total_queries, 2)
+        self.assertEqual(len(logger.fingerprints), 2)
+        by_sql = {entry['sql']: entry for entry in logger.slow}
+        scan = next(entry for sql, entry in by_sql.items() if 'bio' in sql)
+        self.assertEqual(scan['route'], 'api/posts/')
+        self.assertTrue(scan['call_site'].startswith('api/tests.py:'), scan['call_site'])
+        self.assertIn('SCAN members', scan['plan'])
+
+    def test_fast_queries_are_only_sampled(self):
+        self.configure(THRESHOLD_MS=10 ** 6, SAMPLE_RATE=0)
+        logger = querylog.QueryLogger()
+        self.run_logged(logger)
+        self.assertEqual((logger.total_queries, logger.fingerprints, list(logger.slow)), (2, {}, []))
+        self.configure(THRESHOLD_MS=10 ** 6, SAMPLE_RATE=1)
+        self.run_logged(logger)
+        self.assertEqual(sum(stats['count'] for stats in logger.fingerprints.values()), 2)
+        self.assertEqual(list(logger.slow), [])
+
+    def test_state_files_of_gone_workers_are_pruned(self):
+        self.configure(THRESHOLD_MS=0, SAMPLE_RATE=0, STATE_TTL=60)
+        finished = multiprocessing.get_context('fork').Process(target=os._exit, args=(0,))
+        finished.start()
+        finished.join()
+        # Exited, never existed, and running but not rewritten for STATE_TTL (e.g. a reused pid)
+        live = os.getppid()
+        for pid in (finished.pid, 4 * 10 ** 6 + 1, live):
+            (self.directory / f'{pid}.json').write_text(json.dumps({
+                'pid': pid, 'updated_at': time.time(), 'total_queries': 1, 'fingerprints': {}, 'slow': [],
+            }))
+        long_ago = time.time() - 120
+        os.utime(self.directory / f'{live}.json', (long_ago, long_ago))
+
+        logger = querylog.QueryLogger()
+        self.run_logged(logger)
+        logger.maybe_flush(force=True)
+        self.assertEqual({path.name for path in self.directory.glob('*.json')}, {f'{os.getpid()}.json'})
+        with mock.patch.object(querylog, 'logger', logger):
+            self.assertEqual(querylog.merged_report()['workers'], [os.getpid()])
+
+
+@override_settings(CACHES=TEST_CACHES, API_CACHE={'ENABLED': False}, FRAGMENTS={'ENABLED': False})
+class ArchiveTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = Member.objects.create(username='veteran', email='veteran@example.com', password='!')
+        cls.fan = Member.objects.create(username='fan', email='fan@example.com', password='!')
+        now = timezone.now()
+        cls.old = [
+            Post.objects.create(author=cls.author, content=f'Old #history post {i} for @fan',
+                                created_at=now - timedelta(days=400 + i))
+            for i in range(5)
+        ]
+        cls.recent = [
+            Post.objects.create(author=cls.author, content=f'Recent post {i}', created_at=now - timedelta(days=10))
+            for i in range(2)
+        ]
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.cookies['sessionid'] = create_session(self.fan)
+
+    def archived_ids(self):
+        return set(ArchivedPost.objects.values_list('id', flat=True))
+
+    def test_archives_old_posts_oldest_first_in_batches(self):
+        with mock.patch.object(archive, '_archive_batch', wraps=archive._archive_batch) as batches:
+            self.assertEqual(archive.archive_posts(after_days=365, batch_size=2, pause=0, limit=3), 3)
+        self.assertEqual([len(call.args[0]) for call in batches.call_args_list], [2, 1])
+        self.assertEqual(self.archived_ids(), {post.id for post in self.old[2:]})
+
+        self.assertEqual(archive.archive_posts(after_days=365, batch_size=2, pause=0), 2)
+        self.assertEqual(self.archived_ids(), {post.id for post in self.old})
+        self.assertEqual(set(Post.objects.values_list('id', flat=True)), {post.id for post in self.recent})
+        self.assertEqual(archive.archive_posts(after_days=365, pause=0), 0)
+        self.assertEqual(archive.archive_posts(after_days=5, pause=0), 2)
+
+    def test_comments_are_copied_and_everything_else_dropped(self):
+        post = self.old[0]
+        threads.fill_paths(Comment.objects.bulk_create([
+            Comment(post=post, author=self.fan, content=f'Comment {i} #history @veteran') for i in range(3)
+        ]))
+        tagging.index_posts([post])
+        tagging.index_comments(list(Comment.objects.select_related('post')))
+        Like.objects.create(post=post, member=self.fan)
+        Post.objects.filter(id=post.id).update(likes_count=1)
+        Notification.objects.create(recipient=self.author, post=post, actor=self.fan)
+        ranking.refresh_scores()
+        for model in archive.DROPPED:
+            self.assertTrue(model.objects.filter(post=post).exists(), model.__name__)
+
+        archive.archive_posts(after_days=365, pause=0)
+        self.assertEqual(ArchivedPost.objects.get(id=post.id).likes_count, 1)
+        self.assertEqual(ArchivedComment.objects.filter(post_id=post.id).count(), 3)
+        for model in archive.DROPPED:
+            self.assertFalse(model.objects.filter(post_id=post.id).exists(), model.__name__)
+
+        detail = self.client.get(reverse('posts-detail-delete', args=[post.id])).data
+        self.assertEqual((detail['likes_count'], detail['liked_by_me']), (1, False))
+        self.assertEqual(self.client.post(reverse('posts-like', args=[post.id])).status_code, 403)
+
+    def test_every_table_referencing_posts_is_copied_or_dropped(self):
+        for model in (Post, Comment):
+            related = {rel.related_model for rel in model._meta.related_objects} - {Comment}
+            self.assertLessEqual(related, set(archive.DROPPED), f'{model.__name__} rows archive_posts ignores')
+
+    def test_reads_fall_back_to_the_archive(self):
+        post = self.old[0]
+        comment = Comment.objects.create(post=post, author=self.fan, content='Still here')
+        threads.fill_paths([comment])
+        archive.archive_posts(after_days=365, pause=0)
+
+        self.assertEqual(self.client.get(reverse('posts-detail-delete', args=[post.id])).data['content'], post.content)
+        comments = self.client.get(reverse('comments-list-create', args=[post.id])).data['results']
+        self.assertEqual([item['content'] for item in comments], ['Still here'])
+        profile = self.client.get(reverse('profile-posts', args=[self.author.id]) + '?page_size=10').data
+        self.assertEqual(profile['count'], 7)
+        self.assertEqual(
+            [item['id'] for item in profile['results']], [post.id for post in self.recent[::-1] + self.old]
+        )
+        self.assertEqual(self.client.delete(reverse('comments-delete', args=[comment.id])).status_code, 204)
+        self.assertFalse(ArchivedComment.objects.exists())
+        self.assertEqual(self.client.get(reverse('posts-detail-delete', args=[10 ** 9])).status_code, 404)
+
+
+@override_settings(CACHES=TEST_CACHES, LIKES={'FLUSH_EVERY': 3, 'FLUSH_INTERVAL': 60})
+class LikeTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.members = [
+            Member.objects.create(username=f'fan{i}', email=f'fan{i}@example.com', password='!') for i in range(4)
+        ]
+        cls.post = Post.objects.create(author=cls.members[0], content='Like me')
+
+    def setUp(self):
+        counter = likes.LikeCounter()
+        patcher = mock.patch.object(likes, 'counter', counter)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.counter = counter
+
+    def client_for(self, member):
+        client = APIClient()
+        client.cookies['sessionid'] = create_session(member)
+        return client
+
+    def stored_count(self):
+        return Post.objects.values_list('likes_count', flat=True).get(id=self.post.id)
+
+    def test_likes_are_idempotent(self):
+        client, url = self.client_for(self.members[1]), reverse('posts-like', args=[self.post.id])
+        self.assertEqual(client.post(url).status_code, 201)
+        response = client.post(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {'liked': True, 'likes_count': 1})
+        self.assertEqual(client.delete(url).data, {'liked': False, 'likes_count': 0})
+        self.assertEqual(client.delete(url).data, {'liked': False, 'likes_count': 0})
+        self.assertFalse(Like.objects.exists())
+
+    def test_counts_are_buffered_and_bounded(self):
+        url = reverse('posts-like', args=[self.post.id])
+        for member in self.members[:2]:
+            self.client_for(member).post(url)
+        # Below FLUSH_EVERY: the table lags, this worker still reports the exact count
+        self.assertEqual(self.stored_count(), 0)
+        detail = self.client_for(self.members[0]).get(reverse('posts-detail-delete', args=[self.post.id])).data
+        self.assertEqual((detail['likes_count'], detail['liked_by_me']), (2, True))
+
+        self.client_for(self.members[2]).post(url)
+        self.assertEqual(self.stored_count(), 3)
+        self.assertEqual(self.counter.unflushed, 0)
+
+    def test_stale_deltas_flush_after_a_request(self):
+        self.client_for(self.members[1]).post(reverse('posts-like', args=[self.post.id]))
+        self.assertEqual(self.stored_count(), 0)
+        with self.settings(LIKES={'FLUSH_EVERY': 3, 'FLUSH_INTERVAL': 0}):
+            self.client_for(self.members[1]).get(reverse('hello'))
+        self.assertEqual(self.stored_count(), 1)
+
+    def test_liked_by_me_in_lists(self):
+        other = Post.objects.create(author=self.members[0], content='Ignore me')
+        Like.objects.create(post=self.post, member=self.members[1])
+        results = self.client_for(self.members[1]).get(reverse('posts-list-create')).data['results']
+        self.assertEqual({post['id']: post['liked_by_me'] for post in results}, {self.post.id: True, other.id: False})
+
+    def like_in(self, worker, member):
+        # `worker` stands in for the like counter of another gunicorn worker or process
+        with mock.patch.object(likes, 'counter', worker):
+            self.assertTrue(likes.like(member, self.post.id))
+
+    def test_reconcile_between_buffer_and_flush_does_not_double_count(self):
+        self.like_in(self.counter, self.members[1])
+        # reconcile_like_counts runs in its own process, with nothing buffered
+        self.like_in(likes.LikeCounter(), self.members[2])
+        with mock.patch.object(likes, 'counter', likes.LikeCounter()):
+            likes.reconcile()
+        self.assertEqual(self.stored_count(), 2)
+        self.assertEqual(self.counter.flush(), 1)
+        self.assertEqual(self.stored_count(), 2)
+
+    def test_workers_flushing_in_any_order(self):
+        other = likes.LikeCounter()
+        self.like_in(self.counter, self.members[1])
+        self.like_in(other, self.members[2])
+        self.like_in(other, self.members[3])
+        other.flush()
+        self.assertEqual(self.stored_count(), 3)
+        self.counter.flush()
+        self.assertEqual(self.stored_count(), 3)
+        with mock.patch.object(likes, 'counter', other):
+            self.assertTrue(likes.unlike(self.members[2], self.post.id))
+        self.like_in(self.counter, self.members[2])
+        self.counter.flush()
+        other.flush()
+        self.assertEqual(self.stored_count(), 3)
+
+    def test_failed_flush_keeps_deltas(self):
+        self.like_in(self.counter, self.members[1])
+        with mock.patch.object(likes.Post.objects, 'filter', side_effect=OperationalError('database is locked')):
+            with self.assertLogs('api.likes', 'ERROR'):
+                self.assertEqual(self.counter.flush(), 0)
+        # Retried with the next like, past FLUSH_EVERY - 1 buffered
+        self.like_in(self.counter, self.members[2])
+        self.assertEqual(self.counter.unflushed, 2)
+        self.like_in(self.counter, self.members[3])
+        self.assertEqual((self.counter.unflushed, self.stored_count()), (0, 3))
+
+    def test_reconcile_repairs_drift(self):
+        for member in self.members[1:]:
+            Like.objects.create(post=self.post, member=member)
+        Post.objects.filter(id=self.post.id).update(likes_count=42)
+        self.assertEqual(likes.reconcile(batch_size=1), 1)
+        self.assertEqual(self.stored_count(), 3)
+        self.assertEqual(likes.reconcile(), 0)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class NotificationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = Member.objects.create(username='alice', email='alice@example.com', password='!')
+        cls.bob = Member.objects.create(username='bob', email='bob@example.com', password='!')
+        cls.carol = Member.objects.create(username='carol', email='carol@example.com', password='!')
+        cls.posts = [Post.objects.create(author=cls.alice, content=f'Post {i}') for i in range(2)]
+
+    def setUp(self):
+        caches['default'].clear()
+
+    def client_for(self, member):
+        client = APIClient()
+        client.cookies['sessionid'] = create_session(member)
+        return client
+
+    def comment(self, member, post, content='Nice'):
+        response = self.client_for(member).post(
+            reverse('comments-list-create', args=[post.id]), {'content': content}, format='json'
+        )
+        self.assertEqual(response.status_code, 201, response.data)
+        return response.data['id']
+
+    def test_comments_on_a_post_are_batched_while_unread(self):
+        self.comment(self.bob, self.posts[0])
+        last = self.comment(self.carol, self.posts[0])
+        self.comment(self.bob, self.posts[1])
+        self.comment(self.alice, self.posts[1], 'Own post, no notification')
+
+        inbox = self.client_for(self.alice).get(reverse('notifications-list')).data['results']
+        self.assertEqual(
+            [(n['post_id'], n['comment_count'], n['read']) for n in inbox],
+            [(self.posts[1].id, 1, False), (self.posts[0].id, 2, False)],
+        )
+        self.assertEqual((inbox[1]['actor']['username'], inbox[1]['last_comment_id']), ('carol', last))
+        self.assertFalse(Notification.objects.exclude(recipient=self.alice).exists())
+
+        # Once read, the next comment starts a new notification
+        notifications.mark_read(self.alice)
+        self.comment(self.carol, self.posts[0])
+        self.assertEqual(Notification.objects.filter(post=self.posts[0]).count(), 2)
+
+    def test_unread_count_is_cached_and_kept_current(self):
+        alice, url = self.client_for(self.alice), reverse('notifications-unread-count')
+        self.assertEqual(alice.get(url).data, {'unread_count': 0})
+        with self.assertNumQueries(0):
+            self.assertEqual(alice.get(url).data, {'unread_count': 0})
+
+        self.comment(self.bob, self.posts[0])
+        self.comment(self.bob, self.posts[0])
+        self.comment(self.carol, self.posts[1])
+        with self.assertNumQueries(0):
+            self.assertEqual(alice.get(url).data, {'unread_count': 2})
+
+        first = Notification.objects.get(post=self.posts[0])
+        response = alice.post(reverse('notifications-read'), {'ids': [first.id]}, format='json')
+        self.assertEqual(response.data, {'marked': 1, 'unread_count': 1})
+        # Marking twice, or someone else's notifications, changes nothing
+        again = alice.post(reverse('notifications-read'), {'ids': [first.id]}, format='json')
+        self.assertEqual(again.data['marked'], 0)
+        self.assertEqual(self.client_for(self.bob).post(
+            reverse('notifications-read'), {'all': True}, format='json'
+        ).data['marked'], 0)
+        self.assertEqual(alice.post(reverse('notifications-read'), {'all': True}, format='json').data,
+                         {'marked': 1, 'unread_count': 0})
+        self.assertEqual(Notification.objects.filter(read_at__isnull=True).count(), 0)
+
+    def test_unread_count_is_an_atomic_counter(self):
+        alice, url = self.client_for(self.alice), reverse('notifications-unread-count')
+        self.assertEqual(alice.get(url).data, {'unread_count': 0})
+        cache, key = caches['default'], f'notifications:unread:{self.alice.id}'
+        with mock.patch.object(cache, 'set', wraps=cache.set) as set_, \
+                mock.patch.object(cache, 'incr', wraps=cache.incr) as incr:
+            self.comment(self.bob, self.posts[0])
+            notifications.mark_read(self.alice)
+            self.comment(self.bob, self.posts[1])
+        self.assertEqual([args for args, _ in incr.call_args_list if args[0] == key], [(key, 1), (key, -1), (key, 1)])
+        self.assertFalse([args for args, _ in set_.call_args_list if args[0] == key])
+        self.assertEqual(cache.get(key), 1)
+
+    def test_unread_count_follows_deleted_and_archived_posts(self):
+        alice, url = self.client_for(self.alice), reverse('notifications-unread-count')
+        extra = Post.objects.create(author=self.alice, content='Old', created_at=timezone.now() - timedelta(days=30))
+        for post in (*self.posts, extra):
+            self.comment(self.bob, post)
+        self.assertEqual(alice.get(url).data, {'unread_count': 3})
+        self.assertEqual(alice.delete(reverse('posts-detail-delete', args=[self.posts[0].id])).status_code, 204)
+        self.assertEqual(alice.get(url).data, {'unread_count': 2})
+        self.assertEqual(archive.archive_posts(after_days=7, pause=0), 1)
+        self.assertEqual(alice.get(url).data, {'unread_count': 1})
+
+    def test_mark_read_validation_and_auth(self):
+        alice = self.client_for(self.alice)
+        for body in ({}, {'ids': [1], 'all': True}, {'ids': []}, {'ids': list(range(1, 102))}):
+            self.assertEqual(alice.post(reverse('notifications-read'), body, format='json').status_code, 400)
+        self.assertEqual(APIClient().get(reverse('notifications-unread-count')).status_code, 403)
+
+    def test_inbox_pages_by_latest_activity(self):
+        posts = Post.objects.bulk_create([Post(author=self.alice, content=f'Bulk {i}') for i in range(12)])
+        notifications.deliver([
+            (self.alice.id, post.id, self.bob.id, None, timezone.now()) for post in posts
+        ])
+        client = self.client_for(self.alice)
+        url, seen = reverse('notifications-list') + '?page_size=5', []
+        while url:
+            page = client.get(url).data
+            seen += [n['id'] for n in page['results']]
+            url = page['next']
+        expected = list(Notification.objects.order_by('-updated_at', '-id').values_list('id', flat=True))
+        self.assertEqual(seen, expected)
+        self.assertEqual(len(seen), 12)
+
+
+@override_settings(CACHES=TEST_CACHES, SYNC={'SETTLE_SECONDS': 0, 'LIMIT': 5})
+class SyncTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = Member.objects.create(username='alice', email='alice@example.com', password='!')
+        cls.bob = Member.objects.create(username='bob', email='bob@example.com', password='!')
+        cls.posts = [Post.objects.create(author=cls.alice, content=f'Post {i}') for i in range(3)]
+        cls.comments = [Comment.objects.create(post=cls.posts[0], author=cls.bob, content=f'Re {i}') for i in range(2)]
+        threads.fill_paths(cls.comments)
+        an_hour_ago = timezone.now() - timedelta(hours=1)
+        Post.objects.update(updated_at=an_hour_ago)
+        Comment.objects.update(updated_at=an_hour_ago)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.cookies['sessionid'] = create_session(self.alice)
+
+    def sync(self, since=None, **params):
+        if since is not None:
+            params['since'] = since
+        response = self.client.get(reverse('sync'), params)
+        self.assertEqual(response.status_code, 200, response.data)
+        return response.data
+
+    def test_only_changes_since_the_mark_are_returned(self):
+        since = self.sync()['since']
+        new_post = self.client.post(reverse('posts-list-create'), {'content': 'New'}, format='json').data['id']
+        new_comment = self.client.post(
+            reverse('comments-list-create', args=[self.posts[0].id]), {'content': 'Hi'}, format='json'
+        ).data['id']
+        bob = APIClient()
+        bob.cookies['sessionid'] = create_session(self.bob)
+        self.assertEqual(bob.delete(reverse('comments-delete', args=[self.comments[0].id])).status_code, 204)
+        self.assertEqual(self.client.delete(reverse('posts-detail-delete', args=[self.posts[2].id])).status_code, 204)
+
+        changed = self.sync(since, post_id=self.posts[0].id)
+        self.assertFalse(changed['reset'])
+        self.assertEqual([post['id'] for post in changed['posts']], [new_post])
+        self.assertEqual([comment['id'] for comment in changed['comments']], [new_comment])
+        self.assertEqual(changed['deleted'], {'posts': [self.posts[2].id], 'comments': [self.comments[0].id]})
+        # Comments of other posts are not part of the feed sync
+        self.assertEqual(self.sync(since)['comments'], [])
+
+        unchanged = self.sync(changed['since'], post_id=self.posts[0].id)
+        self.assertEqual((unchanged['posts'], unchanged['comments']), ([], []))
+        self.assertEqual(unchanged['deleted'], {'posts': [], 'comments': []})
+
+    def test_clients_reset_instead_of_syncing_too_much(self):
+        self.assertTrue(self.sync()['reset'])
+        expired = sync.encode_mark(timezone.now() - timedelta(days=30))
+        self.assertTrue(self.sync(expired)['reset'])
+        since = sync.encode_mark(timezone.now() - timedelta(minutes=1))
+        Post.objects.bulk_create([Post(author=self.bob, content=f'Bulk {i}') for i in range(6)])
+        self.assertTrue(self.sync(since)['reset'])
+        for token in ('bogus', sync.encode_mark(timezone.now().replace(tzinfo=None))):
+            self.assertEqual(self.client.get(reverse('sync'), {'since': token}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('sync'), {'post_id': 'x'}).status_code, 400)
+
+    def test_prune_drops_expired_tombstones(self):
+        sync.record_deleted_posts([1, 2])
+        Tombstone.objects.filter(object_id=1).update(deleted_at=timezone.now() - timedelta(days=8))
+        self.assertEqual(sync.prune(batch_size=1), 1)
+        self.assertEqual(list(Tombstone.objects.values_list('object_id', flat=True)), [2])
+
+
+class BackupTests(SimpleTestCase):
+    def setUp(self):
+        scratch = tempfile.TemporaryDirectory()
+        self.addCleanup(scratch.cleanup)
+        self.scratch = Path(scratch.name)
+        self.source = self.scratch / 'source.sqlite3'
+        connection = sqlite3.connect(self.source)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('CREATE TABLE items (id INTEGER PRIMARY KEY, payload TEXT)')
+        connection.executemany('INSERT INTO items (payload) VALUES (?)', [('x' * 500,)] * 2000)
+        connection.commit()
+        connection.close()
+        self.directory = self.scratch / 'backups'
+
+    def rows(self, path):
+        connection = sqlite3.connect(path)
+        try:
+            return connection.execute('SELECT COUNT(*) FROM items').fetchone()[0]
+        finally:
+            connection.close()
+
+    def test_stepped_copy_does_not_restart_while_others_write(self):
+        stop = threading.Event()
+
+        def writer():
+            connection = sqlite3.connect(self.source, timeout=5)
+            while not stop.is_set():
+                connection.execute("INSERT INTO items (payload) VALUES ('new')")
+                connection.commit()
+            connection.close()
+
+        thread = threading.Thread(target=writer)
+        thread.start()
+        try:
+            stats = backup.copy_online(self.source, self.scratch / 'copy.sqlite3', pages=8, step_sleep=0.001)
+        finally:
+            stop.set()
+            thread.join()
+        self.assertEqual((stats['journal_mode'], stats['restarts']), ('wal', 0))
+        self.assertGreater(stats['steps'], 10)
+        self.assertEqual(backup.integrity_errors(self.scratch / 'copy.sqlite3'), [])
+        self.assertGreaterEqual(self.rows(self.scratch / 'copy.sqlite3'), 2000)
+
+    def test_snapshot_restore_round_trip(self):
+        manifest = backup.create_snapshot(self.source, self.directory)
+        snapshot_path = self.directory / manifest['name']
+        self.assertEqual(backup.verify(snapshot_path)['sha256'], manifest['sha256'])
+
+        target = self.scratch / 'restored.sqlite3'
+        sqlite3.connect(target).close()
+        backup.restore(snapshot_path, target)
+        self.assertEqual(self.rows(target), 2000)
+
+        data = bytearray(snapshot_path.read_bytes())
+        data[len(data) // 2] ^= 0xFF
+        snapshot_path.write_bytes(bytes(data))
+        with self.assertRaisesMessage(backup.BackupError, 'does not match its checksum'):
+            backup.restore(snapshot_path, target)
+        self.assertEqual(self.rows(target), 2000)
+
+    @override_settings(CACHES=TEST_CACHES)
+    def test_restore_command_clears_every_cache(self):
+        manifest = backup.create_snapshot(self.source, self.directory)
+        target = self.scratch / 'restored.sqlite3'
+        for alias in TEST_CACHES:
+            caches[alias].set('before-restore', 1)
+        output = io.StringIO()
+        with mock.patch.object(backup, 'database_path', return_value=target):
+            call_command('restore', str(self.directory / manifest['name']), '--noinput', stdout=output)
+        self.assertEqual(self.rows(target), 2000)
+        self.assertEqual([alias for alias in TEST_CACHES if caches[alias].get('before-restore')], [])
+        self.assertIn('Restart the workers', output.getvalue())
+
+    def test_rotation_and_point_in_time_lookup(self):
+        manifest = backup.create_snapshot(self.source, self.directory)
+        latest = self.directory / manifest['name']
+        for day in (1, 2):
+            name = f'db-2024010{day}T000000Z'
+            shutil.copy(latest, self.directory / f'{name}.sqlite3.gz')
+            (self.directory / f'{name}.json').write_text(json.dumps(
+                {**manifest, 'name': f'{name}.sqlite3.gz', 'created_at': f'2024-01-0{day}T00:00:00+00:00'}
+            ))
+        moment = datetime(2024, 1, 1, 12, tzinfo=dt_timezone.utc)
+        self.assertEqual(backup.snapshot_at(moment, self.directory)['name'], 'db-20240101T000000Z.sqlite3.gz')
+        self.assertIsNone(backup.snapshot_at(moment - timedelta(days=1), self.directory))
+
+        self.assertEqual(backup.rotate(self.directory, keep=2), ['db-20240101T000000Z.sqlite3.gz'])
+        self.assertEqual(
+            [snapshot['name'] for snapshot in backup.list_snapshots(self.directory)],
+            ['db-20240102T000000Z.sqlite3.gz', manifest['name']],
+        )
+        self.assertFalse((self.directory / 'db-20240101T000000Z.json').exists())
+
+
+
+@override_settings(CACHES=TEST_CACHES, AVAILABILITY={'MIN_CAPACITY': 100})
+class AvailabilityTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Member.objects.bulk_create([
+            Member(username=f'member{i}', email=f'member{i}@example.com', password='!') for i in range(50)
+        ])
+
+    def setUp(self):
+        caches['default'].clear()
+        self.index = availability.AvailabilityIndex()
+        patcher = mock.patch.object(availability, 'index', self.index)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_free_values_cost_no_query(self):
+        self.assertEqual(self.index.check(username='member1'), {'username': False})
+        with self.assertNumQueries(0):
+            self.assertEqual(self.index.check(username='newcomer', email='new@example.com'),
+                             {'username': True, 'email': True})
+        # Taken in another case: the filter says maybe, the exact check says free, as registration does
+        with self.assertNumQueries(1):
+            self.assertEqual(self.index.check(username='MEMBER1'), {'username': True})
+        with self.assertNumQueries(1):
+            self.assertEqual(self.index.check(email='member2@example.com'), {'email': False})
+
+    def test_registrations_in_other_workers_are_caught_up(self):
+        self.index.check(username='warm')
+        other_worker = availability.AvailabilityIndex()
+        other_worker.check(username='warm')
+        with mock.patch.object(availability, 'index', other_worker):
+            serializer = RegisterSerializer(data={
+                'username': 'newcomer', 'email': 'new@example.com',
+                'password': 'long enough', 'password_confirm': 'long enough',
+            })
+            self.assertTrue(serializer.is_valid(), serializer.errors)
+            serializer.save()
+        # The registering worker added it itself; only the exact check runs
+        with self.assertNumQueries(1):
+            self.assertEqual(other_worker.check(username='newcomer'), {'username': False})
+        # This one catches up first
+        with self.assertNumQueries(2):
+            self.assertEqual(self.index.check(username='newcomer'), {'username': False})
+        with self.assertNumQueries(0):
+            self.assertEqual(self.index.check(username='another'), {'username': True})
+
+    def test_endpoint(self):
+        client = APIClient()
+        url = reverse('auth-availability')
+        self.assertEqual(client.get(url, {'username': 'member3', 'email': 'x@example.com'}).data,
+                         {'username': False, 'email': True})
+        self.assertEqual(client.get(url).status_code, 400)
+        self.assertIn('email', client.get(url, {'email': 'not-an-email'}).data['details'])
+
+    def test_bloom_filter_false_positive_rate(self):
+        bloom = availability.BloomFilter(10000, 0.001)
+        for i in range(10000):
+            bloom.add(f'u:member{i}')
+        self.assertTrue(all(f'u:member{i}' in bloom for i in range(10000)))
+        false_positives = sum(f'u:other{i}' in bloom for i in range(20000))
+        self.assertLess(false_positives, 60)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class AdmissionControlTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = Member.objects.create(username='staff', email='staff@example.com', password='!', is_staff=True)
+        Post.objects.create(author=cls.staff, content='Post')
+
+    def setUp(self):
+        scratch = tempfile.TemporaryDirectory()
+        self.addCleanup(scratch.cleanup)
+        settings_override = override_settings(ADMISSION={'LOCATION': Path(scratch.name) / 'admission.shm'})
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.config = admission.get_config()
+        self.client = APIClient()
+        self.client.cookies['sessionid'] = create_session(self.staff)
+
+    def other_worker(self, in_flight, queue_delay_ms=0.0):
+        # A live process standing in for a second gunicorn worker
+        board = admission.board()
+        offset = next(
+            index * admission.SLOT.size for index in range(board.max_workers)
+            if index * admission.SLOT.size != board.offset
+        )
+        admission.SLOT.pack_into(
+            board.map, offset, os.getppid(), in_flight, queue_delay_ms, time.time(), time.time(), *[0] * 9
+        )
+
+    def test_priorities(self):
+        self.assertEqual(admission.priority('posts-list-create', 'GET', self.config), 'low')
+        self.assertEqual(admission.priority('sync', 'GET', self.config), 'low')
+        self.assertEqual(admission.priority('posts-detail-delete', 'GET', self.config), 'normal')
+        self.assertEqual(admission.priority('posts-list-create', 'POST', self.config), 'critical')
+        self.assertEqual(admission.priority('auth-me', 'GET', self.config), 'critical')
+        self.assertIsNone(admission.priority('hello', 'GET', self.config))
+
+    def test_sheds_low_priority_first_while_every_worker_is_busy(self):
+        waited = time.time() - 2
+        self.other_worker(in_flight=0)
+        self.assertEqual(admission.decide(waited, None, 'low', self.config), 'admit')
+        admission.finish()
+
+        self.other_worker(in_flight=1)
+        self.assertEqual(admission.decide(waited, None, 'low', self.config), 'shed')
+        self.assertEqual(admission.decide(waited, None, 'normal', self.config), 'shed')
+        self.assertEqual(admission.decide(waited, None, 'critical', self.config), 'admit')
+        admission.finish()
+        self.assertEqual(admission.decide(time.time() - 120, None, 'critical', self.config), 'expired')
+        self.assertEqual(admission.decide(None, time.time() - 1, 'critical', self.config), 'expired')
+
+        stats = admission.snapshot()
+        self.assertEqual(stats['in_flight'], 1)
+        self.assertEqual(stats['shed'], {'low': 1, 'normal': 1, 'critical': 0})
+        self.assertEqual(stats['expired']['critical'], 2)
+        self.assertEqual(stats['shed_ratio']['low'], 0.5)
+
+    def test_middleware_returns_503_with_retry_after(self):
+        self.other_worker(in_flight=1, queue_delay_ms=3000)
+        started = f't={time.time() - 0.5:.3f}'
+        response = self.client.get(reverse('posts-list-create'), HTTP_X_REQUEST_START=started)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '5')
+        self.assertEqual(response.json()['details'], {'priority': 'low'})
+        self.assertEqual(self.client.get(reverse('hello'), HTTP_X_REQUEST_START=started).status_code, 200)
+        response = self.client.post(
+            reverse('posts-list-create'), {'content': 'Still accepted'}, format='json', HTTP_X_REQUEST_START=started
+        )
+        self.assertEqual(response.status_code, 201)
+
+        stats = self.client.get(reverse('metrics-admission')).data
+        self.assertEqual(stats['in_flight'], 1)
+        self.assertEqual((stats['shed']['low'], stats['admitted']['critical']), (1, 1))
+
+
+@override_settings(CACHES=TEST_CACHES, MEMORY_PROFILING={'ENABLED': True, 'ROUTE_THRESHOLD_BYTES': 1 << 40})
+class MemoryProfilingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = Member.objects.create(username='staff', email='staff@example.com', password='!', is_staff=True)
+
+    def setUp(self):
+        if not tracemalloc.is_tracing():
+            self.addCleanup(tracemalloc.stop)
+        self.monitor = memory.MemoryMonitor()
+        self.monitor.start()
+        patcher = mock.patch.object(memory, 'monitor', self.monitor)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = APIClient()
+        self.client.cookies['sessionid'] = create_session(self.staff)
+
+    def arm(self, body):
+        return self.client.post(reverse('metrics-memory'), body, format='json')
+
+    def test_arms_given_routes(self):
+        self.assertEqual(self.arm({'routes': ['api/posts/', 'api/hello/']}).status_code, 202)
+        self.assertEqual(self.monitor.armed, {'api/posts/', 'api/hello/'})
+
+    def test_arms_every_seen_route_by_default(self):
+        self.monitor.after_request('api/posts/', self.monitor.before_request('api/posts/'))
+        self.assertEqual(self.arm({}).status_code, 202)
+        self.assertEqual(self.monitor.armed, {'api/posts/'})
+
+    def test_malformed_bodies_are_rejected(self):
+        for body in (['api/posts/'], {'routes': 'api/posts/'}, {'routes': [{'route': 'api/posts/'}]}):
+            response = self.arm(body)
+            self.assertEqual(response.status_code, 400, body)
+            self.assertEqual(response.data['error'], 'Validation error')
+            self.assertTrue(response.data['details'])
+        self.assertEqual(self.monitor.armed, set())
+
+    def test_disabled(self):
+        with override_settings(MEMORY_PROFILING={'ENABLED': False}):
+            response = self.arm({'routes': ['api/posts/']})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data, {'error': 'Memory profiling is disabled', 'details': {}})
+
+    def test_armed_route_reports_its_allocation_sites_once(self):
+        self.monitor.arm(['api/posts/'])
+        token = self.monitor.before_request('api/posts/')
+        self.assertIsNotNone(token['snapshot'])
+        retained = [bytearray(4096) for _ in range(64)]
+        self.monitor.after_request('api/posts/', token)
+        report = self.monitor.report()['route_reports']['api/posts/']
+        self.assertGreaterEqual(report['retained_bytes'], 64 * 4096)
+        self.assertIn('tests.py', report['top_sites'][0]['site'])
+        self.assertEqual(self.monitor.armed, set())
+        self.assertIsNone(self.monitor.before_request('api/posts/')['snapshot'])
+        del retained
+
+
+@override_settings(CACHES=TEST_CACHES)
+class RequestProfilerTests(BudgetAssertionsMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = Member.objects.create(username='staff', email='staff@example.com', password='!', is_staff=True)
+        cls.member = Member.objects.create(username='member', email='member@example.com', password='!')
+        Post.objects.bulk_create([Post(author=cls.member, content=f'Post {i}') for i in range(5)])
+
+    def setUp(self):
+        scratch = tempfile.TemporaryDirectory()
+        self.addCleanup(scratch.cleanup)
+        self.directory = Path(scratch.name)
+        settings_override = override_settings(PROFILER={'DIRECTORY': self.directory, 'KEEP': 2})
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.client = APIClient()
+        self.client.cookies['sessionid'] = create_session(self.staff)
+
+    def test_staff_request_is_profiled_with_sql_timeline(self):
+        response = self.client.get(reverse('posts-list-create'), HTTP_X_PROFILE='1')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 5)
+        profile_id = response['X-Profile-Id']
+
+        listed = self.client.get(reverse('metrics-profiles')).data['results']
+        self.assertEqual([profile['id'] for profile in listed], [profile_id])
+        self.assertEqual((listed[0]['route'], listed[0]['status'], listed[0]['mode']), ('api/posts/', 200, 'cprofile'))
+
+        profile = self.client.get(reverse('metrics-profile-detail', args=[profile_id])).data
+        self.assertEqual(profile['query_count'], len(profile['queries']))
+        self.assertTrue(any('FROM "posts"' in query['sql'] for query in profile['queries']))
+        self.assertTrue(any(function['function'].startswith('api/views.py:') for function in profile['functions']))
+        raw = self.client.get(reverse('metrics-profile-detail', args=[profile_id]) + '?raw=1')
+        self.assertEqual(raw['Content-Disposition'], f'attachment; filename="{profile_id}.prof"')
+
+    def test_sampling_mode_writes_folded_stacks(self):
+        with mock.patch('api.profiling.Sampler.run', autospec=True, side_effect=_sample_once):
+            response = self.client.get(reverse('posts-list-create') + '?_profile=sample')
+        profile = self.client.get(reverse('metrics-profile-detail', args=[response['X-Profile-Id']])).data
+        self.assertEqual(profile['mode'], 'sample')
+        self.assertEqual(profile['folded'], ['api/views.py:PostListCreateView.get 1'])
+
+    def test_ignored_for_members_and_without_flag(self):
+        member = APIClient()
+        member.cookies['sessionid'] = create_session(self.member)
+        self.assertNotIn('X-Profile-Id', member.get(reverse('posts-list-create'), HTTP_X_PROFILE='1'))
+        self.assertNotIn('X-Profile-Id', self.client.get(reverse('posts-list-create')))
+        self.assertNotIn('X-Profile-Id', self.client.get(reverse('posts-list-create'), HTTP_X_PROFILE='0'))
+        self.assertEqual(list(self.directory.iterdir()), [])
+
+    def test_only_newest_profiles_are_kept(self):
+        ids = [self.client.get(reverse('hello'), HTTP_X_PROFILE='1')['X-Profile-Id'] for _ in range(3)]
+        self.assertEqual(len(list(self.directory.glob('*.json'))), 2)
+        self.assertEqual(self.client.get(reverse('metrics-profile-detail', args=['..etc'])).status_code, 404)
+        self.assertEqual(len(profiling.list_profiles()), 2)
+        self.assertTrue(set(profile['id'] for profile in profiling.list_profiles()) <= set(ids))
+
+    def test_routes_within_budget(self):
+        profile_id = self.client.get(reverse('hello'), HTTP_X_PROFILE='1')['X-Profile-Id']
+        for route, args in (('metrics-profiles', []), ('metrics-profile-detail', [profile_id])):
+            url = reverse(route, args=args)
+            self.assertWithinBudget(
+                f'GET {url}', RouteBudgetTests.QUERY_BUDGETS[(route, 'get')], lambda: self.client.get(url)
+            )
+
+
+def _sample_once(sampler):
+    # Deterministic stand-in for the sampling loop: one stack per run
+    sampler.finished.wait()
+    sampler.stacks['api/views.py:PostListCreateView.get'] += 1
+
+
+class SharedMemoryCacheTests(SimpleTestCase):
+    """
+    The parts of Django's cache backend contract this backend implements itself
+    """
+
+    def setUp(self):
+        scratch = tempfile.TemporaryDirectory()
+        self.addCleanup(scratch.cleanup)
+        self.location = Path(scratch.name) / 'test.shm'
+        self.cache = self.make_cache()
+
+    def make_cache(self, **options):
+        return SharedMemoryCache(str(self.location), {
+            'TIMEOUT': 60, 'OPTIONS': {'MAX_ENTRIES': 256, 'SLOT_SIZE': 512, 'STRIPES': 4, **options},
+        })
+
+    def test_basic_operations(self):
+        cache = self.cache
+        self.assertIsNone(cache.get('missing'))
+        self.assertEqual(cache.get('missing', 'default'), 'default')
+        cache.set('key', {'nested': [1, 2]})
+        self.assertEqual(cache.get('key'), {'nested': [1, 2]})
+        self.assertFalse(cache.add('key', 'other'))
+        self.assertTrue(cache.add('new', None))
+        self.assertTrue(cache.has_key('new'))
+        self.assertIsNone(cache.get('new', 'default'))
+        self.assertTrue(cache.delete('key'))
+        self.assertFalse(cache.delete('key'))
+        self.assertFalse(cache.has_key('key'))
+
+        cache.set('counter', 10)
+        self.assertEqual(cache.incr('counter', 5), 15)
+        self.assertEqual(cache.decr('counter'), 14)
+        with self.assertRaises(ValueError):
+            cache.incr('missing')
+
+        self.assertEqual(cache.set_many({'a': 1, 'b': 2}), [])
+        self.assertEqual(cache.get_many(['a', 'b', 'c']), {'a': 1, 'b': 2})
+        cache.delete_many(['a', 'b'])
+        self.assertEqual(cache.get_many(['a', 'b']), {})
+
+        cache.set('versioned', 'one', version=1)
+        cache.set('versioned', 'two', version=2)
+        self.assertEqual((cache.get('versioned', version=1), cache.get('versioned', version=2)), ('one', 'two'))
+        cache.clear()
+        self.assertIsNone(cache.get('versioned', version=2))
+        self.assertEqual(cache.stats()['used'], 0)
+
+    def test_timeouts(self):
+        cache = self.cache
+        cache.set('never', 1, timeout=None)
+        cache.set('now', 1, timeout=0)
+        self.assertEqual(cache.get('never'), 1)
+        self.assertIsNone(cache.get('now'))
+        with mock.patch('api.shmcache.time.time', return_value=time.time() + 61):
+            self.assertEqual(cache.get('never'), 1)
+        cache.set('short', 1)
+        self.assertTrue(cache.touch('short', 120))
+        with mock.patch('api.shmcache.time.time', return_value=time.time() + 61):
+            self.assertEqual(cache.get('short'), 1)
+            self.assertTrue(cache.add('expired', 1, timeout=1))
+        with mock.patch('api.shmcache.time.time', return_value=time.time() + 121):
+            self.assertIsNone(cache.get('short'))
+            self.assertFalse(cache.touch('short'))
+            self.assertTrue(cache.add('short', 2))
+        self.assertEqual(cache.get('short'), 2)
+
+    def test_values_too_large_for_a_slot(self):
+        cache = self.cache
+        cache.set('text', 'x' * 4000)
+        self.assertEqual(cache.get('text'), 'x' * 4000)
+        cache.set('blob', b'old')
+        self.assertEqual(cache.set_many({'blob': os.urandom(1000), 'small': 1}), ['blob'])
+        self.assertIsNone(cache.get('blob'))
+        self.assertEqual(cache.get('small'), 1)
+
+    def test_writers_publish_the_sequence_number_last(self):
+        cache = self.make_cache()
+        cache.set('key', 'old')
+        stores = []
+        real_slot, real_sequence = shmcache.SLOT, shmcache._SEQUENCE
+
+        class Recording:
+            def __init__(self, name, struct):
+                self.name, self.struct = name, struct
+
+            def __getattr__(self, attribute):
+                return getattr(self.struct, attribute)
+
+            def pack_into(self, buffer, offset, sequence, *fields):
+                stores.append((self.name, sequence))
+                self.struct.pack_into(buffer, offset, sequence, *fields)
+
+        with mock.patch.object(shmcache, 'SLOT', Recording('header', real_slot)), \
+                mock.patch.object(shmcache, '_SEQUENCE', Recording('sequence', real_sequence)):
+            cache.set('key', 'a much longer new value')
+            cache.touch('key', 60)
+            cache.delete('key')
+        self.assertTrue(stores)
+        for name, sequence in stores[:-1]:
+            if name == 'header':
+                self.assertEqual(sequence % 2, 1, f'Header published with an even sequence number: {stores}')
+        self.assertEqual(stores[-1], ('sequence', stores[-1][1]))
+        self.assertEqual(stores[-1][1] % 2, 0)
+
+    def test_clock_eviction_keeps_referenced_keys(self):
+        cache = self.make_cache(MAX_ENTRIES=4, STRIPES=1, WAYS=4)
+        cache.set('hot', 'hot')
+        for index in range(100):
+            self.assertEqual(cache.get('hot'), 'hot')
+            cache.set(f'cold{index}', index)
+        self.assertEqual(cache.get('cold99'), 99)
+        self.assertEqual(sum(cache.has_key(f'cold{index}') for index in range(100)), 3)
+        self.assertEqual(cache.stats()['used'], 4)
+
+    def test_processes_share_entries(self):
+        self.cache.set('parent', 1)
+        context = multiprocessing.get_context('fork')
+        child = context.Process(target=_shared_cache_child, args=(str(self.location),))
+        child.start()
+        child.join(10)
+        self.assertEqual(child.exitcode, 0)
+        self.assertEqual(self.cache.get('child'), 'hello')
+        self.assertEqual(self.cache.get('counter'), 1000)
+
+    def test_mismatched_file_is_replaced(self):
+        self.cache.set('key', 1)
+        resized = self.make_cache(SLOT_SIZE=1024)
+        self.assertIsNone(resized.get('key'))
+        resized.set('key', 2)
+        self.assertEqual(resized.get('key'), 2)
+
+
+def _shared_cache_child(location):
+    cache = SharedMemoryCache(location, {'OPTIONS': {'MAX_ENTRIES': 256, 'SLOT_SIZE': 512, 'STRIPES': 4}})
+    ok = cache.get('parent') == 1
+    cache.set('child', 'hello')
+    cache.set('counter', 0)
+    workers = [threading.Thread(target=lambda: [cache.incr('counter') for _ in range(250)]) for _ in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    os._exit(0 if ok else 1)
+
+
+@override_settings(CACHES=TEST_CACHES, API_CACHE={'WAIT_TIMEOUT': 0.1, 'POLL_INTERVAL': 0.01})
+class HotCacheTests(SimpleTestCase):
+    def setUp(self):
+        for alias in ('default', 'hot'):
+            caches[alias].clear()
+        caching.stats.reset()
+
+    def build(self, payload):
+        builder = mock.Mock(return_value=payload)
+        return caching.get_or_build(caching.POST_DETAIL, 1, builder), builder
+
+    def lock_key(self):
+        return f'hot:post:1:v{caching.get_version(caching.POST_DETAIL, 1)}:lock'
+
+    def test_bumped_version_moves_readers_to_a_new_key(self):
+        self.assertEqual(self.build('first')[0], 'first')
+        payload, builder = self.build('second')
+        self.assertEqual(payload, 'first')
+        builder.assert_not_called()
+        caching.bump_version(caching.POST_DETAIL, 1)
+        self.assertEqual(self.build('second')[0], 'second')
+        self.assertEqual(caching.stats.snapshot()['rebuilds'], 2)
+
+    def test_rebuild_lock_is_taken_on_the_lock_alias(self):
+        def builder():
+            self.assertTrue(caches['default'].has_key(self.lock_key()))
+            self.assertFalse(caches['hot'].has_key(self.lock_key()))
+            return 'payload'
+
+        self.assertEqual(caching.get_or_build(caching.POST_DETAIL, 1, builder), 'payload')
+        self.assertFalse(caches['default'].has_key(self.lock_key()))
+
+    def test_serves_stale_payload_while_another_worker_rebuilds(self):
+        self.build('old')
+        caching.bump_version(caching.POST_DETAIL, 1)
+        caches['default'].add(self.lock_key(), 1)
+        payload, builder = self.build('new')
+        self.assertEqual(payload, 'old')
+        builder.assert_not_called()
+        self.assertEqual(caching.stats.snapshot()['stale_hits'], 1)
+
+    def test_rebuilds_when_the_lock_holder_does_not_finish_in_time(self):
+        caches['default'].add(self.lock_key(), 1)
+        payload, builder = self.build('new')
+        self.assertEqual(payload, 'new')
+        builder.assert_called_once()
+
+    def run_workers(self, target, *args):
+        """
+        Run `target` in four forked workers sharing a file based 'hot' and a shared memory 'default' cache
+        """
+        scratch = tempfile.TemporaryDirectory()
+        self.addCleanup(scratch.cleanup)
+        directory = Path(scratch.name)
+        shared = {
+            'default': {'BACKEND': 'api.shmcache.SharedMemoryCache', 'LOCATION': directory / 'default.shm'},
+            'hot': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': directory / 'hot'},
+        }
+        context = multiprocessing.get_context('fork')
+        start = context.Event()
+        with override_settings(CACHES=shared, API_CACHE={'WAIT_TIMEOUT': 5.0}):
+            initial = caching.get_version(caching.POST_DETAIL, 1)
+            workers = [context.Process(target=target, args=(start, directory / 'log', *args)) for _ in range(4)]
+            for worker in workers:
+                worker.start()
+            start.set()
+            for worker in workers:
+                worker.join(10)
+            final = caching.get_version(caching.POST_DETAIL, 1)
+        self.assertEqual([worker.exitcode for worker in workers], [0] * 4)
+        return initial, final, (directory / 'log').read_text().split()
+
+    def test_workers_coalesce_on_one_rebuild(self):
+        _, _, builds = self.run_workers(_hot_cache_worker)
+        self.assertEqual(len(builds), 1)
+
+    def test_concurrent_bumps_never_reuse_a_version(self):
+        initial, final, versions = self.run_workers(_version_bump_worker, 50)
+        self.assertEqual(len(set(versions)), 200)
+        self.assertEqual(final, initial + 200)
+
+
+def _hot_cache_worker(start, log):
+    def builder():
+        with open(log, 'a') as builds:
+            builds.write(f'{os.getpid()}\n')
+        time.sleep(0.3)
+        return 'payload'
+
+    start.wait()
+    ok = caching.get_or_build(caching.POST_DETAIL, 1, builder) == 'payload'
+    os._exit(0 if ok else 1)
+
+
+def _version_bump_worker(start, log, bumps):
+    start.wait()
+    versions = [caching.bump_version(caching.POST_DETAIL, 1) for _ in range(bumps)]
+    with open(log, 'a') as bumped:
+        bumped.write(''.join(f'{version}\n' for version in versions))
+    os._exit(0)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class HotCacheBudgetTests(BudgetAssertionsMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.member = Member.objects.create(username='reader', email='reader@example.com', password='!')
+        cls.post = Post.objects.create(author=cls.member, content='Viral')
+        threads.fill_paths(Comment.objects.bulk_create([
+            Comment(post=cls.post, author=cls.member, content=f'Comment {i}') for i in range(10)
+        ]))
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.cookies['sessionid'] = create_session(self.member)
+
+    def test_warm_cache_skips_rebuild(self):
+        # Authentication, plus the live like state on post detail
+        for url, budget in (
+            (reverse('posts-detail-delete', args=[self.post.id]), 2),
+            (reverse('comments-list-create', args=[self.post.id]), 1),
+        ):
+            self.client.get(url)
+            self.assertWithinBudget(f'GET {url} (warm)', budget, lambda: self.client.get(url))
+
+    def test_new_comment_invalidates_thread(self):
+        url = reverse('comments-list-create', args=[self.post.id])
+        self.assertEqual(len(self.client.get(url).data['results']), 10)
+        self.client.post(url, {'content': 'Fresh'}, format='json')
+        self.assertEqual(len(self.client.get(url).data['results']), 11)
+
+
+@override_settings(CACHES=TEST_CACHES, LIKES={'FLUSH_EVERY': 1})
+class FragmentCacheTests(BudgetAssertionsMixin, TestCase):
+    CHECK_PLANS = True
+
+    @classmethod
+    def setUpTestData(cls):
+        Member.objects.bulk_create([
+            Member(username=f'writer{i}', email=f'writer{i}@example.com', password='!') for i in range(5)
+        ])
+        cls.members = list(Member.objects.order_by('id'))
+        # Content the renderer escapes or keeps as UTF-8
+        Post.objects.bulk_create([
+            Post(author=cls.members[i % 5], content=f'Post {i}: "quoted", \u2028 émoji 🎉') for i in range(30)
+        ])
+        cls.posts = list(Post.objects.order_by('id'))
+        Like.objects.bulk_create([Like(post=post, member=cls.members[0]) for post in cls.posts[::3]])
+        Post.objects.filter(id__in=[post.id for post in cls.posts[::3]]).update(likes_count=1)
+        ranking.refresh_scores()
+        # The profile page spans the archive
+        archive._archive_batch([post.id for post in cls.posts[1:10:5]])
+
+    def setUp(self):
+        # Hot feed snapshots are keyed by ids, which other test classes reuse
+        caches['hot'].clear()
+        self.client = APIClient()
+        self.client.cookies['sessionid'] = create_session(self.members[0])
+        self.urls = [
+            reverse('posts-list-create') + '?page_size=20',
+            reverse('posts-list-create') + '?sort=hot&page_size=20',
+            reverse('profile-posts', args=[self.members[1].id]),
+        ]
+
+    def serialized(self, url):
+        with self.settings(FRAGMENTS={'ENABLED': False}):
+            return self.client.get(url).content
+
+    def test_pages_match_the_serializers(self):
+        for url in self.urls:
+            expected = self.serialized(url)
+            self.assertEqual(self.client.get(url).content, expected, f'{url} (cold)')
+            self.assertEqual(self.client.get(url).content, expected, f'{url} (warm)')
+        # Other shapes and the browsable API still go through the serializers
+        self.assertNotIn(b'"author":{', self.client.get(self.urls[0] + '&shape=compact').content)
+        self.assertIn(b'<html', self.client.get(self.urls[0], HTTP_ACCEPT='text/html').content)
+
+    def test_warm_pages_skip_serialization(self):
+        # Authentication, counts, ids and versions, likes; a cold page also loads
+        # its posts with their authors (from posts and the archive on the profile).
+        # The hot feed reads its ranking watermark instead of a count, and builds its snapshot when cold
+        for url, cold, warm in zip(self.urls, (5, 5, 9), (4, 4, 7)):
+            self.assertWithinBudget(f'GET {url} (cold)', cold, lambda: self.client.get(url))
+            misses = fragments.stats.snapshot()['misses']
+            with mock.patch.object(fragments, 'PostSerializer', side_effect=AssertionError('serialized')):
+                self.assertWithinBudget(f'GET {url} (warm)', warm, lambda: self.client.get(url))
+            self.assertEqual(fragments.stats.snapshot()['misses'], misses)
+
+    def test_edits_move_to_new_fragments(self):
+        url = self.urls[2]
+        self.client.get(url)
+        member = self.members[1]
+        member.username = 'renamed'
+        member.save()
+        post = Post.objects.filter(author=member).first()
+        post.content = 'Edited'
+        post.save()
+        results = self.client.get(url).data['results']
+        self.assertEqual({item['author']['username'] for item in results}, {'renamed'})
+        self.assertIn('Edited', [item['content'] for item in results])
+        self.assertEqual(self.client.get(url).content, self.serialized(url))
+
+
+@override_settings(CACHES=TEST_CACHES, DEBUG=False)
+class AdminChangelistBudgetTests(BudgetAssertionsMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin_user = User.objects.create_superuser('root', 'root@example.com', 'pw')
+        Member.objects.bulk_create([
+            Member(username=f'author{i}', email=f'author{i}@example.com', password='!') for i in range(10)
+        ])
+        members = list(Member.objects.all())
+        Post.objects.bulk_create([
+            Post(author=members[i % len(members)], content=f'Post {i}') for i in range(150)
+        ])
+        posts = list(Post.objects.all())
+        threads.fill_paths(Comment.objects.bulk_create([
+            Comment(post=posts[i % len(posts)], author=members[i % len(members)], content=f'Comment {i}')
+            for i in range(150)
+        ]))
+
+    def setUp(self):
+        self.client.force_login(self.admin_user)
+
+    def test_changelists(self):
+        for model_admin, url in (
+            (PostAdmin, reverse('admin:api_post_changelist')),
+            (CommentAdmin, reverse('admin:api_comment_changelist')),
+        ):
+            for query in ('', '?q=author1', '?created_month=older', '?p=2'):
+                self.assertWithinBudget(
+                    f'GET {url}{query}', model_admin.changelist_query_budget,
+                    lambda: self.client.get(f'{url}{query}'),
+                )
+
+    def test_changelist_over_budget_is_logged_in_debug(self):
+        url = reverse('admin:api_post_changelist')
+        with self.settings(DEBUG=True), mock.patch.object(PostAdmin, 'changelist_query_budget', 1):
+            with self.assertLogs('api.admin', 'WARNING') as logs:
+                self.assertEqual(self.client.get(url).status_code, 200)
+        self.assertIn('Post changelist ran', logs.output[0])
+
+    def test_capped_count(self):
+        posts = Post.objects.order_by('id')
+        Post.objects.filter(id__in=[post.id for post in posts[10:30]]).delete()
+        with mock.patch.object(EstimatedCountPaginator, 'exact_count_limit', 100):
+            # Past the limit, deleted rows or not: the limit, shown as "100+"
+            with self.assertNumQueries(1):
+                count = EstimatedCountPaginator(posts, 20).count
+            self.assertEqual((count, str(count)), (100, '100+'))
+            self.assertEqual(EstimatedCountPaginator(posts, 20).num_pages, 5)
+            author = Member.objects.get(username='author0')
+            self.assertEqual(str(EstimatedCountPaginator(posts.filter(author=author), 20).count), '13')
+            self.assertContains(self.client.get(reverse('admin:api_post_changelist')), '100+ posts')
+        self.assertEqual(EstimatedCountPaginator(posts, 20).count, 130)
+
+    def test_created_month_filter(self):
+        member = Member.objects.get(username='author0')
+        dated = {
+            name: Post.objects.create(author=member, content=name, created_at=timezone.make_aware(when)).id
+            for name, when in (
+                ('this month', datetime(2025, 1, 10)),
+                ('new year eve', datetime(2024, 12, 31, 23, 59)),
+                ('oldest month', datetime(2024, 2, 1)),
+                ('older', datetime(2024, 1, 31, 23, 59)),
+            )
+        }
+        url = reverse('admin:api_post_changelist')
+        with mock.patch('django.utils.timezone.localdate', return_value=datetime(2025, 1, 15).date()):
+            choices = CreatedMonthFilter(None, {}, Post, None).lookup_choices
+            listed = {
+                value: set(self.client.get(f'{url}?created_month={value}').context['cl'].queryset
+                           .filter(id__in=dated.values()).values_list('content', flat=True))
+                for value in ('2025-01', '2024-12', '2024-02', 'older', '2024-13')
+            }
+        self.assertEqual((choices[0], choices[-2], choices[-1]), (
+            ('2025-01', 'January 2025'), ('2024-02', 'February 2024'), ('older', 'Older'),
+        ))
+        self.assertEqual(len(choices), 13)
+        self.assertEqual(listed, {
+            '2025-01': {'this month'},
+            '2024-12': {'new year eve'},
+            '2024-02': {'oldest month'},
+            'older': {'older'},
+            '2024-13': set(dated),
+        })
+
+    def test_delete_in_batches(self):
+        posts = list(Post.objects.order_by('id')[:3])
+        comments = list(Comment.objects.filter(post__in=posts))
+        other = Comment.objects.exclude(post__in=posts).order_by('id').first()
+        versions = {
+            (kind, post_id): caching.get_version(kind, post_id)
+            for kind, post_id in [(caching.POST_DETAIL, post.id) for post in posts]
+            + [(caching.COMMENT_THREAD, other.post_id)]
+        }
+        for model, selected in (('post', posts), ('comment', [other])):
+            response = self.client.post(reverse(f'admin:api_{model}_changelist'), {
+                'action': 'delete_in_batches', '_selected_action': [obj.id for obj in selected],
+            }, follow=True)
+            messages = [str(message) for message in response.context['messages']]
+            self.assertIn(f'Deleted {len(selected)} {model}s.', messages)
+            self.assertNotIn('delete_selected', response.context['cl'].model_admin.get_actions(response.wsgi_request))
+
+        self.assertFalse(Post.objects.filter(id__in=[post.id for post in posts]).exists())
+        self.assertFalse(Comment.objects.filter(id__in=[comment.id for comment in comments] + [other.id]).exists())
+        self.assertEqual(
+            set(Tombstone.objects.values_list('kind', 'object_id', 'post_id')),
+            {(Tombstone.POST, post.id, post.id) for post in posts} | {(Tombstone.COMMENT, other.id, other.post_id)},
+        )
+        for (kind, post_id), version in versions.items():
+            self.assertGreater(caching.get_version(kind, post_id), version)
+
+    def test_delete_in_batches_takes_whole_threads(self):
+        post = Post.objects.order_by('id').first()
+        tagging.index_posts([post])
+        root = Comment.objects.filter(post=post).first()
+        reply = Comment.objects.create(post=post, parent=root, author=root.author, content='Reply #gone')
+        threads.fill_paths([reply])
+        nested = Comment.objects.create(post=post, parent=reply, author=root.author, content='Nested')
+        threads.fill_paths([nested])
+        tagging.index_comments(Comment.objects.filter(id__in=[reply.id, nested.id]).select_related('post'))
+        version = caching.get_version(caching.COMMENT_THREAD, post.id)
+
+        response = self.client.post(reverse('admin:api_comment_changelist'), {
+            'action': 'delete_in_batches', '_selected_action': [root.id],
+        }, follow=True)
+        self.assertIn('Deleted 3 comments.', [str(message) for message in response.context['messages']])
+        self.assertEqual(
+            sorted(Tombstone.objects.values_list('object_id', flat=True)), sorted([root.id, reply.id, nested.id])
+        )
+        self.assertFalse(PostTag.objects.filter(post=post, tag__name='gone').exists())
+        self.assertGreater(caching.get_version(caching.COMMENT_THREAD, post.id), version)
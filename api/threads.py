@@ -0,0 +1,88 @@
+"""
+Threaded comment replies stored as materialized paths.
+
+Every comment stores `path`, the path of its parent followed by its own id as
+a fixed-width base-36 segment, and `depth` (0 for top-level comments). Sorting
+a post's comments by path therefore yields display order: each top-level
+comment followed by its replies, depth first, oldest first at every level. A
+subtree is the contiguous path range [path, path + '~'), so reading or
+deleting it is a single range scan of the (post, path) index.
+
+Paths are derived from ids, so they are filled right after the insert, see
+fill_paths().
+"""
+from django.db import models, router, transaction
+from django.db.models.deletion import ProtectedError, RestrictedError
+
+PATH_STEP = 8
+# Sorts after every segment character
+PATH_END = '~'
+MAX_DEPTH = 255 // PATH_STEP - 1
+
+_DIGITS = '0123456789abcdefghijklmnopqrstuvwxyz'
+
+
+def encode_segment(value):
+    digits = []
+    while value:
+        value, remainder = divmod(value, len(_DIGITS))
+        digits.append(_DIGITS[remainder])
+    return ''.join(reversed(digits)).rjust(PATH_STEP, '0')
+
+
+def subtree_bounds(path):
+    return path, path + PATH_END
+
+
+def subtree(comment):
+    """
+    The comment and all of its replies, in display order
+    """
+    start, end = subtree_bounds(comment.path)
+    return type(comment)._base_manager.filter(
+        post_id=comment.post_id, path__gte=start, path__lt=end
+    ).order_by('path')
+
+
+def fill_paths(comments):
+    """
+    Set path and depth of freshly inserted comments (ids assigned).
+
+    comment.parent must be loaded and already have its path, so replies must
+    come after their parents in `comments`.
+    """
+    comments = list(comments)
+    for comment in comments:
+        parent = comment.parent if comment.parent_id else None
+        comment.depth = parent.depth + 1 if parent else 0
+        comment.path = (parent.path if parent else '') + encode_segment(comment.id)
+    if len(comments) == 1:
+        comment = comments[0]
+        type(comment).objects.filter(pk=comment.pk).update(path=comment.path, depth=comment.depth)
+    elif comments:
+        type(comments[0]).objects.bulk_update(comments, ['path', 'depth'])
+
+
+def delete_subtree(comment):
+    """
+    Delete a comment and all of its replies with one range DELETE (plus one per
+    dependent table). Works for Comment and ArchivedComment. Returns the number
+    of comments deleted. Signals are not sent.
+    """
+    model = type(comment)
+    rows = subtree(comment).order_by()
+    using = router.db_for_write(model)
+    with transaction.atomic(using=using):
+        for rel in model._meta.related_objects:
+            if rel.related_model is model or rel.many_to_many:
+                # Replies are inside the range already
+                continue
+            related = rel.related_model._base_manager.filter(**{f'{rel.field.name}__in': rows.values('pk')})
+            if rel.on_delete is models.CASCADE:
+                related._raw_delete(using)
+            elif rel.on_delete is models.SET_NULL:
+                related.update(**{rel.field.name: None})
+            elif rel.on_delete is not models.DO_NOTHING and related.exists():
+                error = RestrictedError if rel.on_delete is models.RESTRICT else ProtectedError
+                raise error(f'{model.__name__} rows are referenced by {rel.related_model.__name__}', set())
+        return rows._raw_delete(using)
@@ -2,29 +2,57 @@ from django.urls import path
 from .views import (
     HelloView,
     RegisterView,
+    AvailabilityView,
     LoginView,
     LogoutView,
     MeView,
     PostListCreateView,
     PostDetailDeleteView,
+    PostLikeView,
     CommentListCreateView,
     CommentDeleteView,
     ProfileDetailView,
     ProfileUpdateView,
-    ProfilePostsView
+    ProfilePostsView,
+    TagPostsView,
+    MentionListView,
+    NotificationListView,
+    NotificationReadView,
+    NotificationUnreadCountView,
+    SyncView,
+    CacheStatsView,
+    MemoryStatsView,
+    QueryStatsView,
+    AdmissionStatsView,
+    RequestProfileListView,
+    RequestProfileDetailView
 )
 
 urlpatterns = [
     path("hello/", HelloView.as_view(), name="hello"),
     path("auth/register/", RegisterView.as_view(), name="auth-register"),
+    path("auth/availability/", AvailabilityView.as_view(), name="auth-availability"),
     path("auth/login/", LoginView.as_view(), name="auth-login"),
     path("auth/logout/", LogoutView.as_view(), name="auth-logout"),
     path("auth/me/", MeView.as_view(), name="auth-me"),
     path("posts/", PostListCreateView.as_view(), name="posts-list-create"),
     path("posts/<int:id>/", PostDetailDeleteView.as_view(), name="posts-detail-delete"),
+    path("posts/<int:id>/like/", PostLikeView.as_view(), name="posts-like"),
     path("posts/<int:post_id>/comments/", CommentListCreateView.as_view(), name="comments-list-create"),
     path("comments/<int:id>/", CommentDeleteView.as_view(), name="comments-delete"),
     path("profile/<int:id>/", ProfileDetailView.as_view(), name="profile-detail"),
     path("profile/", ProfileUpdateView.as_view(), name="profile-update"),
     path("profile/<int:id>/posts/", ProfilePostsView.as_view(), name="profile-posts"),
+    path("tags/<str:tag>/posts/", TagPostsView.as_view(), name="tags-posts"),
+    path("mentions/", MentionListView.as_view(), name="mentions-list"),
+    path("notifications/", NotificationListView.as_view(), name="notifications-list"),
+    path("notifications/read/", NotificationReadView.as_view(), name="notifications-read"),
+    path("notifications/unread-count/", NotificationUnreadCountView.as_view(), name="notifications-unread-count"),
+    path("sync/", SyncView.as_view(), name="sync"),
+    path("metrics/cache/", CacheStatsView.as_view(), name="metrics-cache"),
+    path("metrics/memory/", MemoryStatsView.as_view(), name="metrics-memory"),
+    path("metrics/queries/", QueryStatsView.as_view(), name="metrics-queries"),
+    path("metrics/admission/", AdmissionStatsView.as_view(), name="metrics-admission"),
+    path("metrics/profiles/", RequestProfileListView.as_view(), name="metrics-profiles"),
+    path("metrics/profiles/<str:profile_id>/", RequestProfileDetailView.as_view(), name="metrics-profile-detail"),
 ]
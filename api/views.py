@@ -2,13 +2,17 @@ from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.exceptions import NotAuthenticated
 from rest_framework.pagination import PageNumberPagination
 from django.utils import timezone
 from django.shortcuts import get_object_or_404
-from drf_spectacular.utils import extend_schema
+from django.db import transaction
+from django.db.models import Value
+from django.http import FileResponse
 from .serializers import (
     MessageSerializer,
     RegisterSerializer,
+    AvailabilitySerializer,
     LoginSerializer,
     MemberSerializer,
     PostSerializer,
@@ -16,10 +20,23 @@ from .serializers import (
     CommentSerializer,
     CommentCreateSerializer,
     ProfileSerializer,
-    ProfileUpdateSerializer
+    ProfileUpdateSerializer,
+    MentionSerializer,
+    NotificationSerializer,
+    NotificationReadSerializer,
+    MemoryArmSerializer
 )
-from .models import Member, Post, Comment
-from .authentication import CookieAuthentication, create_session, delete_session
+from .models import Member, Post, Comment, PostScore, ArchivedPost, ArchivedComment, PostTag, Mention, Notification
+from .authentication import CookieAuthentication, create_session, delete_session, session_member_id
+from .permissions import IsStaff
+from .schema import extend_schema, OpenApiParameter
+from .pagination import HotFeedPagination, KeysetPagination, ThreadPagination, InvalidCursor
+from . import (
+    admission, availability, caching, fragments, likes, memory, notifications, profiling, querylog, sync, tagging,
+    threads,
+)
+from .archive import ChainedQuerySets, get_post_or_archived
+from .shaping import ListShape, InvalidShape
 
 
 class HelloView(APIView):
@@ -85,6 +102,49 @@ class RegisterView(APIView):
         return response
 
 
+class AvailabilityView(APIView):
+    """
+    Whether a username and/or email can still be registered
+    """
+    authentication_classes = []
+    permission_classes = []
+
+    @extend_schema(
+        parameters=[
+            OpenApiParameter(
+                name='username',
+                type=str,
+                location=OpenApiParameter.QUERY,
+                description='Username to check',
+                required=False
+            ),
+            OpenApiParameter(
+                name='email',
+                type=str,
+                location=OpenApiParameter.QUERY,
+                description='Email to check',
+                required=False
+            ),
+        ],
+        responses={
+            200: {'description': 'Availability of each value given, e.g. {"username": true}'},
+            400: {'description': 'Validation errors'}
+        },
+        description="Check username/email availability (no DB query unless the value may be taken)"
+    )
+    def get(self, request):
+        serializer = AvailabilitySerializer(data=request.query_params)
+        if not serializer.is_valid():
+            return Response(
+                {
+                    "error": "Validation error",
+                    "details": serializer.errors
+                },
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return Response(availability.index.check(**serializer.validated_data), status=status.HTTP_200_OK)
+
+
 class LoginView(APIView):
     """
     Login user and create a session
@@ -205,6 +265,78 @@ class MeView(APIView):
         return Response(member_serializer.data, status=status.HTTP_200_OK)
 
 
+LIST_SHAPE_PARAMETERS = [
+    OpenApiParameter(
+        name='fields',
+        type=str,
+        location=OpenApiParameter.QUERY,
+        description='Comma-separated item fields to return (sparse fieldset)',
+        required=False
+    ),
+    OpenApiParameter(
+        name='member_fields',
+        type=str,
+        location=OpenApiParameter.QUERY,
+        description='Comma-separated author fields to return',
+        required=False
+    ),
+    OpenApiParameter(
+        name='shape',
+        type=str,
+        location=OpenApiParameter.QUERY,
+        enum=['default', 'compact'],
+        description='"compact" replaces nested authors with author_id plus an included.members map',
+        required=False
+    ),
+]
+
+
+def invalid_shape_response(error):
+    return Response(
+        {
+            "error": "Invalid fields",
+            "details": error.details
+        },
+        status=status.HTTP_400_BAD_REQUEST
+    )
+
+
+KEYSET_PARAMETERS = [
+    OpenApiParameter(
+        name='cursor',
+        type=str,
+        location=OpenApiParameter.QUERY,
+        description='Opaque cursor from the "next" link',
+        required=False
+    ),
+    OpenApiParameter(
+        name='page_size',
+        type=int,
+        location=OpenApiParameter.QUERY,
+        description='Number of items per page (max 100)',
+        required=False
+    ),
+]
+
+
+def invalid_cursor_response():
+    return Response(
+        {
+            "error": "Invalid cursor",
+            "details": {}
+        },
+        status=status.HTTP_400_BAD_REQUEST
+    )
+
+
+def shaped_page_response(paginator, shape, instances):
+    items, included = shape.serialize(instances)
+    response = paginator.get_paginated_response(items)
+    if included is not None:
+        response.data['included'] = included
+    return response
+
+
 class PostsPagination(PageNumberPagination):
     """
     Custom pagination for posts list
@@ -222,21 +354,68 @@ class PostListCreateView(APIView):
     permission_classes = [IsAuthenticated]
 
     @extend_schema(
+        parameters=[
+            OpenApiParameter(
+                name='sort',
+                type=str,
+                location=OpenApiParameter.QUERY,
+                enum=['new', 'hot'],
+                description='"new" (default) is newest first; "hot" ranks by recent comment activity',
+                required=False
+            ),
+            OpenApiParameter(
+                name='cursor',
+                type=str,
+                location=OpenApiParameter.QUERY,
+                description='Opaque cursor from the "next" link (sort=hot only)',
+                required=False
+            ),
+            *LIST_SHAPE_PARAMETERS,
+        ],
         responses={
             200: PostSerializer(many=True),
+            400: {'description': 'Invalid cursor or fields'},
             401: {'description': 'Unauthorized'}
         },
         description="Get paginated list of posts"
     )
     def get(self, request):
-        posts = Post.objects.all()
+        try:
+            shape = ListShape(request, PostSerializer)
+        except InvalidShape as error:
+            return invalid_shape_response(error)
+
+        if request.query_params.get('sort') == 'hot':
+            return self.get_hot(request, shape)
+
+        paginator = PostsPagination()
+        if fragments.applies(request, shape):
+            rows = paginator.paginate_queryset(fragments.page_values(Post.objects.all()), request)
+            return fragments.page_response(request, paginator, rows)
+
+        posts = Post.objects.select_related('author')
         
         # Apply pagination
-        paginator = PostsPagination()
         paginated_posts = paginator.paginate_queryset(posts, request)
         
-        serializer = PostSerializer(paginated_posts, many=True)
-        return paginator.get_paginated_response(serializer.data)
+        return shaped_page_response(paginator, shape, paginated_posts)
+
+    def get_hot(self, request, shape):
+        # Pinned to the ranking the scroll started on, so pages stay consistent while scores grow
+        paginator = HotFeedPagination()
+        use_fragments = fragments.applies(request, shape)
+        if use_fragments:
+            scores = fragments.page_values(PostScore.objects.all(), 'score', 'post_id', path='post__')
+        else:
+            scores = PostScore.objects.select_related('post__author')
+        try:
+            page = paginator.paginate_queryset(scores, request)
+        except InvalidCursor:
+            return invalid_cursor_response()
+
+        if use_fragments:
+            return fragments.page_response(request, paginator, page, path='post__')
+        return shaped_page_response(paginator, shape, [score.post for score in page])
 
     @extend_schema(
         request=PostCreateSerializer,
@@ -261,6 +440,7 @@ class PostListCreateView(APIView):
         
         # Create post with current user as author
         post = serializer.save(author=request.user)
+        tagging.index_posts([post])
         
         # Return full post data
         response_serializer = PostSerializer(post)
@@ -283,9 +463,15 @@ class PostDetailDeleteView(APIView):
         description="Get details of a specific post"
     )
     def get(self, request, id):
-        post = get_object_or_404(Post, id=id)
-        serializer = PostSerializer(post)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        def build():
+            return PostSerializer(get_post_or_archived(id)).data
+
+        data = caching.get_or_build(caching.POST_DETAIL, id, build)
+        # The cached payload is shared by everyone: add the live count and the viewer's like
+        state = likes.post_state(request.user, id)
+        if state is not None:
+            data = {**data, 'likes_count': state[0], 'liked_by_me': state[1]}
+        return Response(data, status=status.HTTP_200_OK)
 
     @extend_schema(
         responses={
@@ -297,10 +483,10 @@ class PostDetailDeleteView(APIView):
         description="Delete user's own post"
     )
     def delete(self, request, id):
-        post = get_object_or_404(Post, id=id)
+        post = Post.objects.filter(id=id).first() or get_object_or_404(ArchivedPost, id=id)
         
         # Check if user is the author
-        if post.author.id != request.user.id:
+        if post.author_id != request.user.id:
             return Response(
                 {
                     "error": "You do not have permission to delete this post",
@@ -309,10 +495,78 @@ class PostDetailDeleteView(APIView):
                 status=status.HTTP_403_FORBIDDEN
             )
         
-        post.delete()
+        with transaction.atomic():
+            post.delete()
+            sync.record_deleted_posts([id])
+        caching.invalidate_post(id)
+        notifications.forget_unread([post.author_id])
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
+class PostLikeView(APIView):
+    """
+    Like or unlike a post
+    """
+    authentication_classes = [CookieAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def get_likes_count(self, id):
+        """Stored likes count of a live post, or an error response"""
+        stored = Post.objects.filter(id=id).values_list('likes_count', flat=True).first()
+        if stored is None:
+            get_object_or_404(ArchivedPost, id=id)
+            return None, Response(
+                {
+                    "error": "Archived posts are read-only",
+                    "details": {}
+                },
+                status=status.HTTP_403_FORBIDDEN
+            )
+        return stored, None
+
+    @extend_schema(
+        request=None,
+        responses={
+            200: {'description': 'Already liked'},
+            201: {'description': 'Post liked'},
+            401: {'description': 'Unauthorized'},
+            403: {'description': 'Post is archived'},
+            404: {'description': 'Post not found'}
+        },
+        description="Like a post (idempotent)"
+    )
+    def post(self, request, id):
+        stored, error = self.get_likes_count(id)
+        if error:
+            return error
+
+        created = likes.like(request.user, id)
+        return Response(
+            {"liked": True, "likes_count": likes.approximate_count(id, stored)},
+            status=status.HTTP_201_CREATED if created else status.HTTP_200_OK
+        )
+
+    @extend_schema(
+        responses={
+            200: {'description': 'Post unliked (or was not liked)'},
+            401: {'description': 'Unauthorized'},
+            403: {'description': 'Post is archived'},
+            404: {'description': 'Post not found'}
+        },
+        description="Remove your like from a post (idempotent)"
+    )
+    def delete(self, request, id):
+        stored, error = self.get_likes_count(id)
+        if error:
+            return error
+
+        likes.unlike(request.user, id)
+        return Response(
+            {"liked": False, "likes_count": likes.approximate_count(id, stored)},
+            status=status.HTTP_200_OK
+        )
+
+
 class CommentListCreateView(APIView):
     """
     Get list of comments for a specific post or create a new comment
@@ -321,21 +575,51 @@ class CommentListCreateView(APIView):
     permission_classes = [IsAuthenticated]
 
     @extend_schema(
+        parameters=[*KEYSET_PARAMETERS, *LIST_SHAPE_PARAMETERS],
         responses={
             200: CommentSerializer(many=True),
+            400: {'description': 'Invalid cursor or fields'},
             401: {'description': 'Unauthorized'},
             404: {'description': 'Post not found'}
         },
-        description="Get list of comments for a specific post"
+        description="Get comment threads of a post, paginated by top-level comment, replies in display order"
     )
     def get(self, request, post_id):
-        # Check if post exists
-        post = get_object_or_404(Post, id=post_id)
-        
-        # Get all comments for this post
-        comments = Comment.objects.filter(post=post)
-        serializer = CommentSerializer(comments, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        try:
+            shape = ListShape(request, CommentSerializer)
+        except InvalidShape as error:
+            return invalid_shape_response(error)
+
+        paginator = ThreadPagination()
+
+        def build():
+            # Check if post exists (archived posts included)
+            post = get_post_or_archived(post_id)
+
+            # Whole threads of the page's top-level comments, in path order
+            page = paginator.paginate_queryset(post.comments.select_related('author'), request)
+            return {'cursor': paginator.next_cursor, 'results': CommentSerializer(page, many=True).data}
+
+        try:
+            if any(param in request.query_params for param in ('cursor', 'page_size')):
+                data = build()
+            else:
+                # Only the first page is cached; it is what almost every reader asks for
+                data = caching.get_or_build(caching.COMMENT_THREAD, post_id, build)
+        except InvalidCursor:
+            return invalid_cursor_response()
+
+        paginator.request = request
+        paginator.next_cursor = data['cursor']
+        if shape.is_default:
+            return paginator.get_paginated_response(data['results'])
+
+        # Reshape the default payload instead of serializing again
+        items, included = shape.reshape(data['results'])
+        response = paginator.get_paginated_response(items)
+        if included is not None:
+            response.data['included'] = included
+        return response
 
     @extend_schema(
         request=CommentCreateSerializer,
@@ -343,15 +627,25 @@ class CommentListCreateView(APIView):
             201: CommentSerializer,
             400: {'description': 'Validation errors'},
             401: {'description': 'Unauthorized'},
+            403: {'description': 'Post is archived'},
             404: {'description': 'Post not found'}
         },
         description="Create a new comment for a post"
     )
     def post(self, request, post_id):
         # Check if post exists
-        post = get_object_or_404(Post, id=post_id)
+        post = Post.objects.filter(id=post_id).first()
+        if post is None:
+            get_object_or_404(ArchivedPost, id=post_id)
+            return Response(
+                {
+                    "error": "Archived posts are read-only",
+                    "details": {}
+                },
+                status=status.HTTP_403_FORBIDDEN
+            )
         
-        serializer = CommentCreateSerializer(data=request.data)
+        serializer = CommentCreateSerializer(data=request.data, context={'post': post})
         
         if not serializer.is_valid():
             return Response(
@@ -364,6 +658,9 @@ class CommentListCreateView(APIView):
         
         # Create comment with current user as author
         comment = serializer.save(author=request.user, post=post)
+        tagging.index_comments([comment])
+        caching.invalidate_comments(post.id)
+        notifications.notify_comment(comment, post)
         
         # Return full comment data
         response_serializer = CommentSerializer(comment)
@@ -379,18 +676,18 @@ class CommentDeleteView(APIView):
 
     @extend_schema(
         responses={
-            204: {'description': 'Comment deleted successfully'},
+            204: {'description': 'Comment and its replies deleted successfully'},
             401: {'description': 'Unauthorized'},
             403: {'description': 'Forbidden - not the owner'},
             404: {'description': 'Comment not found'}
         },
-        description="Delete user's own comment"
+        description="Delete user's own comment together with all replies to it"
     )
     def delete(self, request, id):
-        comment = get_object_or_404(Comment, id=id)
+        comment = Comment.objects.filter(id=id).first() or get_object_or_404(ArchivedComment, id=id)
         
         # Check if user is the author
-        if comment.author.id != request.user.id:
+        if comment.author_id != request.user.id:
             return Response(
                 {
                     "error": "You do not have permission to delete this comment",
@@ -399,7 +696,13 @@ class CommentDeleteView(APIView):
                 status=status.HTTP_403_FORBIDDEN
             )
         
-        comment.delete()
+        # The comment and its replies are one path range, and every one of them gets a tombstone
+        with transaction.atomic():
+            deleted = list(threads.subtree(comment).values_list('id', 'content'))
+            threads.delete_subtree(comment)
+            sync.record_deleted_comments([(comment_id, comment.post_id) for comment_id, _ in deleted])
+            tagging.forget_comments(comment.post_id, [content for _, content in deleted])
+        caching.invalidate_comments(comment.post_id)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
@@ -467,23 +770,445 @@ class ProfilePostsView(APIView):
     permission_classes = [IsAuthenticated]
 
     @extend_schema(
+        parameters=LIST_SHAPE_PARAMETERS,
         responses={
             200: PostSerializer(many=True),
+            400: {'description': 'Invalid fields'},
             401: {'description': 'Not authenticated'},
             404: {'description': 'User not found'}
         },
         description="Returns paginated list of posts by a specific user"
     )
     def get(self, request, id):
+        try:
+            shape = ListShape(request, PostSerializer)
+        except InvalidShape as error:
+            return invalid_shape_response(error)
+
         # Check if user exists
         member = get_object_or_404(Member, id=id)
         
-        # Get all posts by this user
-        posts = Post.objects.filter(author=member)
+        paginator = PostsPagination()
+        if fragments.applies(request, shape):
+            rows = paginator.paginate_queryset(ChainedQuerySets(
+                fragments.page_values(Post.objects.filter(author=member)),
+                fragments.page_values(ArchivedPost.objects.filter(author=member), archived=Value(True)),
+            ), request)
+            return fragments.page_response(request, paginator, rows)
+
+        # Get all posts by this user: recent ones first, then the archive
+        posts = ChainedQuerySets(
+            Post.objects.filter(author=member).select_related('author'),
+            ArchivedPost.objects.filter(author=member).select_related('author'),
+        )
         
         # Apply pagination
-        paginator = PostsPagination()
         paginated_posts = paginator.paginate_queryset(posts, request)
         
-        serializer = PostSerializer(paginated_posts, many=True)
-        return paginator.get_paginated_response(serializer.data)
+        return shaped_page_response(paginator, shape, paginated_posts)
+
+
+class TagPostsView(APIView):
+    """
+    Get posts carrying a hashtag, newest first
+    """
+    authentication_classes = [CookieAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    @extend_schema(
+        parameters=[*KEYSET_PARAMETERS, *LIST_SHAPE_PARAMETERS],
+        responses={
+            200: PostSerializer(many=True),
+            400: {'description': 'Invalid cursor or fields'},
+            401: {'description': 'Not authenticated'}
+        },
+        description="Returns keyset-paginated posts tagged with #tag (case-insensitive)"
+    )
+    def get(self, request, tag):
+        try:
+            shape = ListShape(request, PostSerializer)
+        except InvalidShape as error:
+            return invalid_shape_response(error)
+
+        # Range scan of the (tag, created_at, post) index; unknown tags give an empty page
+        post_tags = PostTag.objects.filter(tag__name=tagging.normalize_tag(tag)).select_related('post__author')
+        paginator = KeysetPagination(keys=('created_at', 'post_id'))
+        try:
+            page = paginator.paginate_queryset(post_tags, request)
+        except InvalidCursor:
+            return invalid_cursor_response()
+
+        return shaped_page_response(paginator, shape, [post_tag.post for post_tag in page])
+
+
+class MentionListView(APIView):
+    """
+    Get posts and comments that mention the current user, newest first
+    """
+    authentication_classes = [CookieAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    @extend_schema(
+        parameters=KEYSET_PARAMETERS,
+        responses={
+            200: MentionSerializer(many=True),
+            400: {'description': 'Invalid cursor'},
+            401: {'description': 'Not authenticated'}
+        },
+        description="Returns keyset-paginated mentions of the current user"
+    )
+    def get(self, request):
+        mentions = Mention.objects.filter(member=request.user).select_related('post__author', 'comment__author')
+        paginator = KeysetPagination(keys=('created_at', 'id'))
+        try:
+            page = paginator.paginate_queryset(mentions, request)
+        except InvalidCursor:
+            return invalid_cursor_response()
+
+        context = {
+            'request': request,
+            'liked_post_ids': likes.liked_post_ids(request.user, [mention.post_id for mention in page]),
+        }
+        return paginator.get_paginated_response(MentionSerializer(page, many=True, context=context).data)
+
+
+class NotificationListView(APIView):
+    """
+    Get the current user's notifications, most recently updated first
+    """
+    authentication_classes = [CookieAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    @extend_schema(
+        parameters=KEYSET_PARAMETERS,
+        responses={
+            200: NotificationSerializer(many=True),
+            400: {'description': 'Invalid cursor'},
+            401: {'description': 'Not authenticated'}
+        },
+        description="Returns the keyset-paginated notification inbox of the current user"
+    )
+    def get(self, request):
+        inbox = Notification.objects.filter(recipient=request.user).select_related('actor')
+        paginator = KeysetPagination(keys=('updated_at', 'id'))
+        try:
+            page = paginator.paginate_queryset(inbox, request)
+        except InvalidCursor:
+            return invalid_cursor_response()
+        return paginator.get_paginated_response(NotificationSerializer(page, many=True).data)
+
+
+class NotificationReadView(APIView):
+    """
+    Mark notifications of the current user as read
+    """
+    authentication_classes = [CookieAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    @extend_schema(
+        request=NotificationReadSerializer,
+        responses={
+            200: {'description': 'Number of notifications marked and the new unread count'},
+            400: {'description': 'Validation error'},
+            401: {'description': 'Not authenticated'}
+        },
+        description="Mark the given notifications, or all of them, as read"
+    )
+    def post(self, request):
+        serializer = NotificationReadSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(
+                {
+                    "error": "Validation error",
+                    "details": serializer.errors
+                },
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        marked = notifications.mark_read(request.user, serializer.validated_data.get('ids'))
+        return Response(
+            {
+                "marked": marked,
+                "unread_count": notifications.unread_count(request.user.id)
+            },
+            status=status.HTTP_200_OK
+        )
+
+
+class NotificationUnreadCountView(APIView):
+    """
+    Unread notification count for the header badge.
+
+    Polled on every page, so the member is not loaded: the session and the
+    count both come from the cache.
+    """
+    authentication_classes = []
+    permission_classes = []
+
+    @extend_schema(
+        responses={
+            200: {'description': 'Number of unread notifications'},
+            401: {'description': 'Not authenticated'}
+        },
+        description="Get the current user's unread notification count"
+    )
+    def get(self, request):
+        member_id = session_member_id(request)
+        if not member_id:
+            raise NotAuthenticated()
+        return Response({"unread_count": notifications.unread_count(member_id)}, status=status.HTTP_200_OK)
+
+
+class SyncView(APIView):
+    """
+    Posts and comments changed since a client's last refresh
+    """
+    authentication_classes = [CookieAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    @extend_schema(
+        parameters=[
+            OpenApiParameter(name='since', type=str, required=False,
+                             description='Mark returned by the previous sync; omit to get a first mark'),
+            OpenApiParameter(name='post_id', type=int, required=False,
+                             description='Also sync the comments of this post'),
+        ],
+        responses={
+            200: {'description': 'Changed posts and comments, deleted ids and the next mark'},
+            400: {'description': 'Invalid mark or post_id'},
+            401: {'description': 'Not authenticated'}
+        },
+        description="Returns posts (and comments of post_id) created, updated or deleted since the given mark"
+    )
+    def get(self, request):
+        token = request.query_params.get('since')
+        post_id = request.query_params.get('post_id')
+        if post_id is not None:
+            try:
+                post_id = int(post_id)
+            except ValueError:
+                return Response(
+                    {
+                        "error": "Validation error",
+                        "details": {"post_id": ["A valid integer is required."]}
+                    },
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+        try:
+            since = sync.decode_mark(token) if token else None
+        except InvalidCursor:
+            return invalid_cursor_response()
+
+        mark, changed = sync.changes(since, post_id)
+        if changed is None:
+            # Too old, too much changed, or first sync: refetch the pages
+            return Response(
+                {"since": sync.encode_mark(mark), "reset": True},
+                status=status.HTTP_200_OK
+            )
+        context = {'request': request}
+        return Response(
+            {
+                "since": sync.encode_mark(mark),
+                "reset": False,
+                "posts": PostSerializer(changed['posts'], many=True, context=context).data,
+                "comments": CommentSerializer(changed['comments'], many=True).data,
+                "deleted": {
+                    "posts": changed['deleted_posts'],
+                    "comments": changed['deleted_comments']
+                }
+            },
+            status=status.HTTP_200_OK
+        )
+
+
+class CacheStatsView(APIView):
+    """
+    Hot cache and feed fragment counters of the worker that serves the request (staff only)
+    """
+    authentication_classes = [CookieAuthentication]
+    permission_classes = [IsAuthenticated, IsStaff]
+
+    @extend_schema(
+        responses={
+            200: {'description': 'Hit ratio and rebuild latency of this worker'},
+            401: {'description': 'Not authenticated'},
+            403: {'description': 'Staff only'}
+        },
+        description="Get hot post/comment cache and feed fragment statistics for the current worker"
+    )
+    def get(self, request):
+        return Response(
+            {**caching.stats.snapshot(), 'fragments': fragments.stats.snapshot()}, status=status.HTTP_200_OK
+        )
+
+
+class MemoryStatsView(APIView):
+    """
+    Memory usage and leak suspects of the worker that serves the request (staff only)
+    """
+    authentication_classes = [CookieAuthentication]
+    permission_classes = [IsAuthenticated, IsStaff]
+
+    @extend_schema(
+        responses={
+            200: {'description': 'RSS/heap samples, per-route retained heap and allocation sites'},
+            401: {'description': 'Not authenticated'},
+            403: {'description': 'Staff only'}
+        },
+        description="Get memory instrumentation report for the current worker"
+    )
+    def get(self, request):
+        include_diff = request.query_params.get('diff') == '1'
+        return Response(memory.monitor.report(include_global_diff=include_diff), status=status.HTTP_200_OK)
+
+    @extend_schema(
+        request=MemoryArmSerializer,
+        responses={
+            202: {'description': 'Snapshot diff armed for the next request of each route'},
+            400: {'description': 'Validation error, or memory profiling disabled'},
+            401: {'description': 'Not authenticated'},
+            403: {'description': 'Staff only'}
+        },
+        description="Capture tracemalloc snapshot diffs on the next request of each route"
+    )
+    def post(self, request):
+        if not memory.get_config()['ENABLED']:
+            return Response(
+                {
+                    "error": "Memory profiling is disabled",
+                    "details": {}
+                },
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        serializer = MemoryArmSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(
+                {
+                    "error": "Validation error",
+                    "details": serializer.errors
+                },
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        memory.monitor.arm(serializer.validated_data.get('routes') or None)
+        return Response({"message": "Snapshot armed"}, status=status.HTTP_202_ACCEPTED)
+
+
+class QueryStatsView(APIView):
+    """
+    Slow-query log merged across workers (staff only)
+    """
+    authentication_classes = [CookieAuthentication]
+    permission_classes = [IsAuthenticated, IsStaff]
+
+    @extend_schema(
+        parameters=[
+            OpenApiParameter(
+                name='sort',
+                type=str,
+                location=OpenApiParameter.QUERY,
+                enum=['total_ms', 'mean_ms', 'p95_ms', 'max_ms', 'count', 'slow_count'],
+                description='Fingerprint ordering (default total_ms)',
+                required=False
+            ),
+        ],
+        responses={
+            200: {'description': 'Per-fingerprint latency stats and recent slow queries with plans'},
+            401: {'description': 'Not authenticated'},
+            403: {'description': 'Staff only'}
+        },
+        description="Get SQL fingerprint stats and captured slow queries"
+    )
+    def get(self, request):
+        sort = request.query_params.get('sort', 'total_ms')
+        if sort not in ('total_ms', 'mean_ms', 'p95_ms', 'max_ms', 'count', 'slow_count'):
+            sort = 'total_ms'
+        querylog.logger.maybe_flush(force=True)
+        return Response(querylog.merged_report(sort=sort), status=status.HTTP_200_OK)
+
+
+class AdmissionStatsView(APIView):
+    """
+    Load-shedding state and counters of every live worker (staff only)
+    """
+    authentication_classes = [CookieAuthentication]
+    permission_classes = [IsAuthenticated, IsStaff]
+
+    @extend_schema(
+        responses={
+            200: {'description': 'In-flight requests, queue delay and admitted/shed/expired counts per priority'},
+            401: {'description': 'Not authenticated'},
+            403: {'description': 'Staff only'}
+        },
+        description="Get admission control (load shedding) statistics"
+    )
+    def get(self, request):
+        return Response(admission.snapshot(), status=status.HTTP_200_OK)
+
+
+class RequestProfileListView(APIView):
+    """
+    Stored per-request profiles from all workers, newest first (staff only)
+    """
+    authentication_classes = [CookieAuthentication]
+    permission_classes = [IsAuthenticated, IsStaff]
+
+    @extend_schema(
+        responses={
+            200: {'description': 'Profile summaries: route, status, timings and query counts'},
+            401: {'description': 'Not authenticated'},
+            403: {'description': 'Staff only'}
+        },
+        description='List profiles of requests sent by staff with the "X-Profile" header'
+    )
+    def get(self, request):
+        return Response({'results': profiling.list_profiles()}, status=status.HTTP_200_OK)
+
+
+class RequestProfileDetailView(APIView):
+    """
+    One stored request profile (staff only)
+    """
+    authentication_classes = [CookieAuthentication]
+    permission_classes = [IsAuthenticated, IsStaff]
+
+    @extend_schema(
+        parameters=[
+            OpenApiParameter(
+                name='raw',
+                type=bool,
+                location=OpenApiParameter.QUERY,
+                description='Download the raw pstats (.prof) or folded stacks (.folded) file',
+                required=False
+            ),
+        ],
+        responses={
+            200: {'description': 'SQL timeline plus top functions (cProfile) or folded stacks (sampling)'},
+            401: {'description': 'Not authenticated'},
+            403: {'description': 'Staff only'},
+            404: {'description': 'Profile not found'}
+        },
+        description="Get a request profile"
+    )
+    def get(self, request, profile_id):
+        profile, raw = profiling.load(profile_id)
+        if profile is None:
+            return Response(
+                {
+                    "error": "Profile not found",
+                    "details": {}
+                },
+                status=status.HTTP_404_NOT_FOUND
+            )
+        if request.query_params.get('raw') in ('1', 'true'):
+            if not raw.exists():
+                return Response(
+                    {
+                        "error": "Raw profile file is missing",
+                        "details": {}
+                    },
+                    status=status.HTTP_404_NOT_FOUND
+                )
+            return FileResponse(open(raw, 'rb'), as_attachment=True, filename=raw.name)
+        return Response(profile, status=status.HTTP_200_OK)
@@ -0,0 +1,41 @@
+"""
+Warm-up hooks for gunicorn (see gunicorn.conf.py).
+
+warm_imports() runs once in the master after the preloaded app is loaded, so
+every forked worker inherits the URLconf, views, serializers and DRF settings
+instead of importing them on its first request. warm_worker() runs in each
+worker right after fork, before it accepts traffic, and opens the per-process
+resources that must not be shared across fork (DB connection, caches).
+"""
+from django.conf import settings
+
+
+def warm_imports():
+    from django.urls import get_resolver
+    from rest_framework.settings import api_settings
+
+    resolver = get_resolver()
+    # Imports config.urls -> api.urls -> api.views and builds the reverse map
+    resolver.reverse_dict
+    for name in (
+        'DEFAULT_RENDERER_CLASSES',
+        'DEFAULT_PARSER_CLASSES',
+        'DEFAULT_AUTHENTICATION_CLASSES',
+        'DEFAULT_PERMISSION_CLASSES',
+        'DEFAULT_CONTENT_NEGOTIATION_CLASS',
+        'EXCEPTION_HANDLER',
+    ):
+        getattr(api_settings, name)
+
+
+def warm_worker():
+    from django.core.cache import caches
+    from django.db import connection
+
+    from api.models import Post
+
+    connection.ensure_connection()
+    # Pull the first feed page's index and table pages into SQLite's page cache
+    list(Post.objects.values_list('id', flat=True)[:10])
+    for alias in settings.CACHES:
+        caches[alias]
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
 import os
+import sys
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -63,13 +64,101 @@ SESSION_COOKIE_AGE = 30 * 24 * 60 * 60  # 30 days
 
 # Cache configuration for session storage
 CACHES = {
+    # Sessions and small entries; one memory-mapped table shared by every
+    # gunicorn worker on the host (api/shmcache.py)
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-        'LOCATION': 'unique-snowflake',
+        'BACKEND': 'api.shmcache.SharedMemoryCache',
+        'LOCATION': BASE_DIR / 'persistent' / 'cache' / 'default.shm',
         'OPTIONS': {
-            'MAX_ENTRIES': 10000
+            'MAX_ENTRIES': 10000,
+            'SLOT_SIZE': 1024,
         }
-    }
+    },
+    # Hot post/comment payloads; file-based so that every gunicorn worker on
+    # the host sees the same versions and invalidations
+    'hot': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'persistent' / 'cache' / 'hot',
+        'TIMEOUT': 300,
+        'OPTIONS': {
+            'MAX_ENTRIES': 20000
+        }
+    },
+    # Rendered post and member JSON for feed pages (api/fragments.py); posts
+    # whose JSON does not fit a slot even compressed are serialized every time
+    'fragments': {
+        'BACKEND': 'api.shmcache.SharedMemoryCache',
+        'LOCATION': BASE_DIR / 'persistent' / 'cache' / 'fragments.shm',
+        'OPTIONS': {
+            'MAX_ENTRIES': 20000,
+            'SLOT_SIZE': 2048,
+        }
+    },
+}
+
+# Versioned cache-aside layer for post detail and comment threads (api/caching.py)
+API_CACHE = {
+    'ENABLED': os.environ.get('API_CACHE_ENABLED', '1') == '1',
+    'ALIAS': 'hot',
+    # Rebuild locks and version counters need an atomic add() and incr() across workers; see api/caching.py
+    'LOCK_ALIAS': 'default',
+    'TIMEOUT': 300,
+    'STALE_TIMEOUT': 3600,
+    'LOCK_TIMEOUT': 10,
+    'WAIT_TIMEOUT': 2.0,
+}
+
+# Hot feed ranking (api/ranking.py), refreshed by `manage.py refresh_post_scores --loop`
+HOT_FEED = {
+    'HALF_LIFE_HOURS': 12,
+    'BATCH_SIZE': 1000,
+    'REFRESH_INTERVAL': 60,
+    # Scroll sessions page through a snapshot of the top of the ranking, cached per refresh
+    'SNAPSHOT_SIZE': 1000,
+    'SNAPSHOT_ALIAS': 'hot',
+}
+
+# Hot/cold archival (api/archive.py), run by `manage.py archive_posts --loop`
+ARCHIVE = {
+    'AFTER_DAYS': int(os.environ.get('ARCHIVE_AFTER_DAYS', '365')),
+    'BATCH_SIZE': 200,
+    'PAUSE': 0.05,
+    'INTERVAL': 3600,
+}
+
+# Post likes (api/likes.py): per-worker buffered counters, reconciled by
+# `manage.py reconcile_like_counts --loop`
+LIKES = {
+    'FLUSH_EVERY': 50,
+    'FLUSH_INTERVAL': 2.0,
+    'RECONCILE_INTERVAL': 600,
+    'RECONCILE_BATCH_SIZE': 1000,
+}
+
+# Notification inbox (api/notifications.py); unread counts live in the hot cache
+NOTIFICATIONS = {
+    # Unread counts are adjusted with incr(): the shared memory cache does that atomically
+    'ALIAS': 'default',
+    'UNREAD_TIMEOUT': 300,
+    'MAX_MARK_READ': 100,
+}
+
+# Delta sync (api/sync.py); tombstones pruned by `manage.py prune_tombstones --loop`
+SYNC = {
+    'LIMIT': 200,
+    'SETTLE_SECONDS': 2,
+    'TOMBSTONE_RETENTION_DAYS': 7,
+    'PRUNE_INTERVAL': 3600,
+}
+
+# Online snapshots of the SQLite database (api/backup.py), taken by
+# `manage.py backup --loop`; restore with `manage.py restore`
+BACKUP = {
+    'DIRECTORY': BASE_DIR / 'persistent' / 'backups',
+    'KEEP': 14,
+    'PAGES_PER_STEP': 128,
+    'STEP_SLEEP': 0.02,
+    'INTERVAL': 6 * 3600,
 }
 
 # Application definition
@@ -83,14 +172,18 @@ INSTALLED_APPS = [
     "django.contrib.staticfiles",
     # Third party
     "rest_framework",
-    "drf_spectacular",
     # Local
     "api",
 ]
 
+# The OpenAPI schema is generated once at image build time and served by nginx,
+# so drf-spectacular is only loaded by `manage.py spectacular`
+SCHEMA_BUILD = os.environ.get("DJANGO_SCHEMA_BUILD") == "1" or "spectacular" in sys.argv[1:2]
+if SCHEMA_BUILD:
+    INSTALLED_APPS.insert(INSTALLED_APPS.index("api"), "drf_spectacular")
+
 # REST Framework configuration
 REST_FRAMEWORK = {
-    "DEFAULT_SCHEMA_CLASS": "drf_spectacular.openapi.AutoSchema",
     "DEFAULT_AUTHENTICATION_CLASSES": [
         "api.authentication.CookieAuthentication",
     ],
@@ -98,6 +191,8 @@ REST_FRAMEWORK = {
         "rest_framework.permissions.IsAuthenticated",
     ],
 }
+if SCHEMA_BUILD:
+    REST_FRAMEWORK["DEFAULT_SCHEMA_CLASS"] = "drf_spectacular.openapi.AutoSchema"
 
 # drf-spectacular configuration
 SPECTACULAR_SETTINGS = {
@@ -108,6 +203,7 @@ SPECTACULAR_SETTINGS = {
 }
 
 MIDDLEWARE = [
+    "api.middleware.AdmissionControlMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -115,8 +211,60 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "api.middleware.MemoryProfilingMiddleware",
+    "api.middleware.SlowQueryLogMiddleware",
+    "api.middleware.RequestProfilerMiddleware",
 ]
 
+# Opt-in SQL fingerprinting and slow-query capture (api/querylog.py);
+# report via `manage.py slow_queries` or /api/metrics/queries/
+SLOW_QUERY_LOG = {
+    "ENABLED": os.environ.get("SLOW_QUERY_LOG") == "1",
+    "SAMPLE_RATE": float(os.environ.get("SLOW_QUERY_SAMPLE_RATE", "0.1")),
+    "THRESHOLD_MS": 100,
+    "DIRECTORY": BASE_DIR / "persistent" / "querylog",
+}
+
+# Opt-in per-worker heap tracing (api/memory.py); report at /api/metrics/memory/
+MEMORY_PROFILING = {
+    "ENABLED": os.environ.get("MEMORY_PROFILING") == "1",
+    "FRAMES": 10,
+    "SAMPLE_EVERY": 100,
+    "ROUTE_THRESHOLD_BYTES": 5 * 1024 * 1024,
+}
+
+# Pre-rendered post and member JSON for the feed and profile pages (api/fragments.py)
+FRAGMENTS = {
+    "ENABLED": os.environ.get("FRAGMENTS_ENABLED", "1") == "1",
+    "ALIAS": "fragments",
+    "TIMEOUT": 3600,
+}
+
+# Per-worker Bloom filter behind /api/auth/availability/ (api/availability.py)
+AVAILABILITY = {
+    "FALSE_POSITIVE_RATE": 0.001,
+    "REBUILD_INTERVAL": 900,
+}
+
+# Load shedding when requests queue up in front of the workers (api/admission.py);
+# needs the X-Request-Start header set by nginx. Report at /api/metrics/admission/
+ADMISSION = {
+    "ENABLED": os.environ.get("ADMISSION_CONTROL", "1") == "1",
+    "LOCATION": BASE_DIR / "persistent" / "cache" / "admission.shm",
+    "TARGET_QUEUE_MS": {"low": 250, "normal": 1000, "critical": 5000},
+    "DEFAULT_DEADLINE_SECONDS": 60,
+    "RETRY_AFTER": 5,
+}
+
+# Staff-only per-request profiles (api/profiling.py): send "X-Profile: 1" for
+# cProfile or "X-Profile: sample" for a flame graph; listed at /api/metrics/profiles/
+PROFILER = {
+    "ENABLED": os.environ.get("REQUEST_PROFILER", "1") == "1",
+    "SAMPLE_INTERVAL": 0.001,
+    "KEEP": 100,
+    "DIRECTORY": BASE_DIR / "persistent" / "profiles",
+}
+
 ROOT_URLCONF = "config.urls"
 
 TEMPLATES = [
@@ -144,6 +292,13 @@ DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": BASE_DIR / "persistent" / "db" / "db.sqlite3",
+        # Keep the connection opened by the post-fork warm-up for the worker's lifetime
+        "CONN_MAX_AGE": None,
+        "CONN_HEALTH_CHECKS": True,
+        "OPTIONS": {
+            # Readers, including online backups (api/backup.py), never block the writer
+            "init_command": "PRAGMA journal_mode=WAL;",
+        },
     }
 }
 
@@ -6,15 +6,21 @@ echo "==> Django Pre-Start Script"
 # Remove existing database for fresh start on each deploy
 echo "==> Removing existing database..."
 if [ -f "/app/persistent/db/db.sqlite3" ]; then
-    rm -f /app/persistent/db/db.sqlite3
+    # A stale write-ahead log must not be replayed into the new database
+    rm -f /app/persistent/db/db.sqlite3 /app/persistent/db/db.sqlite3-wal /app/persistent/db/db.sqlite3-shm
     echo "==> Database removed successfully"
 else
     echo "==> No existing database found, creating new one"
 fi
 
+# Cached payloads are keyed by row ids, which restart with the fresh database
+rm -rf /app/persistent/cache
+
 # Create persistent dirs
 /bin/mkdir -p /app/persistent/db
 /bin/mkdir -p /app/persistent/media
+/bin/mkdir -p /app/persistent/cache
+/bin/mkdir -p /app/persistent/backups
 
 # Run migrations
 echo "==> Running database migrations..."
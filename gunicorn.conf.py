@@ -1,5 +1,7 @@
 """Gunicorn configuration for Docker deployment"""
 
+import os
+
 # Server socket - bind to different port for nginx upstream
 bind = "127.0.0.1:8001"
 
@@ -7,8 +9,9 @@ bind = "127.0.0.1:8001"
 workers = 2
 worker_class = "sync"
 worker_connections = 1000
-max_requests = 10000
-max_requests_jitter = 1000
+# Workers are recycled on memory growth (see post_request), not request count
+max_requests = 0
+worker_max_rss_mb = int(os.environ.get("WORKER_MAX_RSS_MB", "512"))
 
 # Timeouts
 timeout = 300
@@ -36,3 +39,46 @@ limit_request_field_size = 8190
 
 # Preload app for better performance
 preload_app = True
+
+
+# Warm-up hooks (api/warmup.py)
+def when_ready(server):
+    # Master process, after the preloaded app is imported and before workers fork
+    from api.warmup import warm_imports
+
+    warm_imports()
+
+
+def post_fork(server, worker):
+    # Worker process, before it starts accepting connections
+    from api.warmup import warm_worker
+
+    try:
+        warm_worker()
+    except Exception:
+        worker.log.exception("Worker warm-up failed, continuing cold")
+
+
+def post_request(worker, req, environ, resp):
+    # Finish the current request, then let the master replace this worker
+    from api.memory import current_rss_bytes
+
+    rss_mb = current_rss_bytes() / (1024 * 1024)
+    if worker.alive and rss_mb > worker_max_rss_mb:
+        worker.log.info(
+            "Worker %s RSS %.0f MB exceeds %d MB, recycling", worker.pid, rss_mb, worker_max_rss_mb
+        )
+        worker.alive = False
+
+
+def worker_exit(server, worker):
+    # Buffered like counts and queued notifications must not be lost when a
+    # worker is recycled or stopped
+    from api.likes import counter
+    from api.notifications import deliver_pending
+
+    try:
+        counter.flush()
+    except Exception:
+        worker.log.exception("Flushing like counts on exit failed")
+    deliver_pending()